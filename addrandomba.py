@@ -1,11 +1,17 @@
 """
 サンプルデータ投入
-python addrandomba.py
+python addrandomba.py           # 既存のデータはそのままで、スタンド3か所・各5台とユーザー2人を追加する
+python addrandomba.py --reset   # 全テーブルを作り直してから同じ規模で投入する（generate_data.generate）
+
+スタンド3か所・各5台だけの最小構成（貸出履歴なし）。
 """
-import random, string
+import random, string, sys
 from db import engine, get_session
-from models import Base, Station, Battery, User
-from variables import RENTAL_DEPOSIT_CENTS
+from models import Base, Station, Battery, User, ChargeHistory
+from auth import hash_password
+from generate_data import generate, DEFAULT_PASSWORD
+
+BATTERIES_PER_STATION = 5
 
 def random_serial(n=8):
     return "".join(random.choices(string.ascii_uppercase + string.digits, k=n))
@@ -14,25 +20,32 @@ def seed():
     Base.metadata.create_all(bind=engine)
     session = get_session()
     try:
-        # Stations
+        # Stations（在庫カウンタは追加するバッテリーの台数）
         stations = [
-            ("Central Station", 35.681236, 139.767125, "Tokyo"),
-            ("North Station", 43.06417, 141.34694, "Sapporo"),
-            ("South Station", 34.693738, 135.502165, "Osaka"),
+            Station(name=name, lat=lat, lng=lng, location=loc, available_count=BATTERIES_PER_STATION)
+            for name, lat, lng, loc in [
+                ("Central Station", 35.681236, 139.767125, "Tokyo"),
+                ("North Station", 43.06417, 141.34694, "Sapporo"),
+                ("South Station", 34.693738, 135.502165, "Osaka"),
+            ]
         ]
-        for name, lat, lng, loc in stations:
-            session.add(Station(name=name, lat=lat, lng=lng, location=loc))
+        session.add_all(stations)
         # Users
+        password_hash = hash_password(DEFAULT_PASSWORD)
         users = [
-            User(email="alice@example.com", password_hash="$2b$12$invalid", balance_cents=5000),  # パスワード上書きし直してください
-            User(email="bob@example.com", password_hash="$2b$12$invalid", balance_cents=200),
+            User(email="alice@example.com", password_hash=password_hash, balance_cents=5000),
+            User(email="bob@example.com", password_hash=password_hash, balance_cents=200),
         ]
         session.add_all(users)
-        session.commit()
+        session.flush()
+        # 初期残高はチャージとして台帳に記録する（台帳の合計 = 残高。generate_data と同じ）
+        session.add_all([
+            ChargeHistory(user_id=u.id, amount_cents=u.balance_cents, kind="charge")
+            for u in users
+        ])
 
-        sts = session.query(Station).all()
-        for st in sts:
-            for i in range(5):
+        for st in stations:
+            for i in range(BATTERIES_PER_STATION):
                 session.add(Battery(serial=random_serial(), station_id=st.id, available=True, battery_level=random.randint(40,100)))
         session.commit()
         print("Seed finished.")
@@ -42,5 +55,17 @@ def seed():
     finally:
         session.close()
 
+def reset_and_seed():
+    print("⚠️ 全テーブルを削除して作り直します")
+    try:
+        generate(users=2, stations=3, batteries_per_station=BATTERIES_PER_STATION, rentals_per_user=0,
+                 ongoing_ratio=0, verbose=False)
+        print("Seed finished.")
+    except Exception as e:
+        print("Seed failed:", e)
+
 if __name__ == "__main__":
-    seed()
+    if "--reset" in sys.argv[1:]:
+        reset_and_seed()
+    else:
+        seed()
@@ -1,19 +1,53 @@
 """
 DB初期化用スクリプト:
 python admin.py init_db
+python admin.py migrate [--status] [--to 5]
 python admin.py add_station --name "Central" --lat 35.6 --lng 139.7
 python admin.py list_stations
+python admin.py reconcile_available [--fix]
+python admin.py audit_balances [--fix ledger|balance]
+python admin.py export_rentals --format csv --since 2025-01-01 --until 2025-02-01 --status returned -o rentals.csv
+python admin.py simulate_tariff candidate.json --since 2025-01-01 --until 2025-04-01
+python admin.py refresh_rollup [--rebuild]
+python admin.py station_stats 12 --since 2025-01-01 --until 2025-04-01 --bucket day
+python admin.py plan_rebalance --horizon 6 --history-days 28 -o moves.json
+python admin.py sweep_overdue [--policy flag|close] [--dry-run]
 """
 import sys
+import csv
+import json
 import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
 from db import engine, get_session
-from models import Base, Station, Battery
+from models import Base, Station, Battery, Rental, User
+from availability import adjust_available_count, reconcile_available_counts
+from ledger import audit_balances as find_balance_drifts, adjust_ledger, rebuild_balances
+from tariff import Tariff, reprice_rentals
+from rollup import refresh_station_hourly, station_stats as query_station_stats, as_utc_naive
+from rebalance import plan_rebalance as build_rebalance_plan
+from migrations import upgrade, migration_status
+from sweeper import POLICIES as SWEEPER_POLICIES, sweep_overdue as run_overdue_sweep
+from variables import (
+    REBALANCE_HORIZON_HOURS, REBALANCE_HISTORY_DAYS, REBALANCE_MAX_DISTANCE_M, REBALANCE_MIN_STOCK,
+    SWEEPER_POLICY
+)
 import random, string
 
 def init_db():
     Base.metadata.create_all(bind=engine)
     print("Initialized DB (tables created).")
 
+def migrate(status=False, target=None):
+    """未適用のマイグレーションを当てる（status=True なら適用状況の表示だけ）"""
+    if status:
+        for version, name, applied in migration_status(engine):
+            print(f"{version:>4}  {'applied' if applied else 'pending'}  {name}")
+        return
+    applied = upgrade(engine, target)
+    print(f"applied {len(applied)} migration(s)")
+
 def add_station(name, lat=None, lng=None, location=None):
     session = get_session()
     try:
@@ -32,6 +66,7 @@ def add_battery(serial, station_id=None, level=100):
     try:
         b = Battery(serial=serial, station_id=station_id, battery_level=level, available=True)
         session.add(b)
+        adjust_available_count(session, station_id, +1)
         session.commit()
         print("Added battery:", b)
     except Exception as e:
@@ -48,10 +83,216 @@ def list_stations():
     finally:
         session.close()
 
+def reconcile_available(fix=False):
+    """在庫カウンタ（stations.available_count）と実際のバッテリー行のズレを検出・修復"""
+    session = get_session()
+    try:
+        drifts = reconcile_available_counts(session, fix=fix)
+        session.commit()
+        for station_id, counter, actual in drifts:
+            print(f"station {station_id}: counter={counter} actual={actual}")
+        if not drifts:
+            print("No drift.")
+        elif fix:
+            print(f"Repaired {len(drifts)} station(s).")
+        else:
+            print(f"{len(drifts)} station(s) drifted. Run with --fix to repair.")
+    except Exception as e:
+        session.rollback()
+        print("Failed:", e)
+    finally:
+        session.close()
+
+def audit_balances(fix=None):
+    """
+    残高（users.balance_cents）と台帳（charge_histories）の合計のズレを検出・修復
+
+    fix="ledger":  台帳に補正エントリを追記して残高に合わせる（台帳導入前からのユーザー向け）
+    fix="balance": 残高を台帳の合計で上書きする（台帳を正とする場合）
+    """
+    session = get_session()
+    try:
+        drifts = find_balance_drifts(session)
+        if fix == "ledger":
+            adjust_ledger(session, drifts)
+        elif fix == "balance":
+            rebuild_balances(session, drifts)
+        session.commit()
+        for user_id, balance, total in drifts:
+            print(f"user {user_id}: balance={balance} ledger={total}")
+        if not drifts:
+            print("No drift.")
+        elif fix:
+            print(f"Repaired {len(drifts)} user(s) ({fix}).")
+        else:
+            print(f"{len(drifts)} user(s) drifted. Run with --fix ledger|balance to repair.")
+    except Exception as e:
+        session.rollback()
+        print("Failed:", e)
+    finally:
+        session.close()
+
+EXPORT_COLUMNS = [
+    "rental_id", "user_id", "user_email", "battery_id", "battery_serial",
+    "station_id", "station_name", "return_station_id", "return_station_name",
+    "start_at", "end_at", "status", "price_cents",
+]
+
+def export_rentals_query(since=None, until=None, statuses=None):
+    """
+    エクスポート用 SELECT（rentals + users + batteries + stations、id 順）
+
+    スタンドは貸出時の Rental.station_id と返却先の Rental.return_station_id
+    （バッテリーの現在の置き場所ではない）。記録される前の貸出は空になる。
+    """
+    rental_station = aliased(Station)
+    return_station = aliased(Station)
+    stmt = (
+        select(
+            Rental.id.label("rental_id"),
+            Rental.user_id,
+            User.email.label("user_email"),
+            Rental.battery_id,
+            Battery.serial.label("battery_serial"),
+            Rental.station_id,
+            rental_station.name.label("station_name"),
+            Rental.return_station_id,
+            return_station.name.label("return_station_name"),
+            Rental.start_at,
+            Rental.end_at,
+            Rental.status,
+            Rental.price_cents,
+        )
+        .join(User, Rental.user_id == User.id)
+        .join(Battery, Rental.battery_id == Battery.id)
+        .outerjoin(rental_station, Rental.station_id == rental_station.id)
+        .outerjoin(return_station, Rental.return_station_id == return_station.id)
+        .order_by(Rental.id)
+    )
+    # 列は UTC の naive。オフセットつきの日時は UTC に直してから比べる
+    if since is not None:
+        stmt = stmt.where(Rental.start_at >= as_utc_naive(since))
+    if until is not None:
+        stmt = stmt.where(Rental.start_at < as_utc_naive(until))
+    if statuses:
+        stmt = stmt.where(Rental.status.in_(statuses))
+    return stmt
+
+def export_rentals(fmt="csv", output=None, since=None, until=None, statuses=None, batch_size=5000):
+    """
+    貸出データを CSV / NDJSON でストリーム出力する（経理の突合用）
+
+    【設計意図】
+    - stream_results + yield_per でサーバーサイドカーソルから batch_size 行ずつ読む
+      （PostgreSQL では名前付きカーソル、SQLite はもともと逐次読み出し）
+    - 1行ずつ書き出して捨てるので、何千万行でもメモリ使用量は一定
+    - 出力先が標準出力のときは、件数などのメッセージを標準エラーに出す
+      （SQL_ECHO=true のときは SQL ログも標準出力に出るので、-o でファイルに書き出す）
+    """
+    out = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    count = 0
+    try:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(EXPORT_COLUMNS)
+
+        with engine.connect() as conn:
+            result = conn.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(export_rentals_query(since, until, statuses))
+
+            for row in result:
+                if fmt == "csv":
+                    writer.writerow([
+                        v.isoformat() if isinstance(v, datetime) else v
+                        for v in row
+                    ])
+                else:
+                    out.write(json.dumps(dict(row._mapping), default=_json_default, ensure_ascii=False))
+                    out.write("\n")
+                count += 1
+    finally:
+        if output:
+            out.close()
+        else:
+            out.flush()
+
+    print(f"Exported {count} rental(s).", file=sys.stderr)
+    return count
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+def simulate_tariff(path, since=None, until=None):
+    """
+    候補の料金表（JSON）で返却済みの貸出を計算し直し、現在の請求額との差を表示する
+
+    DB は書き換えない。料金変更の前に実データで影響を確認するために使う。
+    """
+    summary = reprice_rentals(Tariff.from_file(path), engine, since, until)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return summary
+
+def refresh_rollup(rebuild=False):
+    """前回以降の貸出を集計テーブルに加算する（cron から定期的に実行する）"""
+    summary = refresh_station_hourly(engine, rebuild=rebuild)
+    print(json.dumps(summary, ensure_ascii=False))
+    return summary
+
+def station_stats(station_id, since=None, until=None, bucket="day"):
+    """集計テーブルからスタンドの利用集計を表示する（0 は全体）"""
+    until = until or datetime.utcnow()
+    since = since or until.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=30)
+    with engine.connect() as conn:
+        stats = query_station_stats(conn, station_id, since, until, bucket)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return stats
+
+def plan_rebalance(horizon_hours, history_days, max_distance_m, min_stock, output=None):
+    """
+    再配置の計画（どこから・どこへ・何台）を作って JSON で出力する
+
+    DB は書き換えない。概要は標準エラーに出す。組み合わせは貪欲法による近似
+    （最小費用の保証はない。rebalance.py 参照）。
+    """
+    plan = build_rebalance_plan(
+        engine,
+        horizon_hours=horizon_hours,
+        history_days=history_days,
+        max_distance_m=max_distance_m,
+        min_stock=min_stock,
+    )
+    out = open(output, "w", encoding="utf-8") if output else sys.stdout
+    try:
+        json.dump(plan, out, ensure_ascii=False, indent=2)
+        out.write("\n")
+    finally:
+        if output:
+            out.close()
+    print(
+        f"[{plan['method']}: heuristic, not guaranteed minimum cost] "
+        f"{len(plan['moves'])} move(s), {plan['batteries_moved']} battery(ies), "
+        f"{plan['total_distance_m'] / 1000:.1f} battery-km, unmet {plan['unmet_batteries']}, "
+        f"{plan['stations']} station(s) in {plan['seconds']}s",
+        file=sys.stderr,
+    )
+    return plan
+
+def sweep_overdue(policy=SWEEPER_POLICY, dry_run=False):
+    """長期未返却の貸出を見回る（cron から定期的に実行する）"""
+    summary = run_overdue_sweep(engine, policy=policy, dry_run=dry_run)
+    print(json.dumps(summary, ensure_ascii=False))
+    return summary
+
 def parse_args(argv):
     parser = argparse.ArgumentParser()
     sub = parser.add_subparsers(dest="cmd")
     sub.add_parser("init_db")
+    p_mg = sub.add_parser("migrate")
+    p_mg.add_argument("--status", action="store_true", help="適用状況を表示するだけ")
+    p_mg.add_argument("--to", type=int, dest="target", help="この番号まで当てる")
     p_as = sub.add_parser("add_station")
     p_as.add_argument("--name", required=True)
     p_as.add_argument("--lat", type=float)
@@ -62,20 +303,69 @@ def parse_args(argv):
     p_ab.add_argument("--station", type=int)
     p_ab.add_argument("--level", type=int, default=100)
     sub.add_parser("list_stations")
+    p_rc = sub.add_parser("reconcile_available")
+    p_rc.add_argument("--fix", action="store_true")
+    p_ab2 = sub.add_parser("audit_balances")
+    p_ab2.add_argument("--fix", choices=["ledger", "balance"])
+    p_ex = sub.add_parser("export_rentals")
+    p_ex.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    p_ex.add_argument("-o", "--output", help="出力ファイル（省略時は標準出力）")
+    p_ex.add_argument("--since", type=as_utc_naive, help="開始日時の下限（含む。オフセットつきは UTC に直す）")
+    p_ex.add_argument("--until", type=as_utc_naive, help="開始日時の上限（含まない。オフセットつきは UTC に直す）")
+    p_ex.add_argument("--status", action="append", help="状態で絞り込み（複数指定可）")
+    p_ex.add_argument("--batch-size", type=int, default=5000)
+    p_st = sub.add_parser("simulate_tariff")
+    p_st.add_argument("tariff", help="候補の料金表（JSON、書式は tariff.py 参照）")
+    p_st.add_argument("--since", type=as_utc_naive, help="開始日時の下限（含む。オフセットつきは UTC に直す）")
+    p_st.add_argument("--until", type=as_utc_naive, help="開始日時の上限（含まない。オフセットつきは UTC に直す）")
+    p_rr = sub.add_parser("refresh_rollup")
+    p_rr.add_argument("--rebuild", action="store_true", help="集計テーブルを空にして作り直す")
+    p_ss = sub.add_parser("station_stats")
+    p_ss.add_argument("station_id", type=int, help="スタンドID（0 は全体）")
+    p_ss.add_argument("--since", type=as_utc_naive, help="UTC（オフセットつきは UTC に直す）")
+    p_ss.add_argument("--until", type=as_utc_naive, help="UTC（オフセットつきは UTC に直す）")
+    p_ss.add_argument("--bucket", choices=["hour", "day"], default="day")
+    p_pr = sub.add_parser("plan_rebalance")
+    p_pr.add_argument("--horizon", type=int, default=REBALANCE_HORIZON_HOURS, help="見込む時間数")
+    p_pr.add_argument("--history-days", type=int, default=REBALANCE_HISTORY_DAYS)
+    p_pr.add_argument("--max-distance-m", type=float, default=REBALANCE_MAX_DISTANCE_M)
+    p_pr.add_argument("--min-stock", type=int, default=REBALANCE_MIN_STOCK)
+    p_pr.add_argument("-o", "--output", help="出力ファイル（省略時は標準出力）")
+    p_so = sub.add_parser("sweep_overdue")
+    p_so.add_argument("--policy", choices=SWEEPER_POLICIES, default=SWEEPER_POLICY)
+    p_so.add_argument("--dry-run", action="store_true", help="書き込まずに件数・請求予定額だけ表示する")
     return parser.parse_args(argv)
 
 def main(argv):
     args = parse_args(argv)
     if args.cmd == "init_db":
         init_db()
+    elif args.cmd == "migrate":
+        migrate(args.status, args.target)
     elif args.cmd == "add_station":
         add_station(args.name, args.lat, args.lng, args.location)
     elif args.cmd == "add_battery":
         add_battery(args.serial, args.station, args.level)
     elif args.cmd == "list_stations":
         list_stations()
+    elif args.cmd == "reconcile_available":
+        reconcile_available(args.fix)
+    elif args.cmd == "audit_balances":
+        audit_balances(args.fix)
+    elif args.cmd == "export_rentals":
+        export_rentals(args.format, args.output, args.since, args.until, args.status, args.batch_size)
+    elif args.cmd == "simulate_tariff":
+        simulate_tariff(args.tariff, args.since, args.until)
+    elif args.cmd == "refresh_rollup":
+        refresh_rollup(args.rebuild)
+    elif args.cmd == "station_stats":
+        station_stats(args.station_id, args.since, args.until, args.bucket)
+    elif args.cmd == "plan_rebalance":
+        plan_rebalance(args.horizon, args.history_days, args.max_distance_m, args.min_stock, args.output)
+    elif args.cmd == "sweep_overdue":
+        sweep_overdue(args.policy, args.dry_run)
     else:
-        print("Use: init_db / add_station / add_battery / list_stations")
+        print("Use: init_db / migrate / add_station / add_battery / list_stations / reconcile_available / audit_balances / export_rentals / simulate_tariff / refresh_rollup / station_stats / plan_rebalance / sweep_overdue")
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,159 @@
+"""
+admission.py - アドミッション制御（混雑時に早めに断って、貸出・返却を守る）
+=====================================================
+【設計意図】
+- 負荷が急増すると、どのリクエストも SQLAlchemy のプールの空きを待って並び、
+  安い読み取りも貸出・返却も一緒に遅くなる
+- ルートを種類（auth / write / read）に分け、種類ごとに同時に処理する数を制限する
+  （ConcurrencyLimiter）。枠が空くのを少しだけ待ち、空かなければすぐ 503 + Retry-After を返す
+  → 在庫のポーリングやログインの集中は、その種類の枠の中だけで詰まり、
+    貸出・返却（write）の枠とプールの接続は残る
+- ログインはさらに IP ごと・ユーザー（メールアドレス）ごとのトークンバケット（TokenBucketLimiter）
+  で回数を制限する。溢れたら DB にもハッシュ計算にも触れずに 429 + Retry-After を返す
+
+【注意】
+- 枠もトークンバケットもプロセス（gunicorn のワーカー）ごと。全体の上限はワーカー数倍になる
+- 枠の数は GUNICORN_THREADS と DB_POOL_SIZE + DB_MAX_OVERFLOW を目安に決める
+  （決め方は gunicorn.conf.py。read の既定値はスレッド数で、キャッシュが効いている間は断らない。
+  読み取りの集中から write 用のスレッドを確保したいときは ADMISSION_READ_CONCURRENCY を
+  スレッド数より小さくする。その分、集中時には安い GET も 503 になる）
+- IP は request.remote_addr。リバースプロキシの後ろでは TRUSTED_PROXY_HOPS を設定すると
+  app.py が ProxyFix で X-Forwarded-For の IP に置き換える（設定しないと全員が同じ IP になる）
+=====================================================
+"""
+
+import math
+import threading
+import time
+
+from variables import (
+    ADMISSION_LIMITS, LOGIN_IP_RATE_PER_MINUTE, LOGIN_IP_BURST,
+    LOGIN_USER_RATE_PER_MINUTE, LOGIN_USER_BURST, LOGIN_LIMITER_MAX_KEYS
+)
+
+
+class ConcurrencyLimiter:
+    """
+    同時に処理する数を limit 件に制限する（1種類のルート分）
+
+    【使用例】
+    if not limiter.try_acquire():
+        return 503
+    try:
+        ...
+    finally:
+        limiter.release()
+    """
+
+    def __init__(self, name, limit, max_wait_seconds):
+        self.name = name
+        self.limit = limit
+        self.max_wait_seconds = max_wait_seconds
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rejected = 0
+        self._in_flight = 0
+
+    def try_acquire(self):
+        """枠を取る（max_wait_seconds まで待つ）。取れなければ False"""
+        if self.max_wait_seconds > 0:
+            acquired = self._slots.acquire(timeout=self.max_wait_seconds)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        with self._lock:
+            if acquired:
+                self._admitted += 1
+                self._in_flight += 1
+            else:
+                self._rejected += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "max_wait_seconds": self.max_wait_seconds,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "in_flight": self._in_flight,
+            }
+
+
+class TokenBucketLimiter:
+    """
+    キー（IP・メールアドレス）ごとのトークンバケット
+
+    1分あたり rate_per_minute 個ずつ補充され、最大 burst 個まで貯まる。
+    覚えておくキーは max_keys 件まで（古く使われていないものから忘れる）。
+    """
+
+    def __init__(self, rate_per_minute, burst, max_keys=LOGIN_LIMITER_MAX_KEYS, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        # キー → (残りトークン, 最後に更新した時刻)。dict の順序を LRU として使う
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """
+        トークンを1つ使う
+
+        【戻り値】
+        0（許可）または次のトークンが貯まるまでの秒数（拒否）
+        """
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+        return wait
+
+
+def retry_after_header(seconds):
+    """Retry-After ヘッダの値（整数の秒、最低1）"""
+    return str(max(1, math.ceil(seconds)))
+
+
+def build_limiters(limits=ADMISSION_LIMITS):
+    """{ルートの種類: ConcurrencyLimiter}"""
+    return {
+        route_class: ConcurrencyLimiter(route_class, limit, wait_ms / 1000)
+        for route_class, (limit, wait_ms) in limits.items()
+    }
+
+
+admission_limiters = build_limiters()
+login_ip_limiter = TokenBucketLimiter(LOGIN_IP_RATE_PER_MINUTE, LOGIN_IP_BURST)
+login_user_limiter = TokenBucketLimiter(LOGIN_USER_RATE_PER_MINUTE, LOGIN_USER_BURST)
+
+
+def check_login_rate(ip, email):
+    """
+    ログインの回数制限（IP → ユーザーの順に判定し、IP で断ったらユーザーの分は使わない）
+
+    【戻り値】
+    (None, 0) または (断った単位 "ip" / "user", Retry-After の秒数)
+    """
+    wait = login_ip_limiter.take(ip or "-")
+    if wait:
+        return "ip", wait
+    wait = login_user_limiter.take((email or "").strip().lower())
+    if wait:
+        return "user", wait
+    return None, 0
+
@@ -4,6 +4,7 @@ Flask API + 画面表示アプリ
 
 【設計意図】
 - トランザクション処理を明示的に使用（session.begin()）
+- DB セッションはリクエスト単位で1つ（get_db()）をルートとヘルパーで共有
 - リレーションを持つテーブル設計（User, Station, Battery, Rental）
 - 複数テーブルを使ったクエリ（サブクエリ・JOIN）
 - 正規化を意識した設計（第3正規形）
@@ -13,23 +14,55 @@ Flask API + 画面表示アプリ
 """
 
 from flask import (
-    Flask, request, jsonify,
+    Flask, request, jsonify, g, abort, make_response,
     render_template, redirect, url_for, flash, session as flask_session
 )
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import (
     JWTManager, jwt_required,
     create_access_token, get_jwt_identity, get_jwt
 )
-from sqlalchemy import select, func, and_, or_
+from sqlalchemy import select, update, func, and_, text, event
 from datetime import datetime, timedelta
+from contextlib import contextmanager
+import hmac
 import logging
+import math
+import threading
+import time
 
-from db import get_session, get_session_context
-from models import User, Station, Battery, Rental
-from auth import hash_password, verify_password
+from db import (
+    get_session, get_session_context, SessionLocal,
+    start_query_stats, current_query_stats, stop_query_stats
+)
+from models import User, Station, Battery, Rental, ChargeHistory
+from availability import (
+    get_station_availability, adjust_available_count, AvailabilityCache,
+    pending_available_count_deltas, pop_available_count_deltas
+)
+from geo_index import StationGridIndex
+from ledger import credit, debit
+from metrics import (
+    observe_request, track_operation, render_metrics,
+    observe_admission_rejected, observe_login_throttled
+)
+from history import (
+    encode_history_cursor, decode_history_cursor, parse_history_limit,
+    user_history_query, split_history_page, history_item
+)
+from auth import hash_password_limited, verify_password_limited, HashingBusyError
+from tariff import active_tariff
+from rollup import station_stats, as_utc_naive
+from telemetry import telemetry_buffer, parse_readings
+from admission import admission_limiters, check_login_rate, retry_after_header
 from variables import (
     JWT_SECRET_KEY, PRICE_PER_MINUTE_CENTS, RENTAL_DEPOSIT_CENTS,
-    INITIAL_BALANCE_CENTS, DEBUG_MODE
+    INITIAL_BALANCE_CENTS, DEBUG_MODE, AVAILABILITY_CACHE_TTL_SECONDS,
+    NEARBY_GRID_CELL_DEG, NEARBY_DEFAULT_RADIUS_M, NEARBY_MAX_RADIUS_M, NEARBY_MAX_LIMIT,
+    HISTORY_PAGE_SIZE, HASH_RETRY_AFTER_SECONDS,
+    SERVER_TIMING_ENABLED, BATCH_MAX_OPERATIONS, BATCH_CHUNK_SIZE,
+    TELEMETRY_API_KEY, TELEMETRY_MAX_READINGS, ADMIN_API_KEY, STATS_MAX_DAYS,
+    ADMISSION_ENABLED, ADMISSION_RETRY_AFTER_SECONDS, TRUSTED_PROXY_HOPS
 )
 
 # --------------------
@@ -74,6 +107,16 @@ with app.app_context():
     # ここでSQLを流し込まなくても、models.pyの定義を元にテーブルを自動作成します
     Base.metadata.create_all(bind=engine)
 
+# リバースプロキシ（Render など）の後ろでは X-Forwarded-For から利用者の IP を取る
+# （ログインの IP ごとの回数制限が、全員プロキシの IP 1つにまとまらないように）
+def wrap_proxy_fix(wsgi_app, hops=TRUSTED_PROXY_HOPS):
+    """信頼するプロキシが hops 段あれば ProxyFix で包む（0 ならそのまま）"""
+    if hops <= 0:
+        return wsgi_app
+    return ProxyFix(wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+app.wsgi_app = wrap_proxy_fix(app.wsgi_app)
+
 app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
 app.config["SECRET_KEY"] = "change_me_in_production_123!"  # HTMLフォーム用
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
@@ -93,36 +136,498 @@ def inject_template_globals():
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ====================
+# リクエスト単位のセッション
+# ====================
+def get_db():
+    """
+    このリクエスト用のセッションを返す（初回呼び出し時に作成し、g に保持する）
+
+    【設計意図】
+    - ルートとヘルパーが同じセッションを共有する
+      → 接続のチェックアウトは1リクエスト1回、同じ行の session.get() は
+        アイデンティティマップから返る（2回目以降は SQL を発行しない）
+    - リクエスト終了時に teardown_appcontext で close する
+    """
+    if "db_session" not in g:
+        g.db_session = SessionLocal()
+    return g.db_session
+
+@contextmanager
+def write_transaction(immediate=False):
+    """
+    リクエスト用セッションで書き込みトランザクションを実行する
+
+    【使用例】
+    with write_transaction() as session:
+        rent_battery(session, user_id, battery_id)
+
+    【注意】
+    - それまでの読み取りで自動開始されたトランザクションは先に閉じてから begin() する
+    - コミット後は読み込み済みのオブジェクトを expire する
+      （残高・在庫は SQL 側で更新するため、同じリクエスト内の後続の読み取りで古い値を返さない）
+    - トランザクション内で SAVEPOINT（session.begin_nested()）を使う場合は immediate=True にする。
+      SQLite のドライバは最初の INSERT/UPDATE まで BEGIN を出さないため、そのままだと
+      SAVEPOINT がトランザクションの外で実行され、RELEASE の時点で確定してしまう
+    """
+    session = get_db()
+    if session.in_transaction():
+        session.commit()
+    with session.begin():
+        if immediate and session.get_bind().dialect.name == "sqlite":
+            # 先に BEGIN IMMEDIATE で書き込みロックを取ってから始める
+            session.execute(text("BEGIN IMMEDIATE"))
+        yield session
+    session.expire_all()
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    """リクエスト終了時にセッションを閉じる（未コミットの変更はロールバックされる）"""
+    session = g.pop("db_session", None)
+    if session is not None:
+        session.close()
+
+# ====================
+# SQL 計測（Server-Timing）
+# ====================
+@app.before_request
+def begin_query_stats():
+    """このリクエストで発行した SQL の件数・時間の集計を始める"""
+    g.query_stats_token = start_query_stats(request.endpoint or request.path)
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Server-Timing ヘッダに SQL の件数・時間とリクエスト全体の時間をつける
+    例: Server-Timing: db;dur=3.2;desc="4 queries", app;dur=12.5
+    （ブラウザの開発者ツールの Timing タブで見られる）
+    """
+    stats = current_query_stats()
+    if SERVER_TIMING_ENABLED and stats is not None:
+        total_ms = (time.perf_counter() - g.request_started_at) * 1000
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", app;dur={total_ms:.1f}'
+        )
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    """ルートごとのレイテンシをヒストグラムに記録（ラベルは URL ではなくルール。件数が増えすぎないように）"""
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    observe_request(request.method, route, response.status_code,
+                    time.perf_counter() - g.request_started_at)
+    return response
+
+@app.teardown_request
+def end_query_stats(exception=None):
+    token = g.pop("query_stats_token", None)
+    if token is not None:
+        stop_query_stats(token)
+
+# ====================
+# アドミッション制御（admission.py）
+# ====================
+# 制限しないルート（DB を使わない・監視用・専用の制限があるもの）
+ADMISSION_EXEMPT_ENDPOINTS = {"static", "index", "logout", "metrics_endpoint", "api_telemetry"}
+# POST を auth の枠で数えるルート（パスワードのハッシュ計算がある）
+# GET はフォームを表示するだけ（DB もハッシュ計算も使わない）なので制限しない
+AUTH_ENDPOINTS = {"api_login", "login_page", "register_page"}
+
+def route_class_for(endpoint, method):
+    """ルートの種類（auth / write / read、制限しないなら None）"""
+    if endpoint is None or endpoint in ADMISSION_EXEMPT_ENDPOINTS:
+        return None
+    if endpoint in AUTH_ENDPOINTS:
+        return "auth" if method == "POST" else None
+    return "read" if method in ("GET", "HEAD", "OPTIONS") else "write"
+
+def overloaded_response(status, retry_after_seconds):
+    """混雑・回数制限で断るときの応答（API は JSON、画面はエラーページ）"""
+    if request.path.startswith("/api/"):
+        response = jsonify({"msg": "server busy, retry later" if status == 503 else "too many requests"})
+    else:
+        response = app.make_response(
+            render_template("error.html", message="混雑しています。しばらくしてから再度お試しください")
+        )
+    response.status_code = status
+    response.headers["Retry-After"] = retry_after_header(retry_after_seconds)
+    return response
+
+@app.before_request
+def admit_request():
+    """
+    ルートの種類ごとの枠を取る（空かなければ少し待ち、それでも空かなければ 503）
+
+    枠は teardown_request で返す。before_request で応答を返しても
+    after_request（Server-Timing・メトリクス）は実行される。
+    """
+    if not ADMISSION_ENABLED:
+        return None
+    route_class = route_class_for(request.endpoint, request.method)
+    if route_class is None:
+        return None
+    limiter = admission_limiters[route_class]
+    if not limiter.try_acquire():
+        observe_admission_rejected(route_class)
+        return overloaded_response(503, ADMISSION_RETRY_AFTER_SECONDS)
+    g.admission_limiter = limiter
+    return None
+
+@app.teardown_request
+def release_admission(exception=None):
+    limiter = g.pop("admission_limiter", None)
+    if limiter is not None:
+        limiter.release()
+
+def login_throttled(email):
+    """
+    ログインの回数制限を超えていれば Retry-After の秒数を返す（超えていなければ 0）
+
+    DB・ハッシュ計算より前に呼ぶ。
+    """
+    scope, wait = check_login_rate(request.remote_addr, email)
+    if scope:
+        observe_login_throttled(scope)
+    return wait
+
 # ====================
 # ヘルパー関数
 # ====================
 
+# スタンド在庫一覧のキャッシュ（貸出・返却のコミット後に bump() で無効化）
+availability_cache = AvailabilityCache(AVAILABILITY_CACHE_TTL_SECONDS)
+
+def load_station_availability():
+    """
+    キャッシュ作り直し用: DB からスタンド在庫一覧を読む
+
+    キャッシュはリクエストをまたいで共有されるため、リクエスト用セッションではなく
+    専用のセッションで読む（どのリクエストの途中の状態も混ざらないように）
+    """
+    with get_session_context() as session:
+        return get_station_availability(session)
+
+# 近隣検索用の空間インデックス
+# - このプロセスの貸出・返却による在庫数の増減は、コミット時に差分で反映する（after_commit）
+# - スタンドの追加・移動と他プロセスの貸出・返却は、AVAILABILITY_CACHE_TTL_SECONDS ごとに
+#   在庫キャッシュから取り込み直して揃える
+station_index = StationGridIndex(cell_deg=NEARBY_GRID_CELL_DEG)
+station_index_sync_lock = threading.Lock()
+
+def get_station_index():
+    """空間インデックスを返す（TTL を過ぎていれば在庫キャッシュから取り込み直す）"""
+    synced_at = station_index.synced_at
+    if synced_at is not None and time.monotonic() - synced_at < AVAILABILITY_CACHE_TTL_SECONDS:
+        return station_index
+    # 取り込み直しは1スレッドだけ。他のスレッドは取り込み済みの内容で答える（初回だけは待つ）
+    if station_index_sync_lock.acquire(blocking=synced_at is None):
+        try:
+            if station_index.synced_at == synced_at:
+                stations, etag = availability_cache.get(load_station_availability)
+                station_index.sync(stations, key=etag)
+        finally:
+            station_index_sync_lock.release()
+    return station_index
+
+@event.listens_for(SessionLocal, "after_commit")
+def apply_committed_availability(session):
+    """コミットした在庫カウンタの増減を空間インデックスに反映する"""
+    deltas = pop_available_count_deltas(session)
+    if deltas:
+        station_index.apply_available_deltas(deltas)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def discard_rolled_back_availability(session):
+    pop_available_count_deltas(session)
+
 def get_user_balance(user_id):
     """ユーザー残高を取得（SQLAlchemy ORM使用）"""
-    with get_session_context() as session:
-        user = session.get(User, user_id)
-        return user.balance_cents if user else 0
+    session = get_db()
+    user = session.get(User, user_id)
+    return user.balance_cents if user else 0
 
 def get_available_batteries_count(station_id):
-    """指定スタンドの利用可能バッテリー数を取得（JOINクエリ）"""
-    with get_session_context() as session:
-        count = session.query(func.count(Battery.id)).filter(
-            Battery.station_id == station_id,
-            Battery.available == True
-        ).scalar()
-        return count or 0
-
-def get_user_rentals_with_details(user_id):
-    """ユーザーの貸出履歴を取得（JOINクエリでバッテリー情報も取得）"""
-    with get_session_context() as session:
-        rentals = session.query(Rental, Battery, Station).join(
-            Battery, Rental.battery_id == Battery.id
-        ).outerjoin(
-            Station, Battery.station_id == Station.id
-        ).filter(
-            Rental.user_id == user_id
-        ).order_by(Rental.start_at.desc()).all()
-        return rentals
+    """指定スタンドの利用可能バッテリー数を取得（在庫カウンタ列を読む）"""
+    session = get_db()
+    count = session.query(Station.available_count).filter(
+        Station.id == station_id
+    ).scalar()
+    return count or 0
+
+def get_user_rentals_with_details(user_id, limit=HISTORY_PAGE_SIZE, after_id=None):
+    """
+    ユーザーの貸出履歴を1ページ分取得（JOINクエリでバッテリー情報も取得）
+    キーセットページングの詳細は history.py を参照
+
+    【戻り値】
+    ([(Rental, Battery, Station), ...], 次ページの after_id または None)
+    """
+    rows = get_db().execute(user_history_query(user_id, limit, after_id)).all()
+    return split_history_page(rows, limit)
+
+def current_user_id():
+    """JWT の identity（文字列）からユーザーIDを取り出す（数値でなければ 401 で打ち切る）"""
+    try:
+        return int(get_jwt_identity())
+    except (TypeError, ValueError):
+        abort(make_response(jsonify({"msg": "Invalid token subject"}), 401))
+
+def authenticate(email, password):
+    """
+    メールアドレスとパスワードでユーザーを認証する
+
+    【設計意図】
+    - ユーザー行を読んだらトランザクションを閉じてからハッシュを照合する
+      （ハッシュ計算の待ち時間中に DB 接続を握らない）
+    - 照合はハッシュ用プールで行う（混雑時は HashingBusyError）
+    - 保存済みハッシュの反復回数が設定と違えば作り直して保存する。
+      読んだ時点のハッシュと一致する場合だけ更新し、その間のパスワード変更は上書きしない
+
+    【戻り値】
+    (user_id, email, balance_cents) または None
+    """
+    session = get_db()
+    row = session.execute(
+        select(User.id, User.email, User.password_hash, User.balance_cents)
+        .where(User.email == email)
+    ).first()
+    # 読み取りのトランザクションを閉じて接続をプールに返す
+    session.commit()
+    if not row:
+        return None
+
+    ok, new_hash = verify_password_limited(password, row.password_hash)
+    if not ok:
+        return None
+
+    if new_hash:
+        with write_transaction() as session:
+            session.execute(
+                update(User)
+                .where(User.id == row.id, User.password_hash == row.password_hash)
+                .values(password_hash=new_hash)
+                .execution_options(synchronize_session=False)
+            )
+        logger.info(f"Rehashed password for user {row.id}")
+
+    return row.id, row.email, row.balance_cents
+
+def api_key_matches(expected):
+    """X-API-Key ヘッダーが expected と一致するか（expected が空なら常に不一致）"""
+    given = request.headers.get("X-API-Key", "")
+    return bool(expected) and hmac.compare_digest(given, expected)
+
+def hashing_busy_response():
+    """ハッシュ計算が混雑しているときの 503（API 用）"""
+    response = jsonify({"msg": "server busy, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(HASH_RETRY_AFTER_SECONDS)
+    return response
+
+class RentalError(Exception):
+    """
+    貸出・返却を中止する業務エラー（残高不足・貸出不可など）
+
+    トランザクション内で送出すると session.begin() のブロックごとロールバックされる。
+    str(e) は API のエラーメッセージ（"insufficient balance" など）。
+    """
+
+def rent_battery(session, user_id, battery_id):
+    """
+    貸出処理（呼び出し元のトランザクション内で実行する）
+
+    【二重貸出の防止】
+    UPDATE batteries SET available = false WHERE id = :id AND available
+    の1文で「利用可能なら貸出中にする」を原子的に行い、更新行数で成否を判定する。
+    同じバッテリーに同時にリクエストが来ても、更新できるのは1件だけ。
+
+    【戻り値】
+    Rental（貸出できない場合は RentalError）
+    """
+    # 残高チェックを先に行う（バッテリーを押さえてから失敗しないように）
+    # 同じトランザクション内で SQL 側の加算・減算が先に走っている場合があるため
+    # （/api/batch）、セッションのキャッシュではなく DB から読む
+    balance = session.execute(
+        select(User.balance_cents).where(User.id == user_id)
+    ).scalar()
+    if balance is None or balance < RENTAL_DEPOSIT_CENTS:
+        raise RentalError("insufficient balance")
+
+    result = session.execute(
+        update(Battery)
+        .where(Battery.id == battery_id, Battery.available == True)
+        .values(available=False)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise RentalError("battery not available")
+
+    # 貸出元スタンドの在庫を -1（スタンドIDは DB 側のサブクエリで引く）
+    station_id = select(Battery.station_id).where(Battery.id == battery_id).scalar_subquery()
+    adjust_available_count(session, station_id, -1)
+
+    # 貸出レコード作成（INSERT）。貸出元スタンドは料金計算に使う
+    rental = Rental(
+        user_id=user_id,
+        battery_id=battery_id,
+        station_id=station_id,
+        status="ongoing"
+    )
+    session.add(rental)
+    session.flush()  # IDを取得するためにflush
+    return rental
+
+def calculate_price(start_time, end_time, station_id=None):
+    """利用料金（料金表は tariff.py。既定では1分未満は1分として分単価で計算）"""
+    return active_tariff.price(start_time, end_time, station_id)
+
+def return_rental(session, user_id, rental_id, return_station_id=None):
+    """
+    返却処理（呼び出し元のトランザクション内で実行する）
+
+    【処理の流れ】
+    1. UPDATE rentals SET status = 'returned' ... WHERE id = :id AND status = 'ongoing'
+       で返却を確定する（同じ貸出への二重返却・二重請求を防ぐ）
+    2. 残高から利用料金を原子的に引き、台帳に記録する（ledger.debit）
+       残高不足なら RentalError でトランザクションごと取り消す
+    3. バッテリーを利用可能に戻し、返却先スタンドの在庫を +1 する
+       返却先スタンドを指定した場合、存在しなければ RentalError
+
+    【戻り値】
+    (料金, 更新後の残高)
+    """
+    rental = session.get(Rental, rental_id)
+    if not rental or rental.user_id != user_id or rental.status != "ongoing":
+        raise RentalError("invalid rental")
+
+    # 時間・料金計算
+    end_time = datetime.utcnow()
+    price = calculate_price(rental.start_at, end_time, rental.station_id)
+
+    # 返却先スタンド（指定がなければバッテリーの現在のスタンド）
+    if return_station_id:
+        return_station = int(return_station_id)
+        # 存在しないスタンドを書き込む前に断る（PostgreSQL では外部キー違反で
+        # チャンクごと失敗し、SQLite ではバッテリーがどのスタンドの在庫からも消える）
+        if session.get(Station, return_station) is None:
+            raise RentalError("invalid return station")
+    else:
+        return_station = select(Battery.station_id).where(Battery.id == rental.battery_id).scalar_subquery()
+
+    # 返却処理（UPDATE）
+    result = session.execute(
+        update(Rental)
+        .where(Rental.id == rental_id, Rental.status == "ongoing")
+        .values(end_at=end_time, price_cents=price, status="returned",
+                return_station_id=return_station)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise RentalError("invalid rental")
+
+    balance = debit(session, user_id, price, kind="rental", rental_id=rental_id)
+    if balance is None:
+        raise RentalError("insufficient balance")
+
+    battery = session.get(Battery, rental.battery_id)
+    battery.available = True
+
+    # ★ ここが重要（位置更新）
+    if return_station_id:
+        battery.station_id = int(return_station_id)
+
+    # 返却先スタンドの在庫を +1（移動した場合は移動先）
+    adjust_available_count(session, battery.station_id, +1)
+
+    return price, balance
+
+# /api/batch で受け付ける操作（メトリクスの operation ラベルにもそのまま使う）
+BATCH_OPERATIONS = ("rent", "return", "charge")
+
+# 操作ごとの ID 項目（必須かどうか）。/api/rent・/api/return の単体 API でも使う
+OPERATION_ID_FIELDS = {
+    "rent": (("battery_id", True),),
+    "return": (("rental_id", True), ("return_station_id", False)),
+    "charge": (),
+}
+
+def normalize_operation_ids(op, item):
+    """
+    貸出・返却・一括処理の1件の ID 項目を検証し、整数にそろえた item を返す（不正なら RentalError）
+
+    【注意】
+    - SQL を発行する前に検証する。PostgreSQL では型の合わない値で文が失敗すると
+      トランザクション全体が中断され、同じチャンクの他の操作まで巻き込んで 500 になる
+    """
+    item = dict(item)
+    for field, required in OPERATION_ID_FIELDS[op]:
+        value = item.get(field)
+        if not value:
+            if required:
+                raise RentalError(f"{field} required")
+            continue
+        # bool は int のサブクラスなので除く。"12" のような数字の文字列は受け付ける
+        if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+            raise RentalError(f"invalid {field}")
+        item[field] = int(value)
+    return item
+
+def apply_batch_operation(session, user_id, op, item):
+    """
+    一括処理の1件を実行する（呼び出し元のトランザクション内で実行する）
+
+    ID 項目は normalize_operation_ids で検証済みのものを渡す。検証と料金計算は api_rent / api_return / api_charge と同じ関数を使い、
+    エラーメッセージも単体の API と同じにする。
+
+    【戻り値】
+    結果の辞書（実行できない場合は RentalError）
+    """
+    if op == "rent":
+        rental = rent_battery(session, user_id, item["battery_id"])
+        return {"rental_id": rental.id}
+
+    if op == "return":
+        price, balance = return_rental(session, user_id, item["rental_id"], item.get("return_station_id"))
+        return {"price": price, "balance": balance}
+
+    try:
+        amount = int(item.get("amount", 0))
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        raise RentalError("invalid amount")
+    balance = credit(session, user_id, amount, kind="charge")
+    if balance is None:
+        raise RentalError("user not found")
+    return {"balance": balance}
+
+def run_batch_item(session, user_id, index, item):
+    """
+    一括処理の1件を SAVEPOINT の中で実行し、API に返す結果を作る
+
+    失敗した操作は SAVEPOINT までロールバックし、同じチャンクの他の操作は残す。
+    status は単体の API で返すステータスコード（成功 200、業務エラー・不正な入力 400）。
+    """
+    op = item.get("op") if isinstance(item, dict) else None
+    if op not in BATCH_OPERATIONS:
+        return {"index": index, "op": op, "ok": False, "status": 400, "msg": "unknown op"}
+    try:
+        item = normalize_operation_ids(op, item)
+    except RentalError as e:
+        return {"index": index, "op": op, "ok": False, "status": 400, "msg": str(e)}
+
+    deltas = pending_available_count_deltas(session)
+    recorded = len(deltas)
+    try:
+        with track_operation(op, RentalError), session.begin_nested():
+            result = apply_batch_operation(session, user_id, op, item)
+    except RentalError as e:
+        # SAVEPOINT まで戻した操作の在庫の増減は空間インデックスに反映しない
+        del deltas[recorded:]
+        return {"index": index, "op": op, "ok": False, "status": 400, "msg": str(e)}
+    return {"index": index, "op": op, "ok": True, "status": 200, **result}
 
 # ====================
 # 画面ルーティング
@@ -155,34 +660,48 @@ def register_page():
         flash("パスワードが一致しません", "error")
         return render_template("register.html"), 400
 
-    with get_session_context() as session:
-        try:
-            # トランザクション開始
-            with session.begin():
-                # メール重複チェック（SELECT）
-                existing_user = session.query(User).filter_by(email=email).first()
-                if existing_user:
-                    flash("このメールアドレスは既に登録されています", "error")
-                    return render_template("register.html"), 400
-
-                # ユーザー作成（INSERT）
-                user = User(
-                    email=email,
-                    password_hash=hash_password(password),
-                    balance_cents=INITIAL_BALANCE_CENTS
-                )
-                session.add(user)
-                session.flush()  # IDを取得するためにflush
-
-
-            logger.info(f"User {email} registered with initial balance {INITIAL_BALANCE_CENTS}")
-            flash("登録が完了しました。ログインしてください", "success")
-            return redirect(url_for("login_page"))
+    # ハッシュはトランザクションの外で計算する（計算中に書き込みロックを握らない）
+    try:
+        password_hash = hash_password_limited(password)
+    except HashingBusyError:
+        flash("混雑しています。しばらくしてから再度お試しください", "error")
+        return render_template("register.html"), 503
 
-        except Exception as e:
-            logger.error(f"Registration failed for {email}: {e}")
-            flash("登録に失敗しました。時間をおいて再度お試しください", "error")
-            return render_template("register.html"), 500
+    try:
+        # トランザクション開始
+        with write_transaction() as session:
+            # メール重複チェック（SELECT）
+            existing_user = session.query(User).filter_by(email=email).first()
+            if existing_user:
+                flash("このメールアドレスは既に登録されています", "error")
+                return render_template("register.html"), 400
+
+            # ユーザー作成（INSERT）
+            user = User(
+                email=email,
+                password_hash=password_hash,
+                balance_cents=INITIAL_BALANCE_CENTS
+            )
+            session.add(user)
+            session.flush()  # IDを取得するためにflush
+
+            # 初回残高も台帳に記録（台帳の合計 = 残高 を保つ）
+            if INITIAL_BALANCE_CENTS:
+                session.add(ChargeHistory(
+                    user_id=user.id,
+                    amount_cents=INITIAL_BALANCE_CENTS,
+                    kind="initial"
+                ))
+
+
+        logger.info(f"User {email} registered with initial balance {INITIAL_BALANCE_CENTS}")
+        flash("登録が完了しました。ログインしてください", "success")
+        return redirect(url_for("login_page"))
+
+    except Exception as e:
+        logger.error(f"Registration failed for {email}: {e}")
+        flash("登録に失敗しました。時間をおいて再度お試しください", "error")
+        return render_template("register.html"), 500
 
 @app.route("/home", strict_slashes=False)
 def home_page():
@@ -191,23 +710,12 @@ def home_page():
     if not user_id:
         return redirect(url_for("login_page"))
 
-    with get_session_context() as session:
-        # 全スタンド取得（SELECT）
-        stations = session.query(Station).all()
-        
-        # 各スタンドの利用可能バッテリー数を計算
-        station_data = []
-        for station in stations:
-            available_count = get_available_batteries_count(station.id)
-            station_data.append({
-                "id": station.id,
-                "name": station.name,
-                "location": station.location,
-                "available_count": available_count
-            })
-
-        # ユーザー残高取得
-        balance = get_user_balance(user_id)
+    session = get_db()
+    # 全スタンド + 利用可能バッテリー数（LEFT JOIN + GROUP BY の1クエリ）
+    station_data = get_station_availability(session)
+
+    # ユーザー残高取得
+    balance = get_user_balance(user_id)
 
     return render_template("home.html", 
                          stations=station_data, 
@@ -221,17 +729,8 @@ def stations_page():
     if not user_id:
         return redirect(url_for("login_page"))
 
-    with get_session_context() as session:
-        stations = session.query(Station).all()
-        station_data = []
-        for station in stations:
-            available_count = get_available_batteries_count(station.id)
-            station_data.append({
-                "id": station.id,
-                "name": station.name,
-                "location": station.location,
-                "available_count": available_count
-            })
+    session = get_db()
+    station_data = get_station_availability(session)
 
     return render_template("stations.html", stations=station_data)
 
@@ -242,19 +741,19 @@ def station_detail_page(station_id):
     if not user_id:
         return redirect(url_for("login_page"))
 
-    with get_session_context() as session:
-        station = session.get(Station, station_id)
-        if not station:
-            flash("指定されたスタンドは存在しません", "error")
-            return redirect(url_for("stations_page"))
+    session = get_db()
+    station = session.get(Station, station_id)
+    if not station:
+        flash("指定されたスタンドは存在しません", "error")
+        return redirect(url_for("stations_page"))
 
-        # そのスタンドの利用可能��ッテリーを取得（JOINクエリ）
-        batteries = session.query(Battery).filter(
-            Battery.station_id == station_id,
-            Battery.available == True
-        ).all()
+    # そのスタンドの利用可能��ッテリーを取得（JOINクエリ）
+    batteries = session.query(Battery).filter(
+        Battery.station_id == station_id,
+        Battery.available == True
+    ).all()
 
-        balance = get_user_balance(user_id)
+    balance = get_user_balance(user_id)
 
     return render_template("station_detail.html", 
                          station=station, 
@@ -268,45 +767,32 @@ def rent_page(battery_id):
     if not user_id:
         return redirect(url_for("login_page"))
 
-    with get_session_context() as session:
-        battery = session.get(Battery, battery_id)
-        if not battery or not battery.available:
-            flash("このバッテリーは貸出できません", "error")
-            return redirect(url_for("stations_page"))
-
-        user = session.get(User, user_id)
-        if user.balance_cents < RENTAL_DEPOSIT_CENTS:
-            flash("残高が不足しています。チャージしてください", "error")
-            return redirect(url_for("charge_page"))
+    session = get_db()
+    battery = session.get(Battery, battery_id)
+    if not battery or not battery.available:
+        flash("このバッテリーは貸出できません", "error")
+        return redirect(url_for("stations_page"))
+
+    user = session.get(User, user_id)
+    if user.balance_cents < RENTAL_DEPOSIT_CENTS:
+        flash("残高が不足しています。チャージしてください", "error")
+        return redirect(url_for("charge_page"))
 
-        balance = user.balance_cents
+    balance = user.balance_cents
 
     if request.method == "POST":
         # 貸出処理（トランザクション）
         try:
-            with get_session_context() as session:
-                with session.begin():
-                    user = session.get(User, user_id)
-                    battery = session.get(Battery, battery_id)
-
-                    if not battery or not battery.available:
-                        return jsonify({"msg": "battery not available"}), 400
-
-                    if user.balance_cents < RENTAL_DEPOSIT_CENTS:
-                        return jsonify({"msg": "insufficient balance"}), 400
-
-                    # 貸出レコード作成（INSERT）
-                    rental = Rental(
-                        user_id=user.id,
-                        battery_id=battery.id,
-                        status="ongoing"
-                    )
-                    battery.available = False
-                    session.add(rental)
+            with track_operation("rent", RentalError), write_transaction() as session:
+                rent_battery(session, user_id, battery_id)
 
+            availability_cache.bump()
             flash("バッテリーを貸出しました", "success")
             return redirect(url_for("home_page"))
 
+        except RentalError as e:
+            return jsonify({"msg": str(e)}), 400
+
         except Exception as e:
             logger.error(f"Rent failed for user {user_id}, battery {battery_id}: {e}")
             flash("貸出に失敗しました", "error")
@@ -321,60 +807,42 @@ def return_page(rental_id):
     if not user_id:
         return redirect(url_for("login_page"))
 
-    with get_session_context() as session:
-        rental = session.get(Rental, rental_id)
-        if not rental or rental.user_id != user_id or rental.status != "ongoing":
-            flash("返却できません", "error")
-            return redirect(url_for("history_page"))
+    session = get_db()
+    rental = session.get(Rental, rental_id)
+    if not rental or rental.user_id != user_id or rental.status != "ongoing":
+        flash("返却できません", "error")
+        return redirect(url_for("history_page"))
 
-        battery = session.get(Battery, rental.battery_id)
-        station = session.get(Station, battery.station_id) if battery else None
+    battery = session.get(Battery, rental.battery_id)
+    station = session.get(Station, battery.station_id) if battery else None
 
     # ここからは関数内部にあるべき処理なのでインデントを関数内に揃える
     if request.method == "POST":
         try:
-            with get_session_context() as session:
-                with session.begin():
-                    rental = session.get(Rental, rental_id)
-                    battery = session.get(Battery, rental.battery_id)
-                    user = session.get(User, user_id)
-
-                    # 時間・料金計算
-                    end_time = datetime.utcnow()
-                    start_time = rental.start_at
-                    minutes = max(1, int((end_time - start_time).total_seconds() // 60))
-                    price = minutes * PRICE_PER_MINUTE_CENTS
-
-                    # 残高チェック
-                    if user.balance_cents < price:
-                        flash("残高が不足しています", "error")
-                        return redirect(url_for("charge_page"))
-
-                    # 返却先ステーション
-                    return_station_id = request.form.get("return_station_id")
-
-                    # 返却処理（UPDATE）
-                    user.balance_cents -= price
-                    rental.end_at = end_time
-                    rental.price_cents = price
-                    rental.status = "returned"
-
-                    battery.available = True
-
-                    # ★ ここが重要（位置更新）
-                    if return_station_id:
-                        battery.station_id = int(return_station_id)
+            # 返却先ステーション
+            return_station_id = request.form.get("return_station_id")
+
+            with track_operation("return", RentalError), write_transaction() as session:
+                price, _ = return_rental(session, user_id, rental_id, return_station_id)
 
+            availability_cache.bump()
             flash(f"バッテリーを返却しました。料金: {price}円", "success")
             return redirect(url_for("home_page"))
 
+        except RentalError as e:
+            if str(e) == "insufficient balance":
+                flash("残高が不足しています", "error")
+                return redirect(url_for("charge_page"))
+            flash("返却できません", "error")
+            return redirect(url_for("history_page"))
+
         except Exception as e:
             logger.error(f"Return failed for rental {rental_id}: {e}")
             flash("返却に失敗しました", "error")
             return redirect(url_for("return_page", rental_id=rental_id))
 
-    with get_session_context() as session:
-        stations = session.query(Station).all()
+    session = get_db()
+    stations = session.query(Station).all()
 
     return render_template("return.html", 
                          rental=rental, 
@@ -389,7 +857,16 @@ def history_page():
     if not user_id:
         return redirect(url_for("login_page"))
 
-    rentals_data = get_user_rentals_with_details(user_id)
+    try:
+        limit = parse_history_limit(request.args.get("limit"))
+        cursor = request.args.get("cursor")
+        after_id = decode_history_cursor(cursor) if cursor else None
+    except ValueError:
+        flash("履歴の表示位置が不正です", "error")
+        return redirect(url_for("history_page"))
+
+    rentals_data, next_id = get_user_rentals_with_details(user_id, limit, after_id)
+    next_cursor = encode_history_cursor(next_id) if next_id else None
     
     # 履歴データを整形
     history_list = []
@@ -407,7 +884,10 @@ def history_page():
             "status": rental.status
         })
 
-    return render_template("history.html", history=history_list)
+    return render_template("history.html",
+                         history=history_list,
+                         next_cursor=next_cursor,
+                         limit=limit)
 
 @app.route("/charge", methods=["GET", "POST"], strict_slashes=False)
 def charge_page():
@@ -430,16 +910,14 @@ def charge_page():
             return redirect(url_for("charge_page"))
 
         try:
-            with get_session_context() as session:
-                with session.begin():
-                    user = session.get(User, user_id)
-                    if not user:
-                        # 想定外（セッションに user_id があるが DB にユーザーがない）
-                        raise RuntimeError("ユーザーが見つかりません")
-
-                    # 単位に注意: 変数名に _CENTS がついていてもテンプレートは「円」を表示しています。
-                    # このアプリでは amount をそのまま balance_cents に足す実装になっています。
-                    user.balance_cents += amount
+            with track_operation("charge"), write_transaction() as session:
+                # 単位に注意: 変数名に _CENTS がついていてもテンプレートは「円」を表示しています。
+                # このアプリでは amount をそのまま balance_cents に足す実装になっています。
+                # 残高は DB 側で加算し（同時チャージでも値を失わない）、台帳に記録する
+                balance = credit(session, user_id, amount, kind="charge")
+                if balance is None:
+                    # 想定外（セッションに user_id があるが DB にユーザーがない）
+                    raise RuntimeError("ユーザーが見つかりません")
 
 
 
@@ -479,18 +957,26 @@ def api_login():
     if not email or not password:
         return jsonify({"msg": "email and password required"}), 400
 
-    with get_session_context() as session:
-        user = session.query(User).filter_by(email=email).first()
-        if not user or not verify_password(password, user.password_hash):
-            return jsonify({"msg": "bad credentials"}), 401
+    wait = login_throttled(email)
+    if wait:
+        return overloaded_response(429, wait)
 
-        token = create_access_token(identity=user.id)
-        return jsonify({
-            "access_token": token,
-            "user_id": user.id,
-            "email": user.email,
-            "balance": user.balance_cents
-        })
+    try:
+        user = authenticate(email, password)
+    except HashingBusyError:
+        return hashing_busy_response()
+
+    if not user:
+        return jsonify({"msg": "bad credentials"}), 401
+
+    user_id, user_email, balance = user
+    token = create_access_token(identity=str(user_id))
+    return jsonify({
+        "access_token": token,
+        "user_id": user_id,
+        "email": user_email,
+        "balance": balance
+    })
 
 @app.route("/login", methods=["GET", "POST"], strict_slashes=False)
 def login_page():
@@ -507,67 +993,127 @@ def login_page():
         flash("メールアドレスとパスワードを入力してください", "error")
         return render_template("login.html"), 400
 
-    with get_session_context() as session:
-        user = session.query(User).filter_by(email=email).first()
-        if not user or not verify_password(password, user.password_hash):
-            flash("メールアドレスまたはパスワードが間違っています", "error")
-            return render_template("login.html"), 401
+    wait = login_throttled(email)
+    if wait:
+        flash("ログインの試行回数が多すぎます。しばらくしてから再度お試しください", "error")
+        return render_template("login.html"), 429, {"Retry-After": retry_after_header(wait)}
 
-        access_token = create_access_token(identity=user.id)
-        flask_session["user_id"] = user.id
-        flask_session["access_token"] = access_token
+    try:
+        user = authenticate(email, password)
+    except HashingBusyError:
+        flash("混雑しています。しばらくしてから再度お試しください", "error")
+        return render_template("login.html"), 503
 
-        logger.info(f"User {user.email} logged in")
-        return redirect(url_for("home_page"))
+    if not user:
+        flash("メールアドレスまたはパスワードが間違っています", "error")
+        return render_template("login.html"), 401
+
+    user_id, user_email, _ = user
+    access_token = create_access_token(identity=str(user_id))
+    flask_session["user_id"] = user_id
+    flask_session["access_token"] = access_token
+
+    logger.info(f"User {user_email} logged in")
+    return redirect(url_for("home_page"))
 
 @app.route("/api/stations", methods=["GET"], strict_slashes=False)
 def api_stations():
-    """API: スタンド一覧"""
-    with get_session_context() as session:
-        stations = session.query(Station).all()
-        result = []
-        for s in stations:
-            available = get_available_batteries_count(s.id)
-            result.append({
-                "id": s.id,
-                "name": s.name,
-                "location": s.location,
-                "available": available
-            })
-        return jsonify(result)
+    """
+    API: スタンド一覧
+
+    プロセス内キャッシュから返す。If-None-Match が現在の ETag と一致すれば
+    DB に触れずに 304 を返す（ポーリングするクライアント向け）。
+    """
+    stations, etag = availability_cache.get(load_station_availability)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify([
+            {
+                "id": s["id"],
+                "name": s["name"],
+                "location": s["location"],
+                "available": s["available_count"]
+            }
+            for s in stations
+        ])
+    response.set_etag(etag)
+    # 毎回 ETag で再検証させる（古い在庫数を表示させない）
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/stations/nearby", methods=["GET"], strict_slashes=False)
+def api_stations_nearby():
+    """
+    API: 近くのスタンド検索
+
+    クエリパラメータ:
+      lat, lng       : 検索地点（必須）
+      radius         : 検索半径（m）
+      limit          : 最大件数
+      min_available  : 利用可能バッテリー数の下限
+    """
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+    except (KeyError, ValueError):
+        return jsonify({"msg": "lat and lng required"}), 400
+    try:
+        radius = float(request.args.get("radius", NEARBY_DEFAULT_RADIUS_M))
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"msg": "invalid parameters"}), 400
+    try:
+        min_available = int(request.args.get("min_available", 0))
+    except ValueError:
+        return jsonify({"msg": "invalid min_available"}), 400
+
+    # float() は "nan" / "inf" も受け付ける。NaN は範囲の比較をすべて素通りするので先に弾く
+    if not all(math.isfinite(v) for v in (lat, lng, radius)):
+        return jsonify({"msg": "invalid parameters"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius <= 0 or limit <= 0:
+        return jsonify({"msg": "invalid parameters"}), 400
+
+    radius = min(radius, NEARBY_MAX_RADIUS_M)
+    limit = min(limit, NEARBY_MAX_LIMIT)
+
+    nearest = get_station_index().nearest(
+        lat, lng, k=limit, radius_m=radius, min_available=min_available
+    )
+    return jsonify([
+        {
+            "id": s["id"],
+            "name": s["name"],
+            "location": s["location"],
+            "lat": s["lat"],
+            "lng": s["lng"],
+            "available": s["available_count"],
+            "distance_m": round(distance, 1)
+        }
+        for distance, s in nearest
+    ])
 
 @app.route("/api/rent", methods=["POST"], strict_slashes=False)
 @jwt_required()
 def api_rent():
     """API: 貸出"""
-    user_id = get_jwt_identity()
-    data = request.get_json() or {}
-    battery_id = data.get("battery_id")
-
-    if not battery_id:
-        return jsonify({"msg": "battery_id required"}), 400
-
+    user_id = current_user_id()
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
     try:
-        with get_session_context() as session:
-            with session.begin():
-                user = session.get(User, user_id)
-                battery = session.get(Battery, battery_id)
-
-                if not battery or not battery.available:
-                    return jsonify({"msg": "battery not available"}), 400
+        # SQL を発行する前に ID を検証する（整数でない値は 400）
+        battery_id = normalize_operation_ids("rent", {"battery_id": data.get("battery_id")})["battery_id"]
+    except RentalError as e:
+        return jsonify({"msg": str(e)}), 400
 
-                if user.balance_cents < RENTAL_DEPOSIT_CENTS:
-                    return jsonify({"msg": "insufficient balance"}), 400
-
-                rental = Rental(
-                    user_id=user.id,
-                    battery_id=battery.id,
-                    status="ongoing"
-                )
-                battery.available = False
-                session.add(rental)
+    try:
+        with track_operation("rent", RentalError), write_transaction() as session:
+            rental = rent_battery(session, user_id, battery_id)
 
+        availability_cache.bump()
         return jsonify({"msg": "rented", "rental_id": rental.id})
+    except RentalError as e:
+        return jsonify({"msg": str(e)}), 400
     except Exception as e:
         logger.error(f"API rent failed: {e}")
         return jsonify({"msg": "rental failed"}), 500
@@ -576,42 +1122,27 @@ def api_rent():
 @jwt_required()
 def api_return():
     """API: 返却"""
-    user_id = get_jwt_identity()
-    data = request.get_json() or {}
-    rental_id = data.get("rental_id")
-
-    if not rental_id:
-        return jsonify({"msg": "rental_id required"}), 400
-
+    user_id = current_user_id()
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
     try:
-        with get_session_context() as session:
-            with session.begin():
-                rental = session.get(Rental, rental_id)
-                if not rental or rental.user_id != user_id or rental.status != "ongoing":
-                    return jsonify({"msg": "invalid rental"}), 400
-
-                battery = session.get(Battery, rental.battery_id)
-                user = session.get(User, user_id)
-
-                end_time = datetime.utcnow()
-                start_time = rental.start_at
-                minutes = max(1, int((end_time - start_time).total_seconds() // 60))
-                price = minutes * PRICE_PER_MINUTE_CENTS
-
-                if user.balance_cents < price:
-                    return jsonify({"msg": "insufficient balance"}), 400
+        # SQL を発行する前に ID を検証する（整数でない値は 400）
+        rental_id = normalize_operation_ids("return", {"rental_id": data.get("rental_id")})["rental_id"]
+    except RentalError as e:
+        return jsonify({"msg": str(e)}), 400
 
-                user.balance_cents -= price
-                rental.end_at = end_time
-                rental.price_cents = price
-                rental.status = "returned"
-                battery.available = True
+    try:
+        with track_operation("return", RentalError), write_transaction() as session:
+            price, balance = return_rental(session, user_id, rental_id)
 
+        availability_cache.bump()
         return jsonify({
             "msg": "returned", 
             "price": price,
-            "balance": user.balance_cents
+            "balance": balance
         })
+    except RentalError as e:
+        return jsonify({"msg": str(e)}), 400
     except Exception as e:
         logger.error(f"API return failed: {e}")
         return jsonify({"msg": "return failed"}), 500
@@ -620,7 +1151,7 @@ def api_return():
 @jwt_required()
 def api_charge():
     """API: チャージ"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     data = request.get_json() or {}
     amount = int(data.get("amount", 0))
 
@@ -628,58 +1159,178 @@ def api_charge():
         return jsonify({"msg": "invalid amount"}), 400
 
     try:
-        with get_session_context() as session:
-            with session.begin():
-                user = session.get(User, user_id)
-                user.balance_cents += amount
-
-
+        with track_operation("charge"), write_transaction() as session:
+            # 残高を DB 側で加算し、台帳に記録
+            balance = credit(session, user_id, amount, kind="charge")
+            if balance is None:
+                raise RuntimeError("user not found")
 
         return jsonify({
             "msg": "charged", 
-            "balance": user.balance_cents
+            "balance": balance
         })
     except Exception as e:
         logger.error(f"API charge failed: {e}")
         return jsonify({"msg": "charge failed"}), 500
 
+@app.route("/api/batch", methods=["POST"], strict_slashes=False)
+@jwt_required()
+def api_batch():
+    """
+    API: 貸出・返却・チャージの一括処理（ステーション端末向け）
+
+    【リクエスト】
+    {"operations": [{"op": "return", "rental_id": 1, "return_station_id": 2},
+                    {"op": "rent", "battery_id": 3},
+                    {"op": "charge", "amount": 500}],
+     "chunk_size": 50}
+
+    【レスポンス】
+    {"results": [{"index": 0, "op": "return", "ok": true, "status": 200, "price": 100, "balance": 900},
+                 {"index": 1, "op": "rent", "ok": false, "status": 400, "msg": "battery not available"}, ...]}
+
+    【設計意図】
+    - 操作は並び順に実行し、chunk_size 件（既定 BATCH_CHUNK_SIZE）ごとに1トランザクション・1コミットにする
+    - 各操作は SAVEPOINT の中で実行するので、残高不足などの業務エラーはその1件だけが失敗になる
+    - ID が整数でない操作は SQL を発行せずにその1件だけ 400 にする（チャンクを中断させない）
+    - DB エラーなどで途中のチャンクが失敗した場合は 500 を返し、results には
+      コミット済みのチャンクの結果だけを入れる（それ以降の操作は実行されていない）
+    """
+    user_id = current_user_id()
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations")
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"msg": "operations required"}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({"msg": f"too many operations (max {BATCH_MAX_OPERATIONS})"}), 400
+    try:
+        chunk_size = int(data.get("chunk_size") or BATCH_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "invalid chunk_size"}), 400
+    chunk_size = max(1, chunk_size)
+
+    results = []
+    try:
+        for start in range(0, len(operations), chunk_size):
+            with write_transaction(immediate=True) as session:
+                chunk_results = [
+                    run_batch_item(session, user_id, index, operations[index])
+                    for index in range(start, min(start + chunk_size, len(operations)))
+                ]
+            results.extend(chunk_results)
+
+            # 貸出・返却が1件でも確定したらチャンクごとに1回だけ在庫キャッシュを無効化
+            if any(r["ok"] and r["op"] in ("rent", "return") for r in chunk_results):
+                availability_cache.bump()
+    except Exception as e:
+        logger.error(f"API batch failed: {e}")
+        return jsonify({"msg": "batch failed", "results": results}), 500
+
+    return jsonify({"results": results})
+
+@app.route("/api/telemetry", methods=["POST"], strict_slashes=False)
+def api_telemetry():
+    """
+    API: ステーションからのバッテリー残量の取り込み
+
+    【リクエスト】
+    X-API-Key: TELEMETRY_API_KEY
+    {"readings": [{"serial": "BT0000000001", "level": 87, "ts": 1760000000}, ...]}
+
+    【注意】
+    - DB には書かずにバッファへ入れて 202 を返す（書き出しは telemetry.py の
+      バックグラウンドスレッドがまとめて行う）
+    - 不正な計測値は捨てて件数だけ返す（1件の不正で他の計測を失わないように）
+    """
+    if not api_key_matches(TELEMETRY_API_KEY):
+        return jsonify({"msg": "invalid api key"}), 401
+
+    data = request.get_json(silent=True) or {}
+    items = data.get("readings") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"msg": "readings required"}), 400
+    if len(items) > TELEMETRY_MAX_READINGS:
+        return jsonify({"msg": f"too many readings (max {TELEMETRY_MAX_READINGS})"}), 400
+
+    readings, rejected = parse_readings(items)
+    telemetry_buffer.add(readings)
+    return jsonify({"accepted": len(readings), "rejected": rejected}), 202
+
+@app.route("/api/admin/stats/stations/<int:station_id>", methods=["GET"], strict_slashes=False)
+def api_station_stats(station_id):
+    """
+    API: スタンドの利用集計（station_id = 0 は全スタンドの合計）
+
+    GET /api/admin/stats/stations/12?since=2025-01-01&until=2025-04-01&bucket=day
+    X-API-Key: ADMIN_API_KEY
+
+    集計テーブル（rollup.py）だけを読む。since / until は UTC（+09:00 などのオフセットつきは
+    UTC に直す）、省略時は直近30日。
+    """
+    if not api_key_matches(ADMIN_API_KEY):
+        return jsonify({"msg": "invalid api key"}), 401
+
+    bucket = request.args.get("bucket", "hour")
+    try:
+        until = as_utc_naive(request.args["until"]) if "until" in request.args else datetime.utcnow()
+        since = as_utc_naive(request.args["since"]) if "since" in request.args else until - timedelta(days=30)
+    except ValueError:
+        return jsonify({"msg": "invalid since or until"}), 400
+    if bucket not in ("hour", "day"):
+        return jsonify({"msg": "bucket must be hour or day"}), 400
+    if not since < until or until - since > timedelta(days=STATS_MAX_DAYS):
+        return jsonify({"msg": f"invalid range (max {STATS_MAX_DAYS} days)"}), 400
+
+    return jsonify(station_stats(get_db().connection(), station_id, since, until, bucket))
+
 @app.route("/api/user", methods=["GET"], strict_slashes=False)
 @jwt_required()
 def api_user():
     """API: ユーザー情報取得"""
-    user_id = get_jwt_identity()
-    with get_session_context() as session:
-        user = session.get(User, user_id)
-        if not user:
-            return jsonify({"msg": "user not found"}), 404
-
-        return jsonify({
-            "id": user.id,
-            "email": user.email,
-            "balance": user.balance_cents,
-            "created_at": user.created_at.isoformat()
-        })
+    user_id = current_user_id()
+    session = get_db()
+    user = session.get(User, user_id)
+    if not user:
+        return jsonify({"msg": "user not found"}), 404
+
+    return jsonify({
+        "id": user.id,
+        "email": user.email,
+        "balance": user.balance_cents,
+        "created_at": user.created_at.isoformat()
+    })
 
 @app.route("/api/history", methods=["GET"], strict_slashes=False)
 @jwt_required()
 def api_history():
-    """API: 利用履歴取得"""
-    user_id = get_jwt_identity()
-    rentals_data = get_user_rentals_with_details(user_id)
-    
-    history = []
-    for rental, battery, station in rentals_data:
-        history.append({
-            "id": rental.id,
-            "start_at": rental.start_at.isoformat(),
-            "end_at": rental.end_at.isoformat() if rental.end_at else None,
-            "battery_serial": battery.serial if battery else None,
-            "station_name": station.name if station else None,
-            "price": rental.price_cents if rental.price_cents else 0,
-            "status": rental.status
-        })
+    """
+    API: 利用履歴取得（キーセットページング）
+
+    クエリパラメータ:
+      limit  : 1ページの件数
+      cursor : 前のレスポンスの next_cursor（省略時は最新から）
+    """
+    user_id = current_user_id()
+    try:
+        limit = parse_history_limit(request.args.get("limit"))
+        cursor = request.args.get("cursor")
+        after_id = decode_history_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"msg": "invalid limit or cursor"}), 400
 
-    return jsonify(history)
+    rentals_data, next_id = get_user_rentals_with_details(user_id, limit, after_id)
+    
+    return jsonify({
+        "history": [history_item(*row) for row in rentals_data],
+        "next_cursor": encode_history_cursor(next_id) if next_id else None
+    })
+
+@app.route("/metrics", methods=["GET"], strict_slashes=False)
+def metrics_endpoint():
+    """Prometheus 形式のメトリクス（gunicorn の複数ワーカー分をまとめて返す）"""
+    body, content_type = render_metrics()
+    return app.response_class(body, mimetype=None, content_type=content_type)
 
 # ====================
 # エラーハンドリング
@@ -0,0 +1,201 @@
+"""
+asgi_api.py - 読み取り API の非同期版（ASGI）
+=====================================================
+【設計意図】
+- 大量のキオスク端末が /api/stations などをポーリングしても、少ないプロセスで捌く
+  （Flask の同期ワーカーは遅いクライアント・遅いクエリ1件でスレッドを1つ占有する）
+- 非同期 SQLAlchemy（aiosqlite / asyncpg）で DB を待つ間も他のリクエストを処理する
+- モデル（models.py）・クエリ（availability.py / history.py）・レスポンス形式は
+  Flask 版と共通。パスも同じなので、リバースプロキシで振り分けるだけで切り替えられる
+- 書き込み（貸出・返却・チャージ）は Flask 側のみ。ここは読み取り専用
+- SSE の接続は待機中にスレッドを占有しないので、1プロセスで数千接続を保持できる
+
+対象:
+  GET /api/stations   在庫一覧（ETag / 304 対応）
+  GET /api/stations/stream  在庫の差分（Server-Sent Events, station_stream.py）
+  GET /api/user       ユーザー情報（JWT 必須）
+  GET /api/history    利用履歴（JWT 必須・キーセットページング）
+
+起動方法:
+  uvicorn asgi_api:app --host 0.0.0.0 --port 8001 --workers 2
+
+【認証】
+- Flask 版（flask-jwt-extended）が発行したアクセストークンをそのまま使える
+  （同じ JWT_SECRET_KEY・HS256 で検証し、type=access と sub を確認する）
+=====================================================
+"""
+
+import jwt
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from async_db import AsyncSessionLocal
+from availability import station_availability_query, station_rows_to_dicts, AsyncAvailabilityCache
+from history import (
+    decode_history_cursor, encode_history_cursor, parse_history_limit,
+    user_history_query, split_history_page, history_item
+)
+from models import User
+from station_stream import StationBroadcaster, StreamUnavailableError, station_counts_query
+from variables import (
+    JWT_SECRET_KEY, AVAILABILITY_CACHE_TTL_SECONDS,
+    STREAM_POLL_INTERVAL_MS, STREAM_SNAPSHOT_SECONDS, STREAM_KEEPALIVE_SECONDS,
+    STREAM_REPLAY_EVENTS, STREAM_SUBSCRIBER_QUEUE, STREAM_READY_TIMEOUT_SECONDS
+)
+
+availability_cache = AsyncAvailabilityCache(AVAILABILITY_CACHE_TTL_SECONDS)
+
+
+async def load_station_counts():
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(station_counts_query())
+        return {row.id: row.available_count or 0 for row in result.all()}
+
+
+station_broadcaster = StationBroadcaster(
+    load_station_counts,
+    poll_interval_ms=STREAM_POLL_INTERVAL_MS,
+    snapshot_seconds=STREAM_SNAPSHOT_SECONDS,
+    replay_events=STREAM_REPLAY_EVENTS,
+    subscriber_queue=STREAM_SUBSCRIBER_QUEUE,
+    ready_timeout=STREAM_READY_TIMEOUT_SECONDS,
+)
+
+
+class AuthError(Exception):
+    def __init__(self, msg, status_code=401):
+        super().__init__(msg)
+        self.status_code = status_code
+
+
+def current_user_id(request):
+    """Authorization: Bearer <token> を検証してユーザーIDを返す（失敗時は AuthError）"""
+    header = request.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme != "Bearer" or not token:
+        raise AuthError("Missing Authorization Header")
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise AuthError("Token has expired")
+    except jwt.InvalidTokenError as e:
+        raise AuthError(str(e), status_code=422)
+    if claims.get("type") != "access" or "sub" not in claims:
+        raise AuthError("Only access tokens are allowed", status_code=422)
+    try:
+        return int(claims["sub"])
+    except (TypeError, ValueError):
+        # 署名は正しいがユーザーIDでない sub（別用途のトークンなど）
+        raise AuthError("Invalid token subject")
+
+
+async def load_station_availability():
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(station_availability_query())
+        return station_rows_to_dicts(result.all())
+
+
+async def api_stations(request):
+    """API: スタンド一覧（If-None-Match が一致すれば 304）"""
+    stations, etag = await availability_cache.get(load_station_availability)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("If-None-Match", "")
+    if f'"{etag}"' in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return JSONResponse([
+        {
+            "id": s["id"],
+            "name": s["name"],
+            "location": s["location"],
+            "available": s["available_count"]
+        }
+        for s in stations
+    ], headers=headers)
+
+
+async def api_stations_stream(request):
+    """
+    API: 在庫の差分ストリーム（text/event-stream）
+
+    接続直後に snapshot（Last-Event-ID で再開できる場合は取りこぼした delta）を送り、
+    以降は在庫が変わるたびに delta を送る。最初の在庫を読めなければ 503。
+    """
+    try:
+        subscriber, initial = await station_broadcaster.subscribe(request.headers.get("Last-Event-ID"))
+    except StreamUnavailableError:
+        return JSONResponse({"msg": "station stream unavailable"}, status_code=503,
+                            headers={"Retry-After": "3"})
+
+    async def events():
+        try:
+            # 切断時の再接続までの待ち時間（ミリ秒）
+            yield b"retry: 3000\n\n"
+            for message in initial:
+                yield message
+            while True:
+                message = await subscriber.next(STREAM_KEEPALIVE_SECONDS)
+                if message is not None:
+                    yield message
+                elif subscriber.dropped:
+                    break
+                else:
+                    yield b": keepalive\n\n"
+        finally:
+            station_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # nginx のバッファリングを止める（イベントをすぐに届ける）
+        "X-Accel-Buffering": "no",
+    })
+
+
+async def api_user(request):
+    """API: ユーザー情報取得"""
+    user_id = current_user_id(request)
+    async with AsyncSessionLocal() as session:
+        user = await session.get(User, user_id)
+    if not user:
+        return JSONResponse({"msg": "user not found"}, status_code=404)
+    return JSONResponse({
+        "id": user.id,
+        "email": user.email,
+        "balance": user.balance_cents,
+        "created_at": user.created_at.isoformat()
+    })
+
+
+async def api_history(request):
+    """API: 利用履歴取得（キーセットページング）"""
+    user_id = current_user_id(request)
+    try:
+        limit = parse_history_limit(request.query_params.get("limit"))
+        cursor = request.query_params.get("cursor")
+        after_id = decode_history_cursor(cursor) if cursor else None
+    except ValueError:
+        return JSONResponse({"msg": "invalid limit or cursor"}, status_code=400)
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(user_history_query(user_id, limit, after_id))
+        rows, next_id = split_history_page(result.all(), limit)
+
+    return JSONResponse({
+        "history": [history_item(*row) for row in rows],
+        "next_cursor": encode_history_cursor(next_id) if next_id else None
+    })
+
+
+async def auth_error(request, exc):
+    return JSONResponse({"msg": str(exc)}, status_code=exc.status_code)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/stations", api_stations, methods=["GET"]),
+        Route("/api/stations/stream", api_stations_stream, methods=["GET"]),
+        Route("/api/user", api_user, methods=["GET"]),
+        Route("/api/history", api_history, methods=["GET"]),
+    ],
+    exception_handlers={AuthError: auth_error},
+)
@@ -0,0 +1,50 @@
+"""
+async_db.py - 非同期エンジン・セッション（asgi_api.py 用）
+=====================================================
+【設計意図】
+- models.py・db.py のプロファイル（プール設定・SQLite の PRAGMA・SQL 計測）をそのまま使う
+- ドライバは URL から自動で切り替える
+    sqlite:///...        → sqlite+aiosqlite:///...
+    postgresql://...     → postgresql+asyncpg://...
+  ASYNC_DATABASE_URL を設定すればそちらを優先する
+- Flask 側（db.py）とは別のエンジン。同じプロセスで両方を使うことはない
+=====================================================
+"""
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db import get_profile, engine_options, install_sqlite_pragmas, instrument_engine, is_sqlite_url
+from variables import DATABASE_URL, ASYNC_DATABASE_URL, DB_PROFILE
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url):
+    """同期ドライバの URL を非同期ドライバの URL に書き換える"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"no async driver for {backend}")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def build_async_engine(url=None, profile_name=DB_PROFILE):
+    url = url or ASYNC_DATABASE_URL or to_async_url(DATABASE_URL)
+    profile = get_profile(profile_name)
+    new_engine = create_async_engine(url, **engine_options(url, profile))
+
+    # イベントは同期側のエンジンに登録する（PRAGMA・SQL 計測は db.py と共通）
+    if is_sqlite_url(url):
+        install_sqlite_pragmas(new_engine.sync_engine, url, profile)
+    instrument_engine(new_engine.sync_engine)
+    return new_engine
+
+
+async_engine = build_async_engine()
+
+# expire_on_commit=False: 読み取り専用なので、コミット後も読んだオブジェクトをそのまま返す
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
@@ -1,8 +1,40 @@
+"""
+auth.py - パスワードのハッシュ化・照合
+=====================================================
+【設計意図】
+- PBKDF2 は意図的に重い処理（1回数十ms の CPU）。ログインが集中すると
+  ワーカーのスレッドが全部ハッシュ計算で埋まり、貸出・返却が待たされる
+- そこでリクエストからのハッシュ計算は専用のスレッドプール（HashingExecutor）に
+  投げ、同時実行数を HASH_MAX_WORKERS に制限する
+  （hashlib の PBKDF2 は計算中に GIL を手放すので、スレッドでも CPU を並列に使える）
+- 待ち行列も HASH_MAX_PENDING 件で打ち切り、溢れたら HashingBusyError を送出する
+  → 呼び出し側は 503 + Retry-After を返す（ログイン以外のリクエストを守る）
+- 反復回数は variables.py の PBKDF2_ROUNDS で変更できる。
+  設定と異なる回数で保存されたハッシュは、ログイン成功時に新しい回数で作り直す
+=====================================================
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
 from passlib.context import CryptContext
 
+from variables import (
+    PBKDF2_ROUNDS, HASH_MAX_WORKERS, HASH_MAX_PENDING,
+    HASH_WAIT_TIMEOUT_SECONDS, HASH_SLOW_QUEUE_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# min/max を既定値と同じにすると、回数の違うハッシュは needs_update() が True になる
 pwd_context = CryptContext(
     schemes=["pbkdf2_sha256"],
-    deprecated="auto"
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__max_rounds=PBKDF2_ROUNDS,
 )
 
 def hash_password(password: str) -> str:
@@ -10,3 +42,125 @@ def hash_password(password: str) -> str:
 
 def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
+
+
+class HashingBusyError(Exception):
+    """ハッシュ計算の待ち行列が満杯、または待ち時間が上限を超えた"""
+
+
+# 待ち時間（秒）と断った理由（"queue_full" / "timeout"）を受け取る関数（metrics.py が登録する）
+hash_queue_wait_observers = []
+hash_rejected_observers = []
+
+
+class HashingExecutor:
+    """
+    同時実行数と待ち行列の長さを制限したハッシュ計算用スレッドプール
+
+    【使用例】
+    ok, new_hash = hashing_executor.run(pwd_context.verify_and_update, password, hashed)
+
+    stats() で投入数・拒否数・待ち時間（キューに入ってから計算開始まで）を返す。
+    待ち時間と拒否は hash_queue_wait_observers / hash_rejected_observers にも通知する。
+    """
+
+    def __init__(self, max_workers, max_pending, wait_timeout, slow_queue_seconds):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self.slow_queue_seconds = slow_queue_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hashing")
+        # 実行中 + 待ち行列の件数を数える（上限を超えたら投入せずに拒否）
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._in_flight = 0
+        self._queue_seconds_total = 0.0
+        self._queue_seconds_max = 0.0
+        self._run_seconds_total = 0.0
+        self._completed = 0
+
+    def _call(self, enqueued_at, fn, args):
+        queued = time.monotonic() - enqueued_at
+        for observer in hash_queue_wait_observers:
+            observer(queued)
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            ran = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._queue_seconds_total += queued
+                self._queue_seconds_max = max(self._queue_seconds_max, queued)
+                self._run_seconds_total += ran
+            self._slots.release()
+            if queued >= self.slow_queue_seconds:
+                logger.warning(f"password hashing queued {queued * 1000:.0f}ms")
+
+    def run(self, fn, *args):
+        """fn(*args) をプールで実行して結果を返す（混雑時は HashingBusyError）"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            for observer in hash_rejected_observers:
+                observer("queue_full")
+            raise HashingBusyError("password hashing queue is full")
+
+        with self._lock:
+            self._submitted += 1
+            self._in_flight += 1
+        future = self._pool.submit(self._call, time.monotonic(), fn, args)
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except FutureTimeoutError:
+            # まだ始まっていなければ取り消す（始まっていれば計算は最後まで走り、枠は _call が返す）
+            if future.cancel():
+                with self._lock:
+                    self._in_flight -= 1
+                self._slots.release()
+            with self._lock:
+                self._timed_out += 1
+            for observer in hash_rejected_observers:
+                observer("timeout")
+            raise HashingBusyError("password hashing timed out")
+
+    def stats(self):
+        with self._lock:
+            completed = self._completed
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "submitted": self._submitted,
+                "completed": completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "in_flight": self._in_flight,
+                "queue_seconds_avg": self._queue_seconds_total / completed if completed else 0.0,
+                "queue_seconds_max": self._queue_seconds_max,
+                "run_seconds_avg": self._run_seconds_total / completed if completed else 0.0,
+            }
+
+
+hashing_executor = HashingExecutor(
+    max_workers=HASH_MAX_WORKERS,
+    max_pending=HASH_MAX_PENDING,
+    wait_timeout=HASH_WAIT_TIMEOUT_SECONDS,
+    slow_queue_seconds=HASH_SLOW_QUEUE_SECONDS,
+)
+
+def hash_password_limited(password: str) -> str:
+    """hash_password をハッシュ用プールで実行する（リクエスト処理から呼ぶ）"""
+    return hashing_executor.run(hash_password, password)
+
+def verify_password_limited(password: str, hashed: str):
+    """
+    パスワードを照合し、必要なら新しい反復回数で作り直したハッシュも返す
+
+    【戻り値】
+    (一致したか, 新しいハッシュ or None)
+    """
+    return hashing_executor.run(pwd_context.verify_and_update, password, hashed)
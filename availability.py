@@ -0,0 +1,252 @@
+"""
+availability.py - スタンド在庫（利用可能バッテリー数）の集計
+=====================================================
+【設計意図】
+- スタンドごとに COUNT を発行する N+1 クエリを避ける
+- 在庫数は stations.available_count（非正規化カウンタ）から読むだけにする
+- カウンタは貸出・返却・移動と同じトランザクションで増減する
+- batteries からの実集計（LEFT JOIN + GROUP BY）はズレの検出・修復に使う
+- 一覧はプロセス内キャッシュに載せ、貸出・返却でバージョンを上げて無効化する
+- カウンタの増減はセッションに記録しておき、コミット後に近隣検索の空間インデックスへ
+  差分として反映する（全スタンドを読み直さない。app.py の after_commit）
+=====================================================
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+from sqlalchemy import select, update, func, and_
+
+from models import Station, Battery
+
+
+def station_availability_query():
+    """在庫一覧の SELECT 文（同期・非同期のセッションで共用）"""
+    return select(
+        Station.id,
+        Station.name,
+        Station.location,
+        Station.lat,
+        Station.lng,
+        Station.available_count,
+    ).order_by(Station.id)
+
+
+def station_rows_to_dicts(rows):
+    return [
+        {
+            "id": row.id,
+            "name": row.name,
+            "location": row.location,
+            "lat": row.lat,
+            "lng": row.lng,
+            "available_count": row.available_count or 0,
+        }
+        for row in rows
+    ]
+
+
+def get_station_availability(session):
+    """全スタンドの在庫一覧を辞書のリストで返す（カウンタ列を読むだけ）"""
+    return station_rows_to_dicts(session.execute(station_availability_query()).all())
+
+
+def stations_etag(stations):
+    """在庫一覧の内容から ETag を作る（内容が同じなら同じ値）"""
+    body = json.dumps(stations, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(body).hexdigest()
+
+
+# session.info に溜める、このトランザクションでの在庫カウンタの増減 [(station_id, delta), ...]
+PENDING_DELTAS_KEY = "available_count_deltas"
+
+
+def adjust_available_count(session, station_id, delta):
+    """
+    スタンドの在庫カウンタを delta だけ増減する
+
+    station_id にはスタンドIDのほか、スタンドIDを返すスカラーサブクエリも渡せる。
+    更新したスタンドIDは RETURNING で受け取り、増減と一緒に session.info に記録する
+    （コミット後に pop_available_count_deltas() で取り出す）。
+
+    【戻り値】
+    更新したスタンドID（該当がなければ None）
+
+    【注意】
+    - 呼び出し元のトランザクション内で実行すること
+    - available_count = available_count + :delta の形で DB 側で加算する
+      （読み取り→書き込みの間に他のリクエストが割り込んでも値を失わない）
+    """
+    if station_id is None or delta == 0:
+        return None
+    updated_id = session.execute(
+        update(Station)
+        .where(Station.id == station_id)
+        .values(available_count=Station.available_count + delta)
+        .returning(Station.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if updated_id is not None:
+        session.info.setdefault(PENDING_DELTAS_KEY, []).append((updated_id, delta))
+    return updated_id
+
+
+def pending_available_count_deltas(session):
+    """このトランザクションで記録した増減のリスト（SAVEPOINT を戻したときに切り詰める用）"""
+    return session.info.setdefault(PENDING_DELTAS_KEY, [])
+
+
+def pop_available_count_deltas(session):
+    """記録した増減を取り出して消す（コミット・ロールバック時に呼ぶ）"""
+    return session.info.pop(PENDING_DELTAS_KEY, None) or []
+
+
+def actual_availability_query():
+    """batteries から実際の利用可能数を集計する SELECT 文（LEFT JOIN + GROUP BY）"""
+    return (
+        select(
+            Station.id,
+            Station.available_count,
+            func.count(Battery.id).label("actual_count"),
+        )
+        .outerjoin(
+            Battery,
+            and_(Battery.station_id == Station.id, Battery.available == True)
+        )
+        .group_by(Station.id, Station.available_count)
+        .order_by(Station.id)
+    )
+
+
+def reconcile_available_counts(session, fix=False):
+    """
+    カウンタと実際のバッテリー行のズレを検出する
+
+    【戻り値】
+    [(station_id, カウンタ値, 実際の数), ...]（ズレがあるスタンドのみ）
+
+    fix=True の場合はズレたスタンドのカウンタを実集計値で上書きする。
+    上書きは相関サブクエリの UPDATE 1文で行うため、検出から修復までの間に
+    貸出・返却が入っても最新の実数で揃う。
+    """
+    drifts = [
+        (row.id, row.available_count, row.actual_count)
+        for row in session.execute(actual_availability_query())
+        if row.available_count != row.actual_count
+    ]
+
+    if fix and drifts:
+        actual = (
+            select(func.count(Battery.id))
+            .where(Battery.station_id == Station.id, Battery.available == True)
+            .scalar_subquery()
+        )
+        session.execute(
+            update(Station)
+            .where(Station.id.in_([station_id for station_id, _, _ in drifts]))
+            .values(available_count=actual)
+            .execution_options(synchronize_session=False)
+        )
+
+    return drifts
+
+
+class AvailabilityCache:
+    """
+    スタンド一覧（在庫数つき）のプロセス内キャッシュ
+
+    【設計意図】
+    - 単調増加するバージョン番号でキャッシュを管理する
+    - 貸出・返却のコミット後に bump() でバージョンを上げ、次の読み取りで作り直す
+    - 他プロセス（別の gunicorn ワーカーや admin.py）の書き込みは
+      バージョンでは検知できないため、TTL 経過でも作り直す
+    - ETag は内容のハッシュ。TTL で作り直しても中身が同じなら ETag は変わらない
+
+    【使用例】
+    stations, etag = availability_cache.get(loader)
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._version = 0
+        # bump() は貸出・返却の直後に呼ばれるため、作り直し中の DB 読み込みを待たせない
+        self._version_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        # (バージョン, 作成時刻, スタンド一覧, ETag)
+        self._entry = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def bump(self):
+        """在庫が変わったことを通知する（コミット後に呼ぶこと）"""
+        with self._version_lock:
+            self._version += 1
+            return self._version
+
+    def _is_fresh(self, entry):
+        return (
+            entry is not None
+            and entry[0] == self._version
+            and time.monotonic() - entry[1] < self.ttl_seconds
+        )
+
+    def get(self, loader):
+        """
+        (スタンド一覧, ETag) を返す
+
+        キャッシュが新しければ DB に触れない。古ければ loader() で作り直す。
+        作り直しはロック内で1スレッドだけが行い、他は結果を待って再利用する。
+        """
+        entry = self._entry
+        if self._is_fresh(entry):
+            return entry[2], entry[3]
+
+        with self._rebuild_lock:
+            entry = self._entry
+            if self._is_fresh(entry):
+                return entry[2], entry[3]
+
+            # 読み込み前のバージョンで登録する（読み込み中に bump されたら次回作り直す）
+            version = self._version
+            stations = loader()
+            etag = stations_etag(stations)
+            self._entry = (version, time.monotonic(), stations, etag)
+            return stations, etag
+
+
+class AsyncAvailabilityCache:
+    """
+    AvailabilityCache の asyncio 版（asgi_api.py 用）
+
+    ASGI プロセスは貸出・返却を処理しないため、バージョンではなく TTL だけで作り直す。
+    作り直しは asyncio.Lock の中で1タスクだけが行い、他のタスクは結果を待って再利用する。
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._lock = asyncio.Lock()
+        # (作成時刻, スタンド一覧, ETag)
+        self._entry = None
+
+    def _is_fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[0] < self.ttl_seconds
+
+    async def get(self, loader):
+        """(スタンド一覧, ETag) を返す（loader は await できる関数）"""
+        entry = self._entry
+        if self._is_fresh(entry):
+            return entry[1], entry[2]
+
+        async with self._lock:
+            entry = self._entry
+            if self._is_fresh(entry):
+                return entry[1], entry[2]
+            stations = await loader()
+            etag = stations_etag(stations)
+            self._entry = (time.monotonic(), stations, etag)
+            return stations, etag
@@ -0,0 +1,122 @@
+"""
+近隣スタンド検索（グリッド空間インデックス）のベンチマーク
+=====================================================
+ランダムに配置した大量のスタンドに対して StationGridIndex.nearest() の
+レイテンシを測り、全件との距離計算（総当たり）の結果と一致するか確認する。
+DB は使わない（インデックス単体の性能を見る）。
+
+実行方法（リポジトリのルートで）:
+  python -m benchmarks.bench_nearby
+  python -m benchmarks.bench_nearby --stations 100000 --queries 2000 --k 10 --radius 3000
+=====================================================
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from geo_index import StationGridIndex, haversine_m
+
+# 首都圏 + 関西のおおよその範囲にスタンドを散らす
+REGIONS = [
+    (35.5, 35.9, 139.4, 139.95),
+    (34.55, 34.85, 135.35, 135.65),
+]
+
+
+def make_stations(n, rng):
+    stations = []
+    for i in range(1, n + 1):
+        lat_min, lat_max, lng_min, lng_max = rng.choice(REGIONS)
+        stations.append({
+            "id": i,
+            "name": f"Station {i}",
+            "location": None,
+            "lat": rng.uniform(lat_min, lat_max),
+            "lng": rng.uniform(lng_min, lng_max),
+            "available_count": rng.randint(0, 5),
+        })
+    return stations
+
+
+def brute_force(stations, lat, lng, k, radius_m, min_available):
+    found = []
+    for s in stations:
+        if s["available_count"] < min_available:
+            continue
+        d = haversine_m(lat, lng, s["lat"], s["lng"])
+        if d <= radius_m:
+            found.append((d, s["id"]))
+    found.sort()
+    return [sid for _, sid in found[:k]]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--radius", type=float, default=3000)
+    parser.add_argument("--min-available", type=int, default=1)
+    parser.add_argument("--cell-deg", type=float, default=0.0025)
+    parser.add_argument("--verify", type=int, default=50, help="総当たりで答え合わせする件数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    stations = make_stations(args.stations, rng)
+
+    index = StationGridIndex(cell_deg=args.cell_deg)
+    t0 = time.perf_counter()
+    index.sync(stations)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    # 1% のスタンドを追加・移動したときの差分更新
+    updated = [dict(s) for s in stations]
+    for s in rng.sample(updated, len(updated) // 100):
+        s["lat"] += 0.001
+    updated.extend(make_stations(len(stations) // 100, rng))
+    for i, s in enumerate(updated[len(stations):], start=len(stations) + 1):
+        s["id"] = i
+    t0 = time.perf_counter()
+    added, moved, removed = index.sync(updated)
+    resync_ms = (time.perf_counter() - t0) * 1000
+    stations = updated
+
+    queries = []
+    for _ in range(args.queries):
+        lat_min, lat_max, lng_min, lng_max = rng.choice(REGIONS)
+        queries.append((rng.uniform(lat_min, lat_max), rng.uniform(lng_min, lng_max)))
+
+    timings = []
+    for lat, lng in queries:
+        t0 = time.perf_counter()
+        index.nearest(lat, lng, k=args.k, radius_m=args.radius, min_available=args.min_available)
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    for lat, lng in queries[:args.verify]:
+        got = [s["id"] for _, s in index.nearest(
+            lat, lng, k=args.k, radius_m=args.radius, min_available=args.min_available
+        )]
+        expected = brute_force(stations, lat, lng, args.k, args.radius, args.min_available)
+        assert got == expected, f"結果が総当たりと一致しません: {(lat, lng)}"
+
+    print(f"stations      : {len(stations)}")
+    print(f"build         : {build_ms:.1f} ms")
+    print(f"incremental   : {resync_ms:.1f} ms (added={added} moved={moved} removed={removed})")
+    print(f"nearest k={args.k} radius={args.radius:.0f}m min_available={args.min_available}")
+    print(f"  p50         : {statistics.median(timings):.3f} ms")
+    print(f"  p95         : {percentile(timings, 95):.3f} ms")
+    print(f"  p99         : {percentile(timings, 99):.3f} ms")
+    print(f"verified      : {min(args.verify, len(queries))} queries match brute force")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
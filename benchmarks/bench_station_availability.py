@@ -0,0 +1,153 @@
+"""
+スタンド在庫集計のベンチマーク
+=====================================================
+以下の3方式を比較し、スタンド数ごとのクエリ発行数とレイテンシを表示する。
+- N+1: スタンドごとに COUNT を発行する旧実装
+- grouped: LEFT JOIN + GROUP BY の集計1クエリ
+- counter: stations.available_count を読むだけ（現在の実装）
+
+実行方法（リポジトリのルートで）:
+  python -m benchmarks.bench_station_availability
+  python -m benchmarks.bench_station_availability --sizes 10 100 1000 5000 --batteries 3
+
+【注意】
+- 一時ディレクトリの SQLite を使うため、既存の DB には触れない
+=====================================================
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# db.py が import 時に DATABASE_URL を読むため、先に一時 DB を指定する
+_TMP_DIR = tempfile.mkdtemp(prefix="bench_availability_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'bench.db')}"
+
+from sqlalchemy import event, insert, delete, func  # noqa: E402
+
+from db import engine, get_session_context  # noqa: E402
+from models import Base, Station, Battery  # noqa: E402
+from availability import get_station_availability, actual_availability_query  # noqa: E402
+
+
+class QueryCounter:
+    """エンジンに発行された SQL の本数を数える"""
+
+    def __init__(self, bind):
+        self.count = 0
+        event.listen(bind, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def seed(n_stations, batteries_per_station):
+    """スタンドとバッテリーを一括投入（Core の executemany）"""
+    with engine.begin() as conn:
+        conn.execute(delete(Battery))
+        conn.execute(delete(Station))
+        available_per_station = sum(1 for j in range(batteries_per_station) if j % 3 != 0)
+        conn.execute(insert(Station), [
+            {
+                "id": i, "name": f"Station {i}", "lat": 35.0, "lng": 139.0,
+                "available_count": available_per_station,
+            }
+            for i in range(1, n_stations + 1)
+        ])
+        conn.execute(insert(Battery), [
+            {
+                "serial": f"B{i:06d}-{j}",
+                "station_id": i,
+                # 一部を貸出中にして集計結果に差が出るようにする
+                "available": j % 3 != 0,
+                "battery_level": 100,
+            }
+            for i in range(1, n_stations + 1)
+            for j in range(batteries_per_station)
+        ])
+
+
+def _count_available(station_id):
+    """旧 get_available_batteries_count と同じ: 別セッションで COUNT"""
+    with get_session_context() as session:
+        return session.query(func.count(Battery.id)).filter(
+            Battery.station_id == station_id,
+            Battery.available == True
+        ).scalar() or 0
+
+
+def n_plus_one():
+    """旧実装: スタンド一覧 + スタンドごとに別セッションで COUNT"""
+    with get_session_context() as session:
+        stations = session.query(Station).all()
+        return [
+            {"id": s.id, "available_count": _count_available(s.id)}
+            for s in stations
+        ]
+
+
+def grouped():
+    """LEFT JOIN + GROUP BY の1クエリ"""
+    with get_session_context() as session:
+        return [
+            {"id": row.id, "available_count": row.actual_count}
+            for row in session.execute(actual_availability_query())
+        ]
+
+
+def counter_column():
+    """現在の実装: 在庫カウンタ列を読むだけ"""
+    with get_session_context() as session:
+        return get_station_availability(session)
+
+
+def measure(fn, counter, repeat):
+    """クエリ数（1回あたり）とレイテンシ（中央値 ms）を返す"""
+    timings = []
+    queries = 0
+    result = None
+    for _ in range(repeat):
+        counter.count = 0
+        t0 = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+        queries = counter.count
+    return queries, statistics.median(timings), result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--batteries", type=int, default=3, help="スタンドあたりのバッテリー数")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    # ベンチマーク中は SQL ログを出さない
+    engine.echo = False
+    Base.metadata.create_all(bind=engine)
+    counter = QueryCounter(engine)
+
+    variants = [("N+1", n_plus_one), ("grouped", grouped), ("counter", counter_column)]
+    header = " | ".join(f"{name + ' queries':>15} {name + ' ms':>11}" for name, _ in variants)
+    print(f"{'stations':>9} | {header}")
+    print("-" * (12 + 30 * len(variants)))
+    for n in args.sizes:
+        seed(n, args.batteries)
+        cells = []
+        expected = None
+        for name, fn in variants:
+            queries, ms, result = measure(fn, counter, args.repeat)
+            counts = {r["id"]: r["available_count"] for r in result}
+            # 集計結果が一致することを確認
+            if expected is None:
+                expected = counts
+            assert counts == expected, f"{name}: 集計結果が一致しません"
+            cells.append(f"{queries:>15} {ms:>11.1f}")
+        print(f"{n:>9} | " + " | ".join(cells))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,400 @@
+"""
+貸出・返却・スタンド一覧の負荷試験
+=====================================================
+大量データを投入した SQLite を用意し、ローカルに起動したサーバーへ
+複数クライアントから同時にリクエストを送って、エンドポイントごとの
+スループットと p50 / p95 / p99 レイテンシを計測する。
+結果は JSON に保存し、前回の結果と比較できる。
+
+各クライアント（= 1ユーザー）は以下を繰り返す:
+  POST /api/login（--login-every 回に1回）
+  GET  /api/stations
+  POST /api/rent     （自分専用に割り当てたバッテリーから選ぶ）
+  GET  /api/history
+  POST /api/return
+
+実行方法（リポジトリのルートで）:
+  python -m benchmarks.load_test run -o results.json
+  python -m benchmarks.load_test run --stations 10000 --batteries 200000 --rentals 1000000 \\
+      --clients 32 --duration 60 --db /tmp/load.db -o results.json --compare baseline.json
+  python -m benchmarks.load_test run --db /tmp/load.db --no-seed -o results.json   # 投入済み DB を再利用
+  python -m benchmarks.load_test compare baseline.json results.json
+
+【注意】
+- --db を省略すると一時ディレクトリの DB を使うため、既存の DB には触れない
+- サーバーは gunicorn があれば gunicorn、なければ Flask の開発サーバー（threaded）で起動する
+- 外部ライブラリは使わず、標準ライブラリの http.client（Keep-Alive）で送る
+=====================================================
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCH_PASSWORD = "bench-pass"
+EMAIL_PREFIX = "bench"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def user_email(i):
+    return f"{EMAIL_PREFIX}{i}@example.com"
+
+
+# ===============================
+# データ投入
+# ===============================
+def seed(db_url, n_stations, n_batteries, n_rentals, n_users, seed_value):
+    """
+    generate_data.generate() で投入する（全バッテリー利用可能、ユーザー = クライアント）
+    """
+    # db.py が import 時に DATABASE_URL を読むため、import の前に指定する
+    os.environ["DATABASE_URL"] = db_url
+    os.environ.setdefault("DB_PROFILE", "bench")
+    from generate_data import generate
+
+    summary = generate(
+        users=n_users,
+        stations=n_stations,
+        batteries_per_station=max(1, n_batteries // n_stations),
+        rentals_per_user=n_rentals // n_users,
+        days=365,
+        ongoing_ratio=0,
+        seed=seed_value,
+        password=BENCH_PASSWORD,
+        email_prefix=EMAIL_PREFIX,
+        balance_cents=10 ** 9,
+    )
+    from db import engine
+    engine.dispose()
+    return summary["seconds"]
+
+
+# ===============================
+# サーバー起動
+# ===============================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, db_url, port, workers, threads):
+    env = dict(os.environ, DATABASE_URL=db_url, DB_PROFILE="bench", SQL_ECHO="False", DEBUG_MODE="False")
+    # 全クライアントが同じ IP から頻繁にログインし直すので、アドミッション制御と
+    # ログインの回数制限は既定で外す（環境変数で指定すればそちらを使う）
+    for name, value in (("ADMISSION_ENABLED", "false"),
+                        ("LOGIN_IP_RATE_PER_MINUTE", "1000000"), ("LOGIN_IP_BURST", "1000000"),
+                        ("LOGIN_USER_RATE_PER_MINUTE", "1000000"), ("LOGIN_USER_BURST", "1000000")):
+        env.setdefault(name, value)
+    if kind == "auto":
+        try:
+            import gunicorn  # noqa: F401
+            kind = "gunicorn"
+        except ImportError:
+            kind = "werkzeug"
+
+    if kind == "gunicorn":
+        cmd = [
+            sys.executable, "-m", "gunicorn", "app:app",
+            "-b", f"127.0.0.1:{port}", "-w", str(workers), "--threads", str(threads),
+            "--log-level", "warning",
+        ]
+    else:
+        cmd = [
+            sys.executable, "-c",
+            f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)",
+        ]
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/api/stations")
+            conn.getresponse().read()
+            conn.close()
+            return proc, kind
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("server did not start within 60s")
+
+
+# ===============================
+# クライアント
+# ===============================
+class Recorder:
+    """エンドポイントごとのレイテンシとステータスを集める（計測区間内のものだけ）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+        self.recording = False
+
+    def add(self, name, elapsed, status):
+        if not self.recording:
+            return
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            counts = self.statuses.setdefault(name, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+
+class Client:
+    def __init__(self, host, port, recorder):
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.recorder = recorder
+        self.token = None
+
+    def call(self, method, path, body=None, name=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = json.dumps(body) if body is not None else None
+        t0 = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            # 接続が切れたら張り直して、エラーとして記録する
+            self.conn.close()
+            data, status = b"", "error"
+        elapsed = time.perf_counter() - t0
+        self.recorder.add(name or f"{method} {path.split('?')[0]}", elapsed, status)
+        try:
+            return status, json.loads(data) if data else {}
+        except ValueError:
+            return status, {}
+
+
+def battery_pool(index, n_batteries, n_clients):
+    """このクライアント専用のバッテリーID（他のクライアントと取り合わない）"""
+    return list(range(index + 1, n_batteries + 1, n_clients)) or [1]
+
+
+def client_loop(index, args, port, recorder, stop):
+    rng = random.Random(args.seed + index)
+    client = Client("127.0.0.1", port, recorder)
+    email = user_email(index + 1)
+    pool = battery_pool(index, args.batteries, args.clients)
+
+    iteration = 0
+    while not stop.is_set():
+        if client.token is None or iteration % args.login_every == 0:
+            status, body = client.call("POST", "/api/login", {"email": email, "password": BENCH_PASSWORD})
+            if status == 200:
+                client.token = body["access_token"]
+        iteration += 1
+
+        client.call("GET", "/api/stations")
+        status, body = client.call("POST", "/api/rent", {"battery_id": rng.choice(pool)})
+        client.call("GET", "/api/history?limit=20", name="GET /api/history")
+        if status == 200:
+            client.call("POST", "/api/return", {"rental_id": body["rental_id"]})
+
+
+def summarize(recorder, duration):
+    endpoints = {}
+    total = 0
+    for name in sorted(recorder.samples):
+        samples = recorder.samples[name]
+        statuses = recorder.statuses[name]
+        errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+        total += len(samples)
+        endpoints[name] = {
+            "requests": len(samples),
+            "errors": errors,
+            "throughput_rps": round(len(samples) / duration, 2),
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "max_ms": round(max(samples) * 1000, 3),
+            "status": statuses,
+        }
+    return endpoints, {"requests": total, "throughput_rps": round(total / duration, 2)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    if args.db:
+        db_path = os.path.abspath(args.db)
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_load_"), "load.db")
+    db_url = f"sqlite:///{db_path}"
+
+    seed_seconds = None
+    if not args.no_seed:
+        print(f"seeding {db_path}: stations={args.stations} batteries={args.batteries} "
+              f"rentals={args.rentals} users={args.clients}", file=sys.stderr)
+        seed_seconds = seed(db_url, args.stations, args.batteries, args.rentals, args.clients, args.seed)
+        print(f"seeded in {seed_seconds:.1f}s", file=sys.stderr)
+
+    port = free_port()
+    proc, server_kind = start_server(args.server, db_url, port, args.workers, args.threads)
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=client_loop, args=(i, args, port, recorder, stop), daemon=True)
+        for i in range(args.clients)
+    ]
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(args.warmup)
+        recorder.recording = True
+        t0 = time.perf_counter()
+        time.sleep(args.duration)
+        recorder.recording = False
+        measured = time.perf_counter() - t0
+        stop.set()
+        for t in threads:
+            t.join(timeout=30)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    endpoints, total = summarize(recorder, measured)
+    result = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": server_kind,
+            "workers": args.workers,
+            "threads": args.threads,
+            "clients": args.clients,
+            "duration_s": round(measured, 2),
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 2) if seed_seconds is not None else None,
+            "dataset": {
+                "stations": args.stations,
+                "batteries": args.batteries,
+                "rentals": args.rentals,
+                "users": args.clients,
+            },
+        },
+        "endpoints": endpoints,
+        "total": total,
+    }
+
+    print_table(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"wrote {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), result)
+    return result
+
+
+# ===============================
+# 表示・比較
+# ===============================
+def print_table(result):
+    print(f"{'endpoint':<22}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in result["endpoints"].items():
+        print(f"{name:<22}{s['requests']:>10}{s['errors']:>8}{s['throughput_rps']:>10.1f}"
+              f"{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}")
+    print(f"{'total':<22}{result['total']['requests']:>10}{'':>8}{result['total']['throughput_rps']:>10.1f}")
+
+
+def _delta(old, new):
+    if not old:
+        return "    n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def print_comparison(base, current):
+    """2回分の結果を並べ、変化率を表示する（レイテンシは負、スループットは正が改善）"""
+    print(f"\ncompare: {base['meta'].get('git_revision')} -> {current['meta'].get('git_revision')}")
+    print(f"{'endpoint':<22}{'rps':>18}{'p50':>18}{'p95':>18}{'p99':>18}")
+    for name in sorted(set(base["endpoints"]) | set(current["endpoints"])):
+        old = base["endpoints"].get(name)
+        new = current["endpoints"].get(name)
+        if not old or not new:
+            print(f"{name:<22}  (only in {'current' if new else 'baseline'})")
+            continue
+        cells = [
+            f"{new[key]:>9.1f} {_delta(old[key], new[key])}"
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+        ]
+        print(f"{name:<22}" + "".join(cells))
+    print(f"{'total':<22}{current['total']['throughput_rps']:>9.1f} "
+          f"{_delta(base['total']['throughput_rps'], current['total']['throughput_rps'])}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd")
+
+    p_run = sub.add_parser("run")
+    p_run.add_argument("--stations", type=int, default=1000)
+    p_run.add_argument("--batteries", type=int, default=20000)
+    p_run.add_argument("--rentals", type=int, default=100000)
+    p_run.add_argument("--clients", type=int, default=16, help="同時クライアント数（= ユーザー数）")
+    p_run.add_argument("--duration", type=float, default=20, help="計測時間（秒）")
+    p_run.add_argument("--warmup", type=float, default=3, help="計測前の助走時間（秒）")
+    p_run.add_argument("--login-every", type=int, default=10, help="何周に1回ログインし直すか")
+    p_run.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto")
+    p_run.add_argument("--workers", type=int, default=4, help="gunicorn のワーカー数")
+    p_run.add_argument("--threads", type=int, default=4, help="gunicorn のワーカーあたりスレッド数")
+    p_run.add_argument("--db", help="SQLite ファイル（省略時は一時ディレクトリ）")
+    p_run.add_argument("--no-seed", action="store_true", help="--db の既存データをそのまま使う")
+    p_run.add_argument("--seed", type=int, default=42)
+    p_run.add_argument("-o", "--output", help="結果の JSON を書き出すファイル")
+    p_run.add_argument("--compare", help="比較対象の結果 JSON")
+
+    p_cmp = sub.add_parser("compare")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "run":
+        if args.no_seed and not args.db:
+            parser.error("--no-seed requires --db")
+        # 投入はスタンドごとに同じ台数なので、総数をスタンド数の倍数に揃える
+        args.batteries = args.stations * max(1, args.batteries // args.stations)
+        run(args)
+    elif args.cmd == "compare":
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+        print_comparison(base, current)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
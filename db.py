@@ -5,6 +5,8 @@ db.py - データベース接続・セッション管理
 - SQLAlchemyのセッション管理を一元化
 - ローカル（SQLite）と本番（PostgreSQL）の切り替え対応
 - トランザクション管理の基盤を提供
+- 用途別のエンジンプロファイル（dev / prod / bench）を variables.py の DB_PROFILE で選択
+- SQL の発行回数・所要時間をリクエスト単位で集計し、遅いクエリはルート名つきでログに出す
 
 【セッション利用方法】
 session = get_session()
@@ -19,23 +21,230 @@ finally:
 =====================================================
 """
 
-from sqlalchemy import create_engine
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
 
-from variables import DATABASE_URL
+from variables import (
+    DATABASE_URL, DB_PROFILE, SQL_ECHO,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SLOW_QUERY_MS
+)
 from models import Base
 
+logger = logging.getLogger(__name__)
+
+# ============================================================
+# エンジンプロファイル
+# - dev:   SQL の全文ログは出さない（リクエストごとの件数・時間は Server-Timing で見る。
+#          全文が必要なら SQL_ECHO=true）。PostgreSQL のプールは小さく、疎通確認・作り直しはしない
+# - prod:  ログなし。PostgreSQL のプールは DB_POOL_* の値で、使う前に接続が生きているか確認し
+#          （DB 再起動・アイドル切断対策）、DB_POOL_RECYCLE 秒で作り直す
+# - bench: ログなし。負荷試験用にプールと SQLite のキャッシュを大きめにする。
+#          疎通確認の往復が測定に混ざらないよう pre_ping はしない
+#
+# SQLite は接続ごとに PRAGMA を設定する
+# - journal_mode=WAL: 書き込み中でも他の接続が読める（gunicorn の複数ワーカー向け）
+# - busy_timeout: ロック中は即エラー（database is locked）にせず待つ
+# - synchronous=NORMAL: WAL ではこれで十分安全で、コミットが速い
+# - cache_size: ページキャッシュ（負の値は KB 指定）
+# ============================================================
+ENGINE_PROFILES = {
+    "dev": {
+        "echo": False,
+        "pool_size": 2,
+        "max_overflow": 3,
+        "pool_timeout": 10,
+        "pool_recycle": -1,
+        "pool_pre_ping": False,
+        "sqlite_cache_size_kb": SQLITE_CACHE_SIZE_KB,
+    },
+    "prod": {
+        "echo": False,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "sqlite_cache_size_kb": SQLITE_CACHE_SIZE_KB,
+    },
+    "bench": {
+        "echo": False,
+        "pool_size": DB_POOL_SIZE * 4,
+        "max_overflow": DB_MAX_OVERFLOW * 4,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": False,
+        "sqlite_cache_size_kb": SQLITE_CACHE_SIZE_KB * 4,
+    },
+}
+
+
+# ============================================================
+# SQL 計測
+# - before/after_cursor_execute で1文ごとの所要時間を測る
+# - 集計先はコンテキスト変数（リクエストを処理しているスレッドごとに独立）
+# - 集計中でなければ（CLI やバックグラウンド処理）遅いクエリのログだけ出す
+# ============================================================
+class QueryStats:
+    """1リクエスト分の SQL 集計"""
+
+    __slots__ = ("route", "count", "seconds")
+
+    def __init__(self, route=None):
+        self.route = route
+        self.count = 0
+        self.seconds = 0.0
+
+
+_query_stats = ContextVar("query_stats", default=None)
+
+
+def start_query_stats(route=None):
+    """集計を開始する（戻り値のトークンを stop_query_stats に渡す）"""
+    return _query_stats.set(QueryStats(route))
+
+
+def current_query_stats():
+    """集計中の QueryStats（集計していなければ None）"""
+    return _query_stats.get()
+
+
+def stop_query_stats(token):
+    _query_stats.reset(token)
+
+
+def instrument_engine(target_engine, slow_query_ms=SLOW_QUERY_MS):
+    """エンジンに計測用のイベントを登録する"""
+
+    @event.listens_for(target_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(target_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started_at"].pop()
+        stats = _query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+        if elapsed * 1000 >= slow_query_ms:
+            route = stats.route if stats is not None else "-"
+            logger.warning(
+                f"slow query {elapsed * 1000:.1f}ms route={route}: "
+                f"{' '.join(statement.split())[:500]}"
+            )
+
+    @event.listens_for(target_engine, "handle_error")
+    def _handle_error(exception_context):
+        # 失敗した文は after_cursor_execute が呼ばれないので開始時刻を捨てる
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started_at"):
+            conn.info["query_started_at"].pop()
+
+
+# ============================================================
+# コネクションプールの待ち時間
+# - プールから接続を借りるまでの時間（空きがなければ待つ、新規接続ならその時間）を測る
+# - 測った値は pool_wait_observers に登録された関数へ渡す（metrics.py が登録する）
+# ============================================================
+pool_wait_observers = []
+
+
+class TimedQueuePool(QueuePool):
+    """connect()（チェックアウト）にかかった時間を pool_wait_observers に通知する QueuePool"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            waited = time.perf_counter() - started
+            for observer in pool_wait_observers:
+                observer(waited)
+
+
+def is_sqlite_url(url):
+    return url.startswith("sqlite")
+
+
+def is_sqlite_memory_url(url):
+    return is_sqlite_url(url) and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)
+
+
+def get_profile(profile_name=DB_PROFILE):
+    if profile_name not in ENGINE_PROFILES:
+        raise ValueError(f"unknown DB_PROFILE: {profile_name} (choose from {', '.join(ENGINE_PROFILES)})")
+    return ENGINE_PROFILES[profile_name]
+
+
+def engine_options(url, profile):
+    """create_engine / create_async_engine に渡す共通のオプション"""
+    echo = profile["echo"] if SQL_ECHO is None else SQL_ECHO.lower() == "true"
+    options = {"echo": echo}
+
+    if is_sqlite_url(url):
+        # Python 側のロック待ち（秒）も busy_timeout に揃える
+        options["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    else:
+        options.update(
+            pool_size=profile["pool_size"],
+            max_overflow=profile["max_overflow"],
+            pool_timeout=profile["pool_timeout"],
+            pool_pre_ping=profile["pool_pre_ping"],
+            pool_recycle=profile["pool_recycle"],
+        )
+    return options
+
+
+def install_sqlite_pragmas(target_engine, url, profile):
+    """接続ごとに PRAGMA を設定する（非同期エンジンには sync_engine を渡す）"""
+    memory = is_sqlite_memory_url(url)
+    cache_size_kb = profile["sqlite_cache_size_kb"]
+
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_size_kb)}")
+        cursor.close()
+
+
+def build_engine(url=DATABASE_URL, profile_name=DB_PROFILE):
+    """
+    プロファイルに従ってエンジンを作成する
+
+    - future=True: SQLAlchemy 2.0スタイルを使用
+    """
+    profile = get_profile(profile_name)
+    options = engine_options(url, profile)
+    options["future"] = True
+
+    # インメモリ SQLite は接続ごとに別の DB になるため、既定のプール（接続を使い回す）のままにする
+    if not is_sqlite_memory_url(url):
+        options["poolclass"] = TimedQueuePool
+
+    new_engine = create_engine(url, **options)
+
+    if is_sqlite_url(url):
+        install_sqlite_pragmas(new_engine, url, profile)
+
+    instrument_engine(new_engine)
+    return new_engine
+
+
 # ============================================================
 # エンジン作成
-# - echo=True: 発行されるSQLをコンソールに表示（デバッグ用）
-# - future=True: SQLAlchemy 2.0スタイルを使用
 # ============================================================
-engine = create_engine(
-    DATABASE_URL,
-    echo=True,  # SQLログ出力（授業で見せる用）
-    future=True
-)
+engine = build_engine()
 
 # ============================================================
 # セッションファクトリ
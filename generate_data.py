@@ -0,0 +1,298 @@
+"""
+generate_data.py - 大量の検証用データを一括投入する
+=====================================================
+【設計意図】
+- ORM オブジェクトを1件ずつ add するのではなく、Core の insert() を
+  executemany で大きなバッチごとに流す（数百万件の貸出履歴を数秒〜数十秒で作る）
+- パスワードハッシュは重い（PBKDF2）ので1回だけ計算し、全ユーザーで共有する
+- 乱数は --seed から作った random.Random だけを使うため、同じ引数なら同じデータになる
+- ID はこちらで採番して明示的に入れる（RETURNING 不要、参照関係も計算で決まる）
+- セカンダリインデックスは投入後にまとめて作る（1行ごとのインデックス更新を避ける）
+- 在庫カウンタ（stations.available_count）と台帳（charge_histories）も
+  投入内容から計算して、最初から整合した状態で入れる
+
+使い方:
+  python generate_data.py
+  python generate_data.py --users 100000 --stations 10000 --batteries-per-station 20 \\
+      --rentals-per-user 20 --days 365 --seed 1
+
+【注意】
+- 既存のテーブルは削除して作り直す（本番 DB には実行しないこと）
+=====================================================
+"""
+
+import argparse
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from db import engine
+from models import Base, User, Station, Battery, Rental, ChargeHistory
+from auth import hash_password
+from variables import PRICE_PER_MINUTE_CENTS
+
+DEFAULT_PASSWORD = "password123"
+
+# スタンドを置く地域（緯度・経度の範囲, 地名）
+REGIONS = [
+    (35.60, 35.78, 139.62, 139.85, "東京都"),
+    (35.40, 35.55, 139.55, 139.70, "神奈川県"),
+    (34.60, 34.75, 135.40, 135.60, "大阪府"),
+    (35.10, 35.20, 136.85, 136.98, "愛知県"),
+    (43.02, 43.10, 141.30, 141.40, "北海道"),
+]
+STATION_SUFFIXES = ["駅前", "駅東口", "駅西口", "北口", "南口", "中央", "公園前", "商店街"]
+
+
+def _batches(rows, batch_size):
+    """行のイテレータを batch_size 件ずつのリストに分ける"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _rental_minutes(rng):
+    """利用時間（分）。短時間が多く、たまに長時間になる分布"""
+    return min(24 * 60, max(1, int(rng.expovariate(1 / 45))))
+
+
+def _bulk_tables():
+    return (User.__table__, Station.__table__, Battery.__table__, Rental.__table__,
+            ChargeHistory.__table__)
+
+
+def _drop_indexes(conn):
+    """セカンダリインデックスを外す（投入後に _create_indexes で作り直す）"""
+    for table in _bulk_tables():
+        for index in table.indexes:
+            index.drop(conn, checkfirst=True)
+
+
+def _create_indexes(conn):
+    for table in _bulk_tables():
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _reset_sequences(conn):
+    """ID を明示して入れたので、PostgreSQL の連番を最大値の次に進める"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in _bulk_tables():
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+        ))
+
+
+def generate(users=1000, stations=100, batteries_per_station=10, rentals_per_user=20,
+             days=90, ongoing_ratio=0.05, seed=42, password=DEFAULT_PASSWORD,
+             email_prefix="user", balance_cents=None, batch_size=50000, verbose=True):
+    """
+    データを投入し、件数と所要時間の概要を辞書で返す
+
+    【生成内容】
+    - ユーザー: {email_prefix}{i}@example.com / password（全員同じハッシュ）
+    - スタンド: REGIONS の範囲にランダム配置
+    - バッテリー: 各スタンドに batteries_per_station 台
+    - 貸出履歴: 1ユーザーあたり平均 rentals_per_user 件、過去 days 日に分散
+      ongoing_ratio の割合のユーザーは最後の1件が貸出中（バッテリーは利用不可）
+    - 残高: balance_cents を指定すれば全員その値、省略時は 1000〜5900 のランダム
+    - 台帳: ユーザーごとに「残高 + 支払総額」のチャージ1件と支払い合計1件
+    """
+    rng = random.Random(seed)
+    log = (lambda *a: print(*a, file=sys.stderr)) if verbose else (lambda *a: None)
+    n_batteries = stations * batteries_per_station
+    now = datetime.utcnow().replace(microsecond=0)
+    span_seconds = days * 86400
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    # ハッシュ計算は1回だけ
+    password_hash = hash_password(password)
+
+    # 貸出中にするバッテリーを先に決める（同じバッテリーを2人に貸さないように）
+    n_ongoing = min(n_batteries, int(users * ongoing_ratio))
+    ongoing_users = set(rng.sample(range(1, users + 1), n_ongoing))
+    ongoing_batteries = rng.sample(range(1, n_batteries + 1), n_ongoing)
+    unavailable = set(ongoing_batteries)
+    ongoing_battery_of = dict(zip(sorted(ongoing_users), ongoing_batteries))
+
+    spent = [0] * (users + 1)
+    counts = {"rentals": 0, "charge_histories": 0}
+    t0 = time.perf_counter()
+
+    def station_rows():
+        for i in range(1, stations + 1):
+            lat_min, lat_max, lng_min, lng_max, pref = rng.choice(REGIONS)
+            yield {
+                "id": i,
+                "name": f"{pref}{rng.choice(STATION_SUFFIXES)} {i}",
+                "location": pref,
+                "lat": round(rng.uniform(lat_min, lat_max), 6),
+                "lng": round(rng.uniform(lng_min, lng_max), 6),
+                "available_count": sum(
+                    1 for b in range((i - 1) * batteries_per_station + 1, i * batteries_per_station + 1)
+                    if b not in unavailable
+                ),
+            }
+
+    def battery_rows():
+        for i in range(1, n_batteries + 1):
+            yield {
+                "id": i,
+                "serial": f"BT{i:010d}",
+                "station_id": (i - 1) // batteries_per_station + 1,
+                "available": i not in unavailable,
+                "battery_level": rng.randint(20, 100),
+            }
+
+    def rental_rows():
+        rental_id = 0
+        for user_id in range(1, users + 1):
+            # 件数は平均 rentals_per_user のばらつきを持たせる（0 なら履歴なし）
+            n = max(0, int(rng.gauss(rentals_per_user, math.sqrt(rentals_per_user)))) if rentals_per_user else 0
+            starts = sorted(int(rng.random() * span_seconds) for _ in range(n))
+            for offset in starts:
+                rental_id += 1
+                start_at = now - timedelta(seconds=span_seconds - offset)
+                minutes = _rental_minutes(rng)
+                price = minutes * PRICE_PER_MINUTE_CENTS
+                spent[user_id] += price
+                battery_id = int(rng.random() * n_batteries) + 1
+                yield {
+                    "id": rental_id,
+                    "user_id": user_id,
+                    "battery_id": battery_id,
+                    "station_id": (battery_id - 1) // batteries_per_station + 1,
+                    "return_station_id": (battery_id - 1) // batteries_per_station + 1,
+                    "start_at": start_at,
+                    "end_at": start_at + timedelta(minutes=minutes),
+                    "status": "returned",
+                    "price_cents": price,
+                }
+            if user_id in ongoing_users:
+                rental_id += 1
+                yield {
+                    "id": rental_id,
+                    "user_id": user_id,
+                    "battery_id": ongoing_battery_of[user_id],
+                    "station_id": (ongoing_battery_of[user_id] - 1) // batteries_per_station + 1,
+                    "return_station_id": None,
+                    "start_at": now - timedelta(minutes=rng.randint(1, 180)),
+                    "end_at": None,
+                    "status": "ongoing",
+                    "price_cents": None,
+                }
+
+    with engine.begin() as conn:
+        _drop_indexes(conn)
+
+        for batch in _batches(station_rows(), batch_size):
+            conn.execute(insert(Station), batch)
+        log(f"stations: {stations}")
+
+        for batch in _batches(battery_rows(), batch_size):
+            conn.execute(insert(Battery), batch)
+        log(f"batteries: {n_batteries}")
+
+        for batch in _batches(rental_rows(), batch_size):
+            conn.execute(insert(Rental), batch)
+            counts["rentals"] += len(batch)
+        log(f"rentals: {counts['rentals']}")
+
+        # 残高は支払総額が分かってから決める（チャージ - 支払い = 残高 になるように）
+        balances = [0] + [
+            balance_cents if balance_cents is not None else rng.randrange(0, 50) * 100 + 1000
+            for _ in range(users)
+        ]
+        for batch in _batches((
+            {
+                "id": i,
+                "email": f"{email_prefix}{i}@example.com",
+                "password_hash": password_hash,
+                "balance_cents": balances[i],
+            }
+            for i in range(1, users + 1)
+        ), batch_size):
+            conn.execute(insert(User), batch)
+        log(f"users: {users}")
+
+        # 台帳は「チャージ1件 + 支払い合計1件」に集約する（貸出ごとに行を作ると件数が倍になるため）
+        def ledger_rows():
+            ledger_id = 0
+            for i in range(1, users + 1):
+                ledger_id += 1
+                yield {"id": ledger_id, "user_id": i, "amount_cents": balances[i] + spent[i],
+                       "kind": "charge", "created_at": now - timedelta(days=days)}
+                if spent[i]:
+                    ledger_id += 1
+                    yield {"id": ledger_id, "user_id": i, "amount_cents": -spent[i],
+                           "kind": "rental", "created_at": now}
+        for batch in _batches(ledger_rows(), batch_size):
+            conn.execute(insert(ChargeHistory), batch)
+            counts["charge_histories"] += len(batch)
+
+        t_index = time.perf_counter()
+        _create_indexes(conn)
+        log(f"indexes: {time.perf_counter() - t_index:.1f}s")
+
+        _reset_sequences(conn)
+
+    elapsed = time.perf_counter() - t0
+    summary = {
+        "users": users,
+        "stations": stations,
+        "batteries": n_batteries,
+        "rentals": counts["rentals"],
+        "ongoing": n_ongoing,
+        "charge_histories": counts["charge_histories"],
+        "seconds": round(elapsed, 2),
+    }
+    log(f"done in {elapsed:.1f}s ({counts['rentals'] / max(elapsed, 1e-9):,.0f} rentals/s)")
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="検証用データの一括投入（既存データは削除されます）")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--stations", type=int, default=100)
+    parser.add_argument("--batteries-per-station", type=int, default=10)
+    parser.add_argument("--rentals-per-user", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90, help="貸出履歴を分散させる期間（日）")
+    parser.add_argument("--ongoing-ratio", type=float, default=0.05, help="貸出中のユーザーの割合")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--email-prefix", default="user")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    summary = generate(
+        users=args.users,
+        stations=args.stations,
+        batteries_per_station=args.batteries_per_station,
+        rentals_per_user=args.rentals_per_user,
+        days=args.days,
+        ongoing_ratio=args.ongoing_ratio,
+        seed=args.seed,
+        password=args.password,
+        email_prefix=args.email_prefix,
+        batch_size=args.batch_size,
+    )
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+    print(f"login: {args.email_prefix}1@example.com / {args.password}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,229 @@
+"""
+geo_index.py - スタンド座標のグリッド空間インデックス
+=====================================================
+【設計意図】
+- 緯度経度を cell_deg 度四方のマス（グリッド）に分けて、マスごとにスタンドを持つ
+  （既定 0.0025度 ≒ 280m。1マスに数件程度になる大きさが速い）
+- 近傍検索は検索地点のマスから外側へ1周ずつ広げ、k件確定した時点で打ち切る
+  （全スタンドとの距離計算をしないので、10万件でも1ms未満で返る）
+- sync() は前回との差分（追加・移動・削除）だけをマスに反映する
+  → admin.py add_station で増えたスタンドも、キャッシュ更新時に差分で取り込まれる
+- 在庫数だけの変化（貸出・返却）は apply_available_deltas() でスタンド単位に反映する
+  （1件の貸出で全スタンドを読み直さない）
+
+【注意】
+- 経度 ±180 度の境界はまたがない前提（国内のスタンドのみを想定）
+- 座標が未設定（lat/lng が NULL）のスタンドはインデックスに入れない
+=====================================================
+"""
+
+import heapq
+import math
+import threading
+import time
+
+EARTH_RADIUS_M = 6371000.0
+# 緯度1度あたりの距離（m）
+METERS_PER_DEG = math.pi * EARTH_RADIUS_M / 180.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """2点間の距離（m）"""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StationGridIndex:
+    """
+    スタンドのグリッド空間インデックス
+
+    【使用例】
+    index = StationGridIndex(cell_deg=0.0025)
+    index.sync(stations)   # get_station_availability() の結果
+    index.nearest(35.68, 139.76, k=5, radius_m=2000, min_available=1)
+    """
+
+    def __init__(self, cell_deg=0.0025):
+        self.cell_deg = cell_deg
+        self._lock = threading.Lock()
+        # (ix, iy) -> {station_id: (lat, lng)}
+        self._cells = {}
+        # station_id -> (lat, lng)
+        self._positions = {}
+        # station_id -> スタンド情報（在庫数など）
+        self._stations = {}
+        # 使用中のマスの範囲（これより外側は探さない）
+        self._bounds = None
+        # 最後に取り込んだデータの識別子（キャッシュの ETag など）と時刻（time.monotonic()）
+        self.synced_key = None
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, lat, lng):
+        return (int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg)))
+
+    def _insert(self, station_id, lat, lng):
+        cell = self._cell(lat, lng)
+        self._cells.setdefault(cell, {})[station_id] = (lat, lng)
+        self._positions[station_id] = (lat, lng)
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            b = self._bounds
+            b[0] = min(b[0], cell[0])
+            b[1] = max(b[1], cell[0])
+            b[2] = min(b[2], cell[1])
+            b[3] = max(b[3], cell[1])
+
+    def _remove(self, station_id):
+        lat, lng = self._positions.pop(station_id)
+        cell = self._cell(lat, lng)
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(station_id, None)
+            if not bucket:
+                del self._cells[cell]
+        # 範囲は縮めない（広めに探すだけで結果は正しい）
+
+    def sync(self, stations, key=None):
+        """
+        スタンド一覧を差分で取り込む
+
+        スタンド情報は複製して持つ（apply_available_deltas() で書き換えても、
+        渡された一覧（在庫キャッシュ）は変わらない）。
+
+        【戻り値】
+        (追加数, 移動数, 削除数)
+        """
+        with self._lock:
+            added = moved = removed = 0
+            seen = {}
+            for s in stations:
+                seen[s["id"]] = dict(s)
+                lat, lng = s.get("lat"), s.get("lng")
+                old = self._positions.get(s["id"])
+                if lat is None or lng is None:
+                    if old is not None:
+                        self._remove(s["id"])
+                        removed += 1
+                    continue
+                if old is None:
+                    self._insert(s["id"], lat, lng)
+                    added += 1
+                elif old != (lat, lng):
+                    self._remove(s["id"])
+                    self._insert(s["id"], lat, lng)
+                    moved += 1
+
+            for station_id in [sid for sid in self._positions if sid not in seen]:
+                self._remove(station_id)
+                removed += 1
+
+            self._stations = seen
+            self.synced_key = key
+            self.synced_at = time.monotonic()
+            return added, moved, removed
+
+    def apply_available_deltas(self, deltas):
+        """
+        在庫数の増減 [(station_id, delta), ...] を反映する（位置は変えない）
+
+        インデックスにないスタンドは無視する（次の sync() で取り込まれる）。
+        """
+        with self._lock:
+            for station_id, delta in deltas:
+                station = self._stations.get(station_id)
+                if station is not None:
+                    station["available_count"] = station.get("available_count", 0) + delta
+
+    def nearest(self, lat, lng, k=10, radius_m=None, min_available=0):
+        """
+        (lat, lng) から近い順に最大 k 件のスタンドを返す
+
+        【戻り値】
+        [(距離m, スタンド情報), ...]（距離の昇順）
+        """
+        with self._lock:
+            if not self._positions or k <= 0:
+                return []
+
+            cx, cy = self._cell(lat, lng)
+            b = self._bounds
+            cell_h = self.cell_deg * METERS_PER_DEG
+            max_ring = max(cx - b[0], b[1] - cx, cy - b[2], b[3] - cy, 0)
+            if radius_m is not None:
+                max_lat = min(abs(lat) + radius_m / METERS_PER_DEG + self.cell_deg, 89.9)
+                min_cell_m = min(cell_h, cell_h * math.cos(math.radians(max_lat)))
+                max_ring = min(max_ring, int(radius_m / min_cell_m) + 1)
+
+            # 遠い順に取り出せるよう (-距離, id) の最大ヒープで上位 k 件を保持
+            best = []
+            for ring, cells in self._rings(cx, cy, max_ring):
+                # ring 周目のマスに、検索地点からの距離が (ring-1) マス分未満の点はない。
+                # 経度方向のマス幅は緯度が高いほど短いので、この周で届く最大緯度で見積もる
+                max_lat = min(abs(lat) + (ring + 1) * self.cell_deg, 89.9)
+                min_step = min(cell_h, cell_h * math.cos(math.radians(max_lat)))
+                ring_min_dist = max(ring - 1, 0) * min_step
+                if radius_m is not None and ring_min_dist > radius_m:
+                    break
+                if len(best) == k and -best[0][0] <= ring_min_dist:
+                    break
+
+                for cell in cells:
+                    bucket = self._cells.get(cell)
+                    if not bucket:
+                        continue
+                    for station_id, (slat, slng) in bucket.items():
+                        if min_available and self._stations[station_id].get("available_count", 0) < min_available:
+                            continue
+                        d = haversine_m(lat, lng, slat, slng)
+                        if radius_m is not None and d > radius_m:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-d, station_id))
+                        elif d < -best[0][0]:
+                            heapq.heapreplace(best, (-d, station_id))
+
+            return [(-neg_d, self._stations[sid]) for neg_d, sid in sorted(best, reverse=True)]
+
+    def _rings(self, cx, cy, max_ring):
+        """
+        (ring, その周のマス一覧) を内側から順に返す
+
+        基本は周ごとにマスを列挙する。ただし、ここまでに見たマス数が使用中のマス数を
+        超えたら（スタンドがまばらで半径が大きい）、残りの周は空のマスを1つずつ見る代わりに
+        使用中のマスだけを周ごとにまとめて返す。
+        """
+        ring = 0
+        while ring <= max_ring and (2 * ring + 1) ** 2 <= len(self._cells):
+            yield ring, self._ring_cells(cx, cy, ring)
+            ring += 1
+        if ring > max_ring:
+            return
+
+        by_ring = {}
+        for cell in self._cells:
+            r = max(abs(cell[0] - cx), abs(cell[1] - cy))
+            if ring <= r <= max_ring:
+                by_ring.setdefault(r, []).append(cell)
+        for r in sorted(by_ring):
+            yield r, by_ring[r]
+
+    @staticmethod
+    def _ring_cells(cx, cy, ring):
+        """中心 (cx, cy) からチェビシェフ距離がちょうど ring のマスを列挙"""
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
@@ -0,0 +1,42 @@
+"""
+gunicorn の設定
+python -m gunicorn app:app  （このファイルは自動で読み込まれる）
+
+【設計意図】
+- Prometheus のメトリクスを全ワーカー分まとめて /metrics で返すため、
+  PROMETHEUS_MULTIPROC_DIR を設定する（未設定なら一時ディレクトリを作る）
+- ディレクトリは起動時に空にし、終了したワーカーの分は child_exit で片付ける
+
+【スレッド数とアドミッション制御の枠（variables.py の ADMISSION_LIMITS）】
+- 枠はワーカーごと。1ワーカーが同時に処理できるのは threads（GUNICORN_THREADS）件まで
+- read の枠の既定値は GUNICORN_THREADS（variables.py も同じ環境変数を読む）。
+  キャッシュから返す GET は一瞬で終わるので、普段の負荷では断らない
+- write の枠（ADMISSION_WRITE_CONCURRENCY）は DB_POOL_SIZE + DB_MAX_OVERFLOW 以下にする
+  （枠より接続が少ないと、枠に入った書き込みがプールの空きを待つ）
+- auth の枠の既定値はハッシュ計算のスレッド数（HASH_MAX_WORKERS）
+- 読み取りの集中時にも write 用のスレッドを残したい場合は、ADMISSION_READ_CONCURRENCY を
+  GUNICORN_THREADS より小さくする（その分、集中時は安い GET も 503 になる）
+"""
+import os
+import shutil
+import tempfile
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# ワーカーが prometheus_client を import する前に設定しておく（fork で引き継がれる）
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus_"))
+
+
+def on_starting(server):
+    """前回の起動で残った値のファイルを消す（カウンタが前回分から続かないように）"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """終了したワーカーの livesum ゲージを集計から外す"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
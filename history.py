@@ -0,0 +1,89 @@
+"""
+history.py - 利用履歴のキーセットページング
+=====================================================
+【設計意図】
+- Flask（app.py）と ASGI（asgi_api.py）の両方から使うため、
+  SELECT 文の組み立てとカーソル・JSON 変換だけをここに置く（セッションは呼び出し側）
+- (start_at, id) の降順に並べ、前ページ最後の行より後ろだけを読む
+  → OFFSET を使わないので、何ページ目でも複合インデックス
+    ix_rentals_user_id_start_at_id の範囲検索1回で済む
+- 境界の start_at はカーソルの貸出IDから DB 上の値を引いて比較する
+  （SQLite では日時が文字列で保存されるため、パラメータとして渡すと
+    保存形式の違いで同じ時刻を正しく比較できないことがある）
+=====================================================
+"""
+
+import base64
+
+from sqlalchemy import select, or_
+
+from models import Rental, Battery, Station
+from variables import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
+
+
+def encode_history_cursor(rental_id):
+    """履歴ページングのカーソル（ページ最後の貸出ID）を URL 安全な文字列にする"""
+    return base64.urlsafe_b64encode(str(rental_id).encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor):
+    """カーソル文字列から貸出IDを取り出す（不正な値は ValueError）"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
+def parse_history_limit(value):
+    """limit パラメータを 1〜HISTORY_MAX_PAGE_SIZE に収める（不正な値は ValueError）"""
+    if value is None or value == "":
+        return HISTORY_PAGE_SIZE
+    return max(1, min(int(value), HISTORY_MAX_PAGE_SIZE))
+
+
+def user_history_query(user_id, limit, after_id=None):
+    """1ページ分の (Rental, Battery, Station) を読む SELECT 文（次ページ判定用に1件多く読む）"""
+    stmt = select(Rental, Battery, Station).join(
+        Battery, Rental.battery_id == Battery.id
+    ).outerjoin(
+        Station, Battery.station_id == Station.id
+    ).where(
+        Rental.user_id == user_id
+    )
+
+    if after_id is not None:
+        anchor_start = select(Rental.start_at).where(
+            Rental.id == after_id
+        ).scalar_subquery()
+        stmt = stmt.where(
+            Rental.start_at <= anchor_start,
+            or_(Rental.start_at < anchor_start, Rental.id < after_id)
+        )
+
+    return stmt.order_by(
+        Rental.start_at.desc(), Rental.id.desc()
+    ).limit(limit + 1)
+
+
+def split_history_page(rows, limit):
+    """
+    limit + 1 件読んだ結果をページと次ページの after_id に分ける
+
+    【戻り値】
+    ([(Rental, Battery, Station), ...], 次ページの after_id または None)
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][0].id
+    return rows, None
+
+
+def history_item(rental, battery, station):
+    """API レスポンス用の1件分の辞書"""
+    return {
+        "id": rental.id,
+        "start_at": rental.start_at.isoformat(),
+        "end_at": rental.end_at.isoformat() if rental.end_at else None,
+        "battery_serial": battery.serial if battery else None,
+        "station_name": station.name if station else None,
+        "price": rental.price_cents if rental.price_cents else 0,
+        "status": rental.status
+    }
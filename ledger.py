@@ -0,0 +1,118 @@
+"""
+ledger.py - 残高の原子的な増減と台帳（charge_histories）への記録
+=====================================================
+【設計意図】
+- 残高は Python 側で読み書きせず、DB 側の UPDATE 1文で増減する
+    UPDATE users SET balance_cents = balance_cents - :p
+     WHERE id = :id AND balance_cents >= :p
+  → 複数の gunicorn ワーカーから同じユーザーの更新が同時に来ても値を失わない
+  → 残高不足の判定も同じ1文で行うため、マイナスにならない
+- すべての増減を charge_histories に追記する（チャージは正、支払いは負）
+  → ユーザーごとの合計と users.balance_cents を突き合わせて監査・再構築できる
+
+【注意】
+- どの関数も呼び出し元のトランザクション内で実行すること
+=====================================================
+"""
+
+from sqlalchemy import select, update, func
+
+from models import User, ChargeHistory
+
+
+def _record(session, user_id, amount_cents, kind, rental_id):
+    session.add(ChargeHistory(
+        user_id=user_id,
+        amount_cents=amount_cents,
+        kind=kind,
+        rental_id=rental_id
+    ))
+
+
+def _current_balance(session, user_id):
+    return session.execute(
+        select(User.balance_cents).where(User.id == user_id)
+    ).scalar()
+
+
+def credit(session, user_id, amount_cents, kind="charge", rental_id=None):
+    """
+    残高を増やす
+
+    【戻り値】
+    更新後の残高（ユーザーが存在しなければ None）
+    """
+    result = session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance_cents=User.balance_cents + amount_cents)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    _record(session, user_id, amount_cents, kind, rental_id)
+    return _current_balance(session, user_id)
+
+
+def debit(session, user_id, amount_cents, kind="rental", rental_id=None, allow_negative=False):
+    """
+    残高を減らす（allow_negative=False なら残高が足りるときだけ）
+
+    【戻り値】
+    更新後の残高（残高不足・ユーザーが存在しない場合は None）
+    """
+    stmt = update(User).where(User.id == user_id)
+    if not allow_negative:
+        stmt = stmt.where(User.balance_cents >= amount_cents)
+    result = session.execute(
+        stmt.values(balance_cents=User.balance_cents - amount_cents)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    _record(session, user_id, -amount_cents, kind, rental_id)
+    return _current_balance(session, user_id)
+
+
+def audit_balances(session):
+    """
+    users.balance_cents と台帳の合計が一致しないユーザーを返す
+
+    【戻り値】
+    [(user_id, 残高, 台帳の合計), ...]
+    """
+    ledger_sum = (
+        select(
+            ChargeHistory.user_id,
+            func.sum(ChargeHistory.amount_cents).label("total")
+        )
+        .group_by(ChargeHistory.user_id)
+        .subquery()
+    )
+    rows = session.execute(
+        select(User.id, User.balance_cents, func.coalesce(ledger_sum.c.total, 0))
+        .outerjoin(ledger_sum, ledger_sum.c.user_id == User.id)
+        .order_by(User.id)
+    )
+    return [
+        (user_id, balance, total)
+        for user_id, balance, total in rows
+        if balance != total
+    ]
+
+
+def adjust_ledger(session, drifts):
+    """台帳側に補正エントリ（kind=adjustment）を追記して残高に合わせる（台帳導入前のユーザー向け）"""
+    for user_id, balance, total in drifts:
+        _record(session, user_id, balance - total, "adjustment", None)
+
+
+def rebuild_balances(session, drifts):
+    """残高を台帳の合計で上書きする（台帳を正とする場合）"""
+    for user_id, _, total in drifts:
+        session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(balance_cents=total)
+            .execution_options(synchronize_session=False)
+        )
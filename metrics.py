@@ -0,0 +1,206 @@
+"""
+metrics.py - Prometheus 形式のメトリクス（/metrics）
+=====================================================
+【設計意図】
+- ルートごとのレイテンシはヒストグラムで持つ（p95/p99 を PromQL の histogram_quantile で出す）
+- 貸出・返却・チャージは結果ごとに数える（success / insufficient_balance /
+  battery_not_available / invalid_rental / error）
+- 貸出中件数・利用可能バッテリー数は DB の事実なので、プロセスごとに持たず
+  スクレイプ時に DB から集計する（どのワーカーが応答しても同じ値）
+- コネクションプールはプロセスごとにあるので、チェックアウト・チェックイン時に
+  そのプロセスの値を更新し、gunicorn の全ワーカー分を合計（livesum）して見せる
+- パスワードのハッシュ計算（auth.py の HashingExecutor）の待ち時間と断った件数も出す
+  （HASH_MAX_WORKERS / HASH_MAX_PENDING を決める材料）
+
+【gunicorn の複数ワーカー】
+- 環境変数 PROMETHEUS_MULTIPROC_DIR を設定すると、各ワーカーが値をそのディレクトリの
+  ファイルに書き、/metrics はディレクトリ全体を集計して返す（gunicorn.conf.py 参照）
+- 設定しなければ単一プロセス用のレジストリをそのまま返す（開発サーバー用）
+=====================================================
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry,
+    REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event, select, func
+
+from db import engine, get_session_context, pool_wait_observers
+from auth import hash_queue_wait_observers, hash_rejected_observers
+from models import Rental, Station
+
+logger = logging.getLogger(__name__)
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "リクエストの処理時間",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+OPERATIONS = Counter(
+    "battery_operations_total",
+    "貸出・返却・チャージの結果ごとの件数",
+    ["operation", "outcome"],
+)
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "同時実行数の上限で断ったリクエスト数（admission.py）",
+    ["route_class"],
+)
+
+LOGIN_THROTTLED = Counter(
+    "login_throttled_total",
+    "回数制限で断ったログイン数（scope は ip / user）",
+    ["scope"],
+)
+
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "貸し出し中の DB 接続数",
+    multiprocess_mode="livesum",
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "pool_size を超えて作られている DB 接続数",
+    multiprocess_mode="livesum",
+)
+POOL_CHECKOUTS = Counter(
+    "db_pool_checkouts_total",
+    "DB 接続のチェックアウト回数",
+)
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "DB 接続を借りるまでの待ち時間",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds",
+    "パスワードのハッシュ計算が始まるまでの待ち時間",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+HASH_REJECTED = Counter(
+    "password_hash_rejected_total",
+    "ハッシュ計算の混雑で断った件数（reason は queue_full / timeout）",
+    ["reason"],
+)
+
+
+def _update_pool_gauges(returning=False):
+    """
+    プールの値でゲージを更新する
+
+    checkin イベントは接続がプールに戻る前に呼ばれるので、returning=True のときは
+    戻ってくる1本を差し引く（プールの待機分が満杯なら、その接続は閉じられて overflow も1減る）
+    """
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return
+    checked_out = pool.checkedout()
+    overflow = pool.overflow()
+    if returning:
+        checked_out -= 1
+        if pool.checkedin() >= pool.size():
+            overflow -= 1
+    POOL_CHECKED_OUT.set(max(0, checked_out))
+    POOL_OVERFLOW.set(max(0, overflow))
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+    _update_pool_gauges()
+
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    _update_pool_gauges(returning=True)
+
+
+pool_wait_observers.append(POOL_WAIT.observe)
+hash_queue_wait_observers.append(HASH_QUEUE_WAIT.observe)
+hash_rejected_observers.append(lambda reason: HASH_REJECTED.labels(reason=reason).inc())
+
+
+class InventoryCollector:
+    """スクレイプ時に DB から貸出中件数・利用可能バッテリー数を集計する"""
+
+    def describe(self):
+        # 登録時に collect() が呼ばれて DB に触れないよう、名前だけを返す
+        return [
+            GaugeMetricFamily("rentals_ongoing", "貸出中の件数"),
+            GaugeMetricFamily("batteries_available", "利用可能なバッテリー数"),
+        ]
+
+    def collect(self):
+        try:
+            with get_session_context() as session:
+                ongoing = session.execute(
+                    select(func.count(Rental.id)).where(Rental.status == "ongoing")
+                ).scalar()
+                available = session.execute(
+                    select(func.coalesce(func.sum(Station.available_count), 0))
+                ).scalar()
+        except Exception as e:
+            # DB が落ちていても他のメトリクスは返す
+            logger.warning(f"inventory metrics unavailable: {e}")
+            return
+        yield GaugeMetricFamily("rentals_ongoing", "貸出中の件数", value=ongoing)
+        yield GaugeMetricFamily("batteries_available", "利用可能なバッテリー数", value=available)
+
+
+_inventory_collector = InventoryCollector()
+if not MULTIPROCESS:
+    REGISTRY.register(_inventory_collector)
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method=method, route=route, status=str(status)).observe(seconds)
+
+
+def observe_admission_rejected(route_class):
+    ADMISSION_REJECTED.labels(route_class=route_class).inc()
+
+
+def observe_login_throttled(scope):
+    LOGIN_THROTTLED.labels(scope=scope).inc()
+
+
+@contextmanager
+def track_operation(operation, error_types=()):
+    """
+    with ブロックの結果を OPERATIONS に数える
+
+    error_types に含まれる例外は str(e) を outcome にする
+    （RentalError("insufficient balance") → insufficient_balance）。
+    それ以外の例外は error。例外はそのまま送出する。
+    """
+    try:
+        yield
+    except error_types as e:
+        OPERATIONS.labels(operation=operation, outcome=str(e).replace(" ", "_")).inc()
+        raise
+    except Exception:
+        OPERATIONS.labels(operation=operation, outcome="error").inc()
+        raise
+    OPERATIONS.labels(operation=operation, outcome="success").inc()
+
+
+def render_metrics():
+    """(本文, Content-Type) を返す"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_inventory_collector)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
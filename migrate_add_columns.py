@@ -0,0 +1,27 @@
+# migrate_add_columns.py
+"""
+既存 DB に、models.py で追加されたカラムとインデックスを足すスクリプト
+（create_all は既存テーブルにカラム・インデックスを追加しないため）
+
+このスクリプトの内容は migrations.py の番号つきマイグレーション（1〜2番）に移した。
+互換のために残しており、実行すると未適用のマイグレーションをすべて当てる。
+
+使い方:
+  python migrate_add_columns.py
+  （python admin.py migrate と同じ）
+
+注意:
+  - 適用済みの番号は schema_migrations に記録されるので、何度実行してもよい
+  - SQLite / PostgreSQL の両方で動く
+"""
+from db import engine
+from migrations import upgrade
+
+
+def main():
+    applied = upgrade(engine)
+    print(f"applied {len(applied)} migration(s)")
+
+
+if __name__ == "__main__":
+    main()
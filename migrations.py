@@ -0,0 +1,236 @@
+"""
+migrations.py - 番号つきマイグレーションの実行（SQLite / PostgreSQL）
+=====================================================
+【設計意図】
+- これまでのスキーマ変更は migrate_add_columns.py / migrate_rentals_nullable.py のような
+  一回きりのスクリプトで、どの DB にどこまで当てたかが分からなかった
+- マイグレーションは番号（version）つきの関数として MIGRATIONS に登録し、
+  適用済みの番号を schema_migrations テーブルに記録する。未適用のものだけを番号順に実行する
+- 各マイグレーションは「既にあればスキップ」で書く（create_all で作った新しい DB や、
+  旧スクリプトを当て済みの DB に対して実行しても壊れない）
+
+【トランザクションとロック】
+- 通常のマイグレーションは DDL と schema_migrations への記録を1トランザクションで行う
+- インデックスの追加は PostgreSQL では CREATE INDEX CONCURRENTLY で作る（テーブルに
+  書き込みロックをかけないので、貸出・返却を止めずに本番へ当てられる）。
+  CONCURRENTLY はトランザクションの中では使えないため、自動コミットの接続で実行し、
+  作り終えてから記録する
+- PostgreSQL では実行中ずっとアドバイザリロックを取り、複数台から同時に実行しても
+  1台ずつ順に当たるようにする
+
+【注意】
+- 新しい DB は python admin.py init_db（create_all）で最新のスキーマのまま作られる。
+  そのあと python admin.py migrate を実行すると、全部が「既にある」として記録される
+- CONCURRENTLY が途中で失敗すると無効なインデックスが残るので、作り直す前に削除する
+- SQLite はテーブルの書き込みロックが DB 全体なので、大きな DB では空いている時間に当てること
+
+使い方:
+  python admin.py migrate            # 未適用のものをすべて当てる
+  python admin.py migrate --status   # 適用状況を表示する
+  python admin.py migrate --to 3     # 3 番まで当てる
+=====================================================
+"""
+
+import time
+
+from sqlalchemy import inspect, select, insert, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
+
+from models import Battery, Rental, OverdueRentalAction, SchemaMigration
+from availability import reconcile_available_counts
+
+# PostgreSQL のアドバイザリロックのキー（他の用途と重ならない適当な定数）
+MIGRATION_LOCK_KEY = 727_001
+
+MIGRATIONS = []
+
+
+class Migration:
+    """1件のマイグレーション（upgrade(conn) を実行する）"""
+
+    def __init__(self, version, name, upgrade, transactional=True):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+        # False: PostgreSQL では自動コミットの接続で実行する（CREATE INDEX CONCURRENTLY 用）
+        self.transactional = transactional
+
+
+def migration(version, name, transactional=True):
+    """関数をマイグレーションとして MIGRATIONS に登録するデコレータ"""
+
+    def register(upgrade):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"duplicate migration version: {version}")
+        MIGRATIONS.append(Migration(version, name, upgrade, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+
+    return register
+
+
+# ============================================================
+# 共通処理
+# ============================================================
+def _index(table, name):
+    """models.py に定義したインデックス（定義は models.py と1か所にする）"""
+    return next(index for index in table.indexes if index.name == name)
+
+
+def create_index(conn, index):
+    """
+    インデックスがなければ作る
+
+    PostgreSQL では CONCURRENTLY で作る（conn は自動コミットであること）。
+    前回の CONCURRENTLY が失敗して無効なインデックスが残っていれば、先に削除する。
+    """
+    concurrently = conn.dialect.name == "postgresql"
+    if concurrently:
+        valid = conn.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+            ),
+            {"name": index.name},
+        ).scalar()
+        if valid is False:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    if concurrently:
+        ddl = ddl.replace("CREATE INDEX ", "CREATE INDEX CONCURRENTLY ", 1)
+    conn.execute(text(ddl))
+
+
+def analyze(conn, table):
+    """
+    テーブルの統計を取り直す
+
+    SQLite は統計がないと、値が2種類しかない status のインデックスを部分インデックスより
+    優先してしまうため、インデックスを足したら取り直す。
+    SQLite の他の接続は統計を接続時に読むので、ワーカーを再起動するまでは古い統計のまま。
+    """
+    conn.execute(text(f"ANALYZE {table}"))
+
+
+def add_column(conn, table, column, ddl):
+    """カラムがなければ ALTER TABLE ... ADD COLUMN する（追加したら True）"""
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        # テーブルごと無い場合は create_all（init_db）で新しい定義のまま作られる
+        return False
+    if column in {c["name"] for c in inspector.get_columns(table)}:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+# ============================================================
+# マイグレーション
+# ============================================================
+# (テーブル, カラム, 型と制約)（migrate_add_columns.py で足していたもの）
+COLUMNS = [
+    ("stations", "available_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("charge_histories", "kind", "VARCHAR(30) NOT NULL DEFAULT 'charge'"),
+    ("charge_histories", "rental_id", "INTEGER REFERENCES rentals(id)"),
+    ("batteries", "level_reported_at", "TIMESTAMP"),
+    ("rentals", "station_id", "INTEGER REFERENCES stations(id)"),
+    ("rentals", "return_station_id", "INTEGER REFERENCES stations(id)"),
+]
+
+
+@migration(1, "add columns from migrate_add_columns.py")
+def _add_columns(conn):
+    added = [(table, column) for table, column, ddl in COLUMNS if add_column(conn, table, column, ddl)]
+    if ("stations", "available_count") in added:
+        # 在庫カウンタを実際のバッテリー状態で埋める
+        reconcile_available_counts(Session(bind=conn), fix=True)
+
+
+@migration(2, "rentals start_at / end_at indexes", transactional=False)
+def _rental_time_indexes(conn):
+    create_index(conn, _index(Rental.__table__, "ix_rentals_start_at"))
+    create_index(conn, _index(Rental.__table__, "ix_rentals_end_at"))
+
+
+@migration(3, "rentals (user_id, start_at, id) index", transactional=False)
+def _rental_history_index(conn):
+    # 利用履歴は user_id で絞って start_at の降順に読む。B-tree は逆順にも読めるので
+    # (user_id, start_at DESC) 用に別のインデックスは作らない
+    create_index(conn, _index(Rental.__table__, "ix_rentals_user_id_start_at_id"))
+
+
+@migration(4, "batteries (station_id, available) index", transactional=False)
+def _battery_station_index(conn):
+    create_index(conn, _index(Battery.__table__, "ix_batteries_station_id_available"))
+    analyze(conn, "batteries")
+
+
+@migration(5, "rentals partial index on status = 'ongoing'", transactional=False)
+def _ongoing_rentals_index(conn):
+    create_index(conn, _index(Rental.__table__, "ix_rentals_ongoing_start_at"))
+    analyze(conn, "rentals")
+
+
+@migration(6, "overdue_rental_actions table")
+def _overdue_actions_table(conn):
+    OverdueRentalAction.__table__.create(conn, checkfirst=True)
+
+
+# ============================================================
+# 実行
+# ============================================================
+def applied_versions(conn):
+    """適用済みの番号の集合（schema_migrations がなければ作る）"""
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+
+def _run(bind, item):
+    record = insert(SchemaMigration).values(version=item.version, name=item.name)
+    if item.transactional or bind.dialect.name != "postgresql":
+        with bind.begin() as conn:
+            item.upgrade(conn)
+            conn.execute(record)
+        return
+    with bind.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        item.upgrade(conn)
+        conn.execute(record)
+
+
+def migration_status(bind):
+    """[(version, name, 適用済みか), ...]"""
+    with bind.begin() as conn:
+        applied = applied_versions(conn)
+    return [(m.version, m.name, m.version in applied) for m in MIGRATIONS]
+
+
+def upgrade(bind, target=None, log=print):
+    """
+    未適用のマイグレーションを番号順に当てる（target を指定したらその番号まで）
+
+    【戻り値】
+    当てたマイグレーションの番号のリスト
+    """
+    done = []
+    with bind.connect() as lock_conn:
+        if bind.dialect.name == "postgresql":
+            lock_conn = lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+            lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            # ロックを取ってから読むので、別の実行が当てた分は含まれている
+            with bind.begin() as conn:
+                applied = applied_versions(conn)
+            for item in MIGRATIONS:
+                if item.version in applied or (target is not None and item.version > target):
+                    continue
+                started = time.perf_counter()
+                _run(bind, item)
+                log(f"applied {item.version}: {item.name} ({time.perf_counter() - started:.2f}s)")
+                done.append(item.version)
+        finally:
+            if bind.dialect.name == "postgresql":
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    return done
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Column, Integer, String, Boolean, ForeignKey,
-    DateTime, Float, Text, func
+    DateTime, Float, Text, Index, func, text
 )
 from sqlalchemy.orm import relationship, declarative_base
 
@@ -29,6 +29,9 @@ class Station(Base):
     lat = Column(Float, nullable=True)
     lng = Column(Float, nullable=True)
 
+    # 利用可能バッテリー数（貸出・返却と同じトランザクションで増減する非正規化カウンタ）
+    available_count = Column(Integer, default=0, server_default="0", nullable=False)
+
     batteries = relationship("Battery", back_populates="station", lazy="dynamic")
 
 
@@ -40,11 +43,18 @@ class Battery(Base):
     station_id = Column(Integer, ForeignKey("stations.id"), nullable=True)
     available = Column(Boolean, default=True, nullable=False)
     battery_level = Column(Integer, default=100, nullable=False)
+    # 最後に反映したテレメトリの計測時刻（古い計測で上書きしないための比較用）
+    level_reported_at = Column(DateTime, nullable=True)
     extra_info = Column(Text, nullable=True)
 
     station = relationship("Station", back_populates="batteries")
     rentals = relationship("Rental", back_populates="battery", lazy="dynamic")
 
+    __table_args__ = (
+        # 貸出時の「このスタンドの利用可能なバッテリー」と在庫数の集計用
+        Index("ix_batteries_station_id_available", "station_id", "available"),
+    )
+
 
 class Rental(Base):
     __tablename__ = "rentals"
@@ -52,11 +62,15 @@ class Rental(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     battery_id = Column(Integer, ForeignKey("batteries.id"), nullable=False, index=True)
+    # 貸出元スタンド（スタンドごとの料金の判定用。追加前の貸出は NULL）
+    station_id = Column(Integer, ForeignKey("stations.id"), nullable=True)
+    # 返却先スタンド（返却時に確定。集計テーブル rollup.py 用）
+    return_station_id = Column(Integer, ForeignKey("stations.id"), nullable=True)
 
     start_at = Column(DateTime(timezone=True), server_default=func.now())
     end_at = Column(DateTime(timezone=True), nullable=True)
 
-    # 状態管理（ongoing: 貸出中, returned: 返却済）
+    # 状態管理（ongoing: 貸出中, returned: 返却済, overdue: 長期未返却のため sweeper.py が終了）
     status = Column(String(30), default="ongoing", nullable=False, index=True)
 
     price_cents = Column(Integer, nullable=True)
@@ -64,13 +78,93 @@ class Rental(Base):
     user = relationship("User", back_populates="rentals")
     battery = relationship("Battery", back_populates="rentals")
 
+    __table_args__ = (
+        # 利用履歴のキーセットページング用（user_id で絞り、(start_at, id) の降順で読む）
+        Index("ix_rentals_user_id_start_at_id", "user_id", "start_at", "id"),
+        # 集計ジョブ（rollup.py）が前回以降に開始・返却された貸出だけを読むため
+        Index("ix_rentals_start_at", "start_at"),
+        Index("ix_rentals_end_at", "end_at"),
+        # 貸出中の貸出だけの部分インデックス（件数の集計・長期未返却の検出用）
+        Index(
+            "ix_rentals_ongoing_start_at", "start_at", "id",
+            sqlite_where=text("status = 'ongoing'"),
+            postgresql_where=text("status = 'ongoing'"),
+        ),
+    )
+
 
 class ChargeHistory(Base):
+    """
+    残高の増減履歴（追記のみの台帳）
+
+    チャージは正、利用料金の支払いは負の amount_cents で記録する。
+    ユーザーごとの合計が users.balance_cents と一致する。
+    """
     __tablename__ = "charge_histories"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     amount_cents = Column(Integer, nullable=False)
+
+    # 種類（charge: チャージ, rental: 利用料金, overdue: 長期未返却の請求, initial: 初回残高, adjustment: 補正）
+    kind = Column(String(30), default="charge", server_default="charge", nullable=False)
+    rental_id = Column(Integer, ForeignKey("rentals.id"), nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="charges")
+
+
+class StationHourlyStat(Base):
+    """
+    スタンド・1時間（UTC）ごとの利用集計（rollup.py が差分で更新する）
+
+    - rentals_started: その時間にそのスタンドで始まった貸出の数
+    - rentals_returned / revenue_cents / duration_seconds_total:
+      その時間にそのスタンドへ返却された貸出の数・料金合計・利用時間合計
+      （平均利用時間 = duration_seconds_total / rentals_returned）
+    - station_id = 0 の行は全スタンドの合計
+    """
+    __tablename__ = "station_hourly_stats"
+
+    station_id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    rentals_started = Column(Integer, default=0, server_default="0", nullable=False)
+    rentals_returned = Column(Integer, default=0, server_default="0", nullable=False)
+    revenue_cents = Column(Integer, default=0, server_default="0", nullable=False)
+    duration_seconds_total = Column(Float, default=0, server_default="0", nullable=False)
+
+
+class RollupWatermark(Base):
+    """集計ジョブごとの「ここまで集計した」時刻"""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(100), primary_key=True)
+    processed_until = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class OverdueRentalAction(Base):
+    """長期未返却の貸出に対して sweeper.py が行ったこと（貸出・種類ごとに1件）"""
+    __tablename__ = "overdue_rental_actions"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    rental_id = Column(Integer, ForeignKey("rentals.id"), nullable=False)
+    # flagged: 長期未返却として記録, closed: 請求して終了
+    action = Column(String(30), nullable=False)
+    # closed のときの請求額
+    amount_cents = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ux_overdue_rental_actions_rental_id_action", "rental_id", "action", unique=True),
+    )
+
+
+class SchemaMigration(Base):
+    """適用済みのマイグレーション（migrations.py が1件ずつ記録する）"""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(200), nullable=False)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
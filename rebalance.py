@@ -0,0 +1,252 @@
+"""
+rebalance.py - バッテリー再配置の計画（どのスタンドからどのスタンドへ何台運ぶか）
+=====================================================
+【設計意図】
+- 返却は人気のスタンドに偏るため、貸出の多いスタンドで在庫が尽きる
+- 過去の貸出（rentals の貸出元スタンド・開始時刻と返却先スタンド・返却時刻）から、
+  スタンド × 時刻（0〜23時）の貸出数・返却数の行列（1日あたりの平均）を NumPy で作る
+- 現在時刻から horizon_hours 時間の「貸出 - 返却」の累積の最大値が、その間に必要な在庫
+  → 必要数 + min_stock を目標在庫とし、現在の利用可能台数（batteries）との差で
+    余っているスタンド（供給）と足りないスタンド（需要）を決める
+- 運ぶ台数 × 距離の合計が小さくなるように組み合わせる（下記。最小とは限らない）
+
+【組み合わせの求め方（ヒューリスティック）】
+- 厳密な最小費用流は1万スタンドでは重いので、次の貪欲法で数秒に収める
+  1. 需要スタンドごとに、近い供給スタンド k 件を距離行列（ブロックごと）から選ぶ
+  2. 全候補の組を距離の短い順に並べ、残り台数の範囲で貪欲に割り当てる
+  3. 割り当てきれなかった需要スタンドは k を広げてやり直す（max_distance_m より遠い組は使わない）
+- 最適解との差に上限はない。例えば一直線上に 需要R2(0m)・供給D1(2m)・需要R1(3m)・供給D2(5m)
+  が各1台なら、貪欲法は D1→R1(1m), D2→R2(5m) の計6m、最適は D1→R2, D2→R1 の計4m
+  （tests/test_rebalance.py で総当たりの最適解と比べている）
+- そのため出力には "method": "greedy_nearest", "optimal": false をつける
+- 距離はスタンドの緯度経度からの平面近似（数十km以内なら誤差は小さい）
+
+【注意】
+- 返却は返却先スタンドが記録された貸出だけを数える（見回りで終了した貸出はバッテリーが
+  戻っていないので数えない。集計テーブルの返却数とはここが違う）
+- 時刻は UTC の時
+- 座標が未設定のスタンドは計画の対象外
+
+使い方:
+  python admin.py plan_rebalance --horizon 6 --history-days 28 -o moves.json
+=====================================================
+"""
+
+import math
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, func, cast, Integer
+
+from geo_index import METERS_PER_DEG
+from models import Station, Battery, Rental
+from variables import (
+    REBALANCE_HORIZON_HOURS, REBALANCE_HISTORY_DAYS, REBALANCE_MAX_DISTANCE_M,
+    REBALANCE_MIN_STOCK
+)
+
+# 距離行列を作るときの1ブロックの需要スタンド数（ブロック × 供給スタンド数の float32 を作る）
+DISTANCE_BLOCK = 512
+# 最初に見る近い供給スタンドの数（足りなければ4倍ずつ広げる）
+INITIAL_CANDIDATES = 8
+
+
+def _hour_of_day(column, dialect_name):
+    if dialect_name == "sqlite":
+        return cast(func.strftime("%H", column), Integer)
+    return func.extract("hour", column)
+
+
+def load_stations(conn):
+    """座標のあるスタンドの (ID 配列, 平面座標[m] の (n, 2) 配列)"""
+    rows = conn.execute(
+        select(Station.id, Station.lat, Station.lng)
+        .where(Station.lat.isnot(None), Station.lng.isnot(None))
+        .order_by(Station.id)
+    ).all()
+    ids = np.array([r.id for r in rows], dtype=np.int64)
+    lat = np.array([r.lat for r in rows], dtype=np.float64)
+    lng = np.array([r.lng for r in rows], dtype=np.float64)
+    # 経度方向は平均緯度の cos で縮める（正距円筒図法の近似）
+    scale = math.cos(math.radians(float(lat.mean()))) if len(rows) else 1.0
+    xy = np.column_stack([lng * scale * METERS_PER_DEG, lat * METERS_PER_DEG]).astype(np.float32)
+    return ids, xy
+
+
+def _index_of(ids, station_ids):
+    """スタンドIDの配列を ids の添字にする（ids にないものは -1）"""
+    station_ids = np.asarray(station_ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.full(len(station_ids), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(ids, station_ids), len(ids) - 1)
+    return np.where(ids[pos] == station_ids, pos, -1)
+
+
+def load_supply(conn, ids):
+    """スタンドごとの利用可能なバッテリー数"""
+    rows = conn.execute(
+        select(Battery.station_id, func.count(Battery.id))
+        .where(Battery.available == True, Battery.station_id.isnot(None))
+        .group_by(Battery.station_id)
+    ).all()
+    supply = np.zeros(len(ids), dtype=np.int64)
+    if rows:
+        index = _index_of(ids, [r[0] for r in rows])
+        counts = np.array([r[1] for r in rows], dtype=np.int64)
+        supply[index[index >= 0]] = counts[index >= 0]
+    return supply
+
+
+def load_demand(conn, ids, since, until, days):
+    """
+    スタンド × 時刻（0〜23時, UTC）の1日あたり平均の (貸出数, 返却数) 行列
+
+    [since, until) の貸出を、貸出元スタンド × 開始時刻と返却先スタンド × 返却時刻で
+    GROUP BY して読む（結果の行数はスタンド数 × 24 まで）。
+    """
+    dialect_name = conn.dialect.name
+    start_hour = _hour_of_day(Rental.start_at, dialect_name)
+    started = conn.execute(
+        select(Rental.station_id, start_hour, func.count(Rental.id))
+        .where(Rental.start_at >= since, Rental.start_at < until, Rental.station_id.isnot(None))
+        .group_by(Rental.station_id, start_hour)
+    ).all()
+    end_hour = _hour_of_day(Rental.end_at, dialect_name)
+    returned = conn.execute(
+        select(Rental.return_station_id, end_hour, func.count(Rental.id))
+        .where(Rental.end_at >= since, Rental.end_at < until, Rental.return_station_id.isnot(None))
+        .group_by(Rental.return_station_id, end_hour)
+    ).all()
+
+    def matrix(rows):
+        counts = np.zeros((len(ids), 24), dtype=np.float64)
+        if rows:
+            data = np.array([tuple(r) for r in rows], dtype=np.float64)
+            index = _index_of(ids, data[:, 0].astype(np.int64))
+            valid = index >= 0
+            np.add.at(counts, (index[valid], data[valid, 1].astype(np.int64)), data[valid, 2])
+        return counts / days
+
+    return matrix(started), matrix(returned)
+
+
+def station_targets(pickups, returns, start_hour, horizon_hours, min_stock):
+    """
+    スタンドごとの目標在庫
+
+    start_hour から horizon_hours 時間の「貸出 - 返却」の累積の最大値（0 未満は 0）を切り上げ、
+    min_stock を足す。
+    """
+    hours = (start_hour + np.arange(horizon_hours)) % 24
+    net_out = np.cumsum(pickups[:, hours] - returns[:, hours], axis=1)
+    need = np.maximum(net_out.max(axis=1, initial=0.0), 0.0)
+    return np.ceil(need).astype(np.int64) + min_stock
+
+
+def _nearest_candidates(xy, receivers, donors, k):
+    """需要スタンドごとに近い供給スタンド k 件（需要の添字, 供給の添字, 距離[m]）"""
+    donor_xy = xy[donors]
+    k = min(k, len(donors))
+    recv_parts, donor_parts, dist_parts = [], [], []
+    for start in range(0, len(receivers), DISTANCE_BLOCK):
+        block = receivers[start:start + DISTANCE_BLOCK]
+        diff = xy[block][:, None, :] - donor_xy[None, :, :]
+        dist = np.sqrt((diff * diff).sum(axis=2))
+        if k < len(donors):
+            nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.broadcast_to(np.arange(len(donors)), (len(block), len(donors)))
+        recv_parts.append(np.repeat(block, k))
+        donor_parts.append(donors[nearest].ravel())
+        dist_parts.append(np.take_along_axis(dist, nearest, axis=1).ravel())
+    return np.concatenate(recv_parts), np.concatenate(donor_parts), np.concatenate(dist_parts)
+
+
+def plan_moves(xy, surplus, deficit, max_distance_m):
+    """
+    余剰（surplus）から不足（deficit）へ運ぶ組み合わせ（貪欲法。最小費用とは限らない）
+
+    【戻り値】
+    [(供給の添字, 需要の添字, 台数, 距離[m]), ...]（距離の短い順）
+    """
+    supply = surplus.astype(np.int64).copy()
+    need = deficit.astype(np.int64).copy()
+    moves = {}
+    k = INITIAL_CANDIDATES
+
+    receivers = np.flatnonzero(need > 0)
+    donors = np.flatnonzero(supply > 0)
+    while len(receivers) and len(donors):
+        recv, donor, dist = _nearest_candidates(xy, receivers, donors, k)
+        order = np.argsort(dist, kind="stable")
+        for r, d, meters in zip(recv[order].tolist(), donor[order].tolist(), dist[order].tolist()):
+            if meters > max_distance_m:
+                break
+            if need[r] == 0 or supply[d] == 0:
+                continue
+            count = min(need[r], supply[d])
+            need[r] -= count
+            supply[d] -= count
+            key = (d, r)
+            moves[key] = (moves[key][0] + count if key in moves else count, meters)
+
+        if k >= len(donors):
+            break
+        # k 件すべてが範囲内だった需要スタンドだけ、候補を広げてやり直す
+        # （範囲外の候補があったスタンドは、それより遠い供給スタンドも範囲外）
+        out_of_range = np.isin(receivers, recv[dist > max_distance_m])
+        receivers = receivers[(need[receivers] > 0) & ~out_of_range]
+        donors = donors[supply[donors] > 0]
+        k *= 4
+
+    return sorted(
+        ((d, r, int(count), float(meters)) for (d, r), (count, meters) in moves.items()),
+        key=lambda move: move[3],
+    )
+
+
+def plan_rebalance(bind, now=None, horizon_hours=REBALANCE_HORIZON_HOURS,
+                   history_days=REBALANCE_HISTORY_DAYS, max_distance_m=REBALANCE_MAX_DISTANCE_M,
+                   min_stock=REBALANCE_MIN_STOCK):
+    """
+    再配置の計画を作る（DB は書き換えない）
+
+    組み合わせは貪欲法なので、運ぶ台数 × 距離の合計が最小とは限らない（method / optimal）。
+
+    【戻り値】
+    {"method": "greedy_nearest", "optimal": False,
+     "moves": [{"from_station_id", "to_station_id", "batteries", "distance_m"}, ...],
+     "batteries_moved", "total_distance_m", "unmet_batteries", "stations", "seconds"}
+    """
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    with bind.connect() as conn:
+        ids, xy = load_stations(conn)
+        supply = load_supply(conn, ids)
+        pickups, returns = load_demand(conn, ids, now - timedelta(days=history_days), now, history_days)
+
+    targets = station_targets(pickups, returns, now.hour, horizon_hours, min_stock)
+    surplus = np.maximum(supply - targets, 0)
+    deficit = np.maximum(targets - supply, 0)
+    moves = plan_moves(xy, surplus, deficit, max_distance_m)
+
+    moved = sum(move[2] for move in moves)
+    return {
+        "method": "greedy_nearest",
+        "optimal": False,
+        "moves": [
+            {
+                "from_station_id": int(ids[d]),
+                "to_station_id": int(ids[r]),
+                "batteries": count,
+                "distance_m": round(meters),
+            }
+            for d, r, count, meters in moves
+        ],
+        "batteries_moved": moved,
+        "total_distance_m": round(sum(move[2] * move[3] for move in moves)),
+        "unmet_batteries": int(deficit.sum()) - moved,
+        "stations": len(ids),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,268 @@
+"""
+rollup.py - スタンド・時間ごとの利用集計（差分更新の集計テーブル）
+=====================================================
+【設計意図】
+- ダッシュボードの「スタンドごと・1時間ごとの貸出数・返却数・売上・平均利用時間」を
+  rentals の全件走査ではなく、集計テーブル station_hourly_stats から読む
+- 集計ジョブ（refresh_station_hourly）はウォーターマーク（前回どこまで集計したか）を持ち、
+  前回以降に開始・返却された貸出だけを GROUP BY して、集計テーブルに加算する（UPSERT）
+- 数か月分でも 1スタンド = 24行/日 なので、主キー (station_id, hour) の範囲読みで数ミリ秒
+- station_id = 0 の行に全スタンドの合計も同時に加算する（全体のグラフ用）
+
+【ウォーターマーク】
+- 集計範囲は [前回の processed_until, 現在時刻 - ROLLUP_LAG_SECONDS)
+  開始時刻・返却時刻はコミットより少し前に決まるため、LAG だけ遅らせて
+  「集計後にコミットされて取りこぼす」ことを防ぐ
+- processed_until の更新は「前回の値のままなら更新」の条件付き UPDATE で行い、
+  同時に2つのジョブが走っても二重に加算しない（後から来た方は何もせずに終わる）
+
+【注意】
+- 返却済みの貸出の料金を後から修正しても集計には反映されない。
+  その場合は rebuild=True（python admin.py refresh_rollup --rebuild）で作り直す
+- 時間の区切りは UTC
+- 貸出元・返却先スタンドが記録される前の貸出（station_id / return_station_id が NULL）は対象外
+- 見回り（sweeper.py の close）で終了した貸出は返却先がないので、貸出元スタンドの
+  返却数・売上として数える（長期未返却の請求も売上に入る）
+
+使い方（cron で毎分など）:
+  python admin.py refresh_rollup
+  python admin.py station_stats 12 --since 2025-01-01 --until 2025-04-01 --bucket day
+=====================================================
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, func
+
+from models import Rental, StationHourlyStat, RollupWatermark
+from variables import ROLLUP_LAG_SECONDS
+
+ROLLUP_NAME = "station_hourly_stats"
+FLEET_STATION_ID = 0
+UPSERT_BATCH = 5000
+STAT_COLUMNS = ("rentals_started", "rentals_returned", "revenue_cents", "duration_seconds_total")
+
+
+def _hour_bucket(column, dialect_name):
+    """日時を1時間単位に切り捨てる SQL 式"""
+    if dialect_name == "sqlite":
+        return func.strftime("%Y-%m-%d %H:00:00", column)
+    return func.date_trunc("hour", column)
+
+
+def _duration_seconds(start, end, dialect_name):
+    if dialect_name == "sqlite":
+        # julianday は浮動小数の日数なので、ミリ秒で丸めて誤差を落とす
+        return func.round((func.julianday(end) - func.julianday(start)) * 86400.0, 3)
+    return func.extract("epoch", end - start)
+
+
+def as_utc_naive(value):
+    """
+    日時（datetime または ISO 8601 の文字列）を UTC の naive datetime にする
+
+    GROUP BY の結果（SQLite は文字列、PostgreSQL は datetime）や、API・CLI で受け取った
+    since / until に使う（+09:00 などのオフセットつきは UTC に直す。なしは UTC とみなす）。
+    """
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _window(stmt, column, since, until):
+    stmt = stmt.where(column < until)
+    if since is not None:
+        stmt = stmt.where(column >= since)
+    return stmt
+
+
+def collect_deltas(conn, since, until):
+    """
+    [since, until) に開始・返却された貸出を (スタンド, 時間) ごとに集計する
+
+    【戻り値】
+    {(station_id, hour): [開始数, 返却数, 売上, 利用秒数合計]}（station_id = 0 は全体）
+    """
+    dialect_name = conn.dialect.name
+    deltas = {}
+
+    def add(station_id, hour, values):
+        for key in ((station_id, hour), (FLEET_STATION_ID, hour)):
+            current = deltas.setdefault(key, [0, 0, 0, 0.0])
+            for i, value in enumerate(values):
+                current[i] += value
+
+    started_hour = _hour_bucket(Rental.start_at, dialect_name)
+    started = _window(
+        select(Rental.station_id, started_hour, func.count(Rental.id))
+        .where(Rental.station_id.isnot(None)),
+        Rental.start_at, since, until,
+    ).group_by(Rental.station_id, started_hour)
+    for station_id, hour, count in conn.execute(started):
+        add(station_id, as_utc_naive(hour), (count, 0, 0, 0.0))
+
+    returned_hour = _hour_bucket(Rental.end_at, dialect_name)
+    # 見回りで終了した貸出（返却先なし）は貸出元スタンドに数える
+    ended_station = func.coalesce(Rental.return_station_id, Rental.station_id)
+    returned = _window(
+        select(
+            ended_station,
+            returned_hour,
+            func.count(Rental.id),
+            func.coalesce(func.sum(Rental.price_cents), 0),
+            func.coalesce(func.sum(_duration_seconds(Rental.start_at, Rental.end_at, dialect_name)), 0),
+        )
+        # end_at が入っていれば終了済み。status で絞ると SQLite が end_at のインデックスを使わない
+        .where(ended_station.isnot(None)),
+        Rental.end_at, since, until,
+    ).group_by(ended_station, returned_hour)
+    for station_id, hour, count, revenue, seconds in conn.execute(returned):
+        add(station_id, as_utc_naive(hour), (0, count, int(revenue), float(seconds)))
+
+    return deltas
+
+
+def _dialect_insert(dialect_name):
+    """ON CONFLICT が書ける方言ごとの insert()"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert
+
+
+def _upsert_statement(dialect_name):
+    """(station_id, hour) が既にあれば各列に加算する INSERT ... ON CONFLICT"""
+    stmt = _dialect_insert(dialect_name)(StationHourlyStat)
+    columns = StationHourlyStat.__table__.c
+    return stmt.on_conflict_do_update(
+        index_elements=["station_id", "hour"],
+        set_={name: columns[name] + stmt.excluded[name] for name in STAT_COLUMNS},
+    )
+
+
+def apply_deltas(conn, deltas):
+    rows = [
+        dict(zip(("station_id", "hour") + STAT_COLUMNS, (station_id, hour, *values)))
+        for (station_id, hour), values in deltas.items()
+    ]
+    stmt = _upsert_statement(conn.dialect.name)
+    for start in range(0, len(rows), UPSERT_BATCH):
+        conn.execute(stmt, rows[start:start + UPSERT_BATCH])
+    return len(rows)
+
+
+def _claim_window(conn, until):
+    """
+    ウォーターマークを until まで進める（条件付き UPDATE）
+
+    【戻り値】
+    (集計範囲の開始 or None, 進められたか)
+    """
+    row = conn.execute(
+        select(RollupWatermark.processed_until).where(RollupWatermark.name == ROLLUP_NAME)
+    ).first()
+    if row is None:
+        # 初回のジョブが同時に2つ走っても主キー違反にならないように、既にあれば何もしない。
+        # 行を作れなかった方は、下の条件付き UPDATE で先に進めた方に負けて何もせずに終わる
+        conn.execute(
+            _dialect_insert(conn.dialect.name)(RollupWatermark)
+            .values(name=ROLLUP_NAME, processed_until=None)
+            .on_conflict_do_nothing(index_elements=["name"])
+        )
+        since = None
+    else:
+        since = row.processed_until
+        if since is not None and since >= until:
+            return since, False
+
+    unchanged = (
+        RollupWatermark.processed_until.is_(None) if since is None
+        else RollupWatermark.processed_until == since
+    )
+    result = conn.execute(
+        update(RollupWatermark)
+        .where(RollupWatermark.name == ROLLUP_NAME, unchanged)
+        .values(processed_until=until, updated_at=func.now())
+    )
+    return since, result.rowcount == 1
+
+
+def refresh_station_hourly(bind, now=None, lag_seconds=ROLLUP_LAG_SECONDS, rebuild=False):
+    """
+    前回の集計以降に開始・返却された貸出を集計テーブルに加算する
+
+    rebuild=True なら集計テーブルを空にして最初から作り直す。
+    ウォーターマークの更新と加算は同じトランザクションで行う（途中で失敗したらどちらも戻る）。
+
+    【戻り値】
+    {"since", "until", "updated_rows", "skipped", "seconds"}
+    """
+    started = time.perf_counter()
+    until = (now or datetime.utcnow()) - timedelta(seconds=lag_seconds)
+
+    with bind.begin() as conn:
+        if rebuild:
+            conn.execute(delete(StationHourlyStat))
+            conn.execute(
+                update(RollupWatermark)
+                .where(RollupWatermark.name == ROLLUP_NAME)
+                .values(processed_until=None)
+            )
+
+        since, claimed = _claim_window(conn, until)
+        updated_rows = apply_deltas(conn, collect_deltas(conn, since, until)) if claimed else 0
+
+    return {
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat(),
+        "updated_rows": updated_rows,
+        "skipped": not claimed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def station_stats(conn, station_id, since, until, bucket="hour"):
+    """
+    集計テーブルから1スタンド（0 は全体）の時系列と合計を返す
+
+    bucket は "hour" または "day"（日ごとの合計は時間ごとの行を足して作る）。
+    """
+    rows = conn.execute(
+        select(StationHourlyStat.hour, *[StationHourlyStat.__table__.c[name] for name in STAT_COLUMNS])
+        .where(
+            StationHourlyStat.station_id == station_id,
+            StationHourlyStat.hour >= since,
+            StationHourlyStat.hour < until,
+        )
+        .order_by(StationHourlyStat.hour)
+    ).all()
+
+    buckets = {}
+    for hour, *values in rows:
+        key = hour if bucket == "hour" else hour.replace(hour=0)
+        current = buckets.setdefault(key, [0, 0, 0, 0.0])
+        for i, value in enumerate(values):
+            current[i] += value
+
+    def item(values):
+        started_count, returned_count, revenue, seconds = values
+        return {
+            "rentals_started": started_count,
+            "rentals_returned": returned_count,
+            "revenue_cents": revenue,
+            "mean_duration_seconds": round(seconds / returned_count, 1) if returned_count else None,
+        }
+
+    totals = [sum(values[i] for values in buckets.values()) for i in range(4)]
+    return {
+        "station_id": station_id,
+        "bucket": bucket,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "series": [{"at": key.isoformat(), **item(values)} for key, values in buckets.items()],
+        "totals": item(totals),
+    }
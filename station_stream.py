@@ -0,0 +1,243 @@
+"""
+station_stream.py - スタンド在庫の変化を SSE で配信するブロードキャスター
+=====================================================
+【設計意図】
+- 端末が /api/stations 全体を取り直す代わりに、変化したスタンドの在庫数だけを
+  Server-Sent Events（/api/stations/stream, asgi_api.py）で受け取れるようにする
+- DB を読むのはプロセスに1つのブロードキャスターだけ。購読者ごとのポーリングはしない
+  （購読者が何千いても、DB への問い合わせは STREAM_POLL_INTERVAL_MS ごとに1回）
+- 貸出・返却のコミットは Flask（WSGI）側のプロセスで起きるため、ここでは
+  stations.available_count を間隔ごとに読み、前回との差分を1つのイベントにまとめて流す
+- イベントは1回だけ JSON にエンコードし、同じバイト列を全購読者のキューに入れる
+
+【イベント】
+- snapshot: 全スタンドの在庫 [{"station_id": 1, "available": 5}, ...]
+  接続直後（再開できない場合）と STREAM_SNAPSHOT_SECONDS ごとに送る
+- delta: 前回から変化したスタンドだけ [{"station_id": 3, "available": 4}, ...]
+
+【再開（Last-Event-ID）】
+- イベントIDは「プロセスごとの epoch-連番」。snapshot の ID は、その時点までの delta の連番
+- 再接続時の Last-Event-ID が同じ epoch で、それ以降の delta が STREAM_REPLAY_EVENTS 件の
+  履歴に残っていれば、その delta だけを送り直す。そうでなければ snapshot から始める
+
+【最初の読み込みに失敗したとき】
+- 接続時は最初の在庫読み込みを待つが、読み込みが失敗したとき・ready_timeout 秒を過ぎたときは
+  StreamUnavailableError を投げる（API は 503 を返し、クライアントの再接続に任せる）
+- 次の接続でまた読み直す（DB が戻れば普通につながる）
+
+【遅い購読者】
+- 購読者ごとのキューは STREAM_SUBSCRIBER_QUEUE 件まで。溢れた購読者は切断し、
+  クライアントの自動再接続（Last-Event-ID つき）に任せる（他の購読者を待たせない）
+=====================================================
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from sqlalchemy import select
+
+from models import Station
+
+logger = logging.getLogger(__name__)
+
+
+def station_counts_query():
+    """ブロードキャスター用の軽い SELECT（ID と在庫数だけ）"""
+    return select(Station.id, Station.available_count).order_by(Station.id)
+
+
+def encode_event(event, event_id, payload):
+    """SSE の1イベント分のバイト列"""
+    data = json.dumps(payload, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n".encode("utf-8")
+
+
+class StreamUnavailableError(Exception):
+    """最初の在庫を読めていない（DB 障害など）ので購読を始められない"""
+
+
+class Subscriber:
+    """1接続分のキュー。溢れたら dropped になり、残りを送り終えたら接続を閉じる"""
+
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    async def next(self, timeout):
+        """次のイベント（timeout 秒来なければ None）"""
+        if self.dropped and self.queue.empty():
+            return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class StationBroadcaster:
+    """
+    在庫の差分をプロセス内の全購読者に配る
+
+    【使用例】
+    subscriber, initial = await broadcaster.subscribe(last_event_id)
+    try:
+        for message in initial: ...
+        message = await subscriber.next(timeout)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+    loader は {station_id: available} を返す async 関数。
+    """
+
+    def __init__(self, loader, poll_interval_ms, snapshot_seconds, replay_events, subscriber_queue,
+                 ready_timeout=5):
+        self.loader = loader
+        self.poll_interval = poll_interval_ms / 1000
+        self.snapshot_seconds = snapshot_seconds
+        self.replay_events = replay_events
+        self.subscriber_queue = subscriber_queue
+        self.ready_timeout = ready_timeout
+        self._loop = None
+        self._task = None
+
+    def _reset(self):
+        # プロセスの起動ごと（テストではイベントループごと）に ID の系列を変える
+        self.epoch = f"{os.getpid():x}{int(time.time() * 1000):x}"
+        self._seq = 0
+        self._state = None
+        self._snapshot = None  # (連番, バイト列)
+        self._last_snapshot_at = 0.0
+        self._replay = deque(maxlen=self.replay_events)  # (連番, バイト列)
+        self._subscribers = set()
+        self._waiters = 0  # 最初の読み込みを待っている subscribe() の数
+        self._error = None
+        self._ready = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._reset()
+        self._loop = loop
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._subscribers and not self._waiters:
+                # 購読者がいない間は DB を読まない
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.warning(f"station stream poll failed: {e}")
+                if self._state is None:
+                    # 待っている subscribe() を起こして失敗を返す。
+                    # 次の subscribe() は新しい Event で次の読み込みを待つ
+                    self._error = e
+                    ready, self._ready = self._ready, asyncio.Event()
+                    ready.set()
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        """在庫を読み、差分を配る（一定時間ごとに snapshot も配る）"""
+        current = await self.loader()
+        if self._state is None:
+            self._state = current
+            self._last_snapshot_at = time.monotonic()
+            self._ready.set()
+            return
+
+        changes = [
+            {"station_id": station_id, "available": available}
+            for station_id, available in current.items()
+            if self._state.get(station_id) != available
+        ]
+        # 削除されたスタンドは在庫 0 として流す
+        changes.extend(
+            {"station_id": station_id, "available": 0}
+            for station_id in self._state.keys() - current.keys()
+        )
+        self._state = current
+
+        if changes:
+            self._seq += 1
+            message = encode_event("delta", self._event_id(self._seq), changes)
+            self._replay.append((self._seq, message))
+            self._fanout(message)
+
+        if time.monotonic() - self._last_snapshot_at >= self.snapshot_seconds:
+            self._last_snapshot_at = time.monotonic()
+            self._fanout(self._snapshot_message())
+
+    def _event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def _snapshot_message(self):
+        # 同じ連番の snapshot は1回だけエンコードして使い回す
+        if self._snapshot is None or self._snapshot[0] != self._seq:
+            payload = [
+                {"station_id": station_id, "available": available}
+                for station_id, available in sorted(self._state.items())
+            ]
+            self._snapshot = (self._seq, encode_event("snapshot", self._event_id(self._seq), payload))
+        return self._snapshot[1]
+
+    def _replay_after(self, last_event_id):
+        """Last-Event-ID 以降の delta（再開できなければ None）"""
+        epoch, _, seq = (last_event_id or "").rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        floor = self._replay[0][0] - 1 if self._replay else self._seq
+        if not floor <= seq <= self._seq:
+            return None
+        return [message for message_seq, message in self._replay if message_seq > seq]
+
+    def _fanout(self, message):
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                subscriber.dropped = True
+                self._subscribers.discard(subscriber)
+
+    async def subscribe(self, last_event_id=None):
+        """
+        (Subscriber, 最初に送るイベントのリスト) を返す
+
+        最初の在庫を読めなければ StreamUnavailableError（ready_timeout 秒まで待つ）
+        """
+        self._ensure_started()
+        self._wakeup.set()
+        if self._state is None:
+            self._waiters += 1
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.ready_timeout)
+            except asyncio.TimeoutError:
+                raise StreamUnavailableError("station stream is not ready") from None
+            finally:
+                self._waiters -= 1
+            if self._state is None:
+                raise StreamUnavailableError(f"station stream poll failed: {self._error}")
+
+        # ここから登録までの間に await を挟まないので、取りこぼし・重複は起きない
+        initial = self._replay_after(last_event_id)
+        if initial is None:
+            initial = [self._snapshot_message()]
+        subscriber = Subscriber(self.subscriber_queue)
+        self._subscribers.add(subscriber)
+        return subscriber, initial
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers) if self._task else 0,
+            "last_event_id": self._event_id(self._seq) if self._task else None,
+        }
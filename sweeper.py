@@ -0,0 +1,156 @@
+"""
+sweeper.py - 長期未返却の貸出の見回り（cron で定期的に実行する）
+=====================================================
+【設計意図】
+- 返却されない貸出は status = 'ongoing' のまま残り、いつか返却されたときの請求額にも上限がなかった
+  → 請求の上限は料金表の max_charge_cents（既定は RENTAL_MAX_CHARGE_CENTS）で返却時にも効く
+- 見回りは貸出開始から OVERDUE_AFTER_HOURS を過ぎた貸出中の貸出を探し、SWEEPER_POLICY に従って
+  - flag:  overdue_rental_actions に記録するだけ（運用側の連絡・回収用。同じ貸出は1回だけ）
+  - close: その時点の料金（上限つき）を請求して貸出を終了する（status = overdue）
+  行ったことはすべて overdue_rental_actions に記録する（close の請求は台帳にも kind = overdue で残る）
+
+【貸出・返却を邪魔しない工夫】
+- 探すのは部分インデックス ix_rentals_ongoing_start_at（貸出中の行だけ）を (start_at, id) の
+  キーセットで SWEEPER_BATCH_SIZE 件ずつ。読み取りはトランザクションを張らずに行う
+- 書き込みは1バッチ = 1つの短いトランザクションで、バッチの間に SWEEPER_BATCH_PAUSE_MS 休む
+  （SQLite は書き込みロックが DB 全体なので、貸出・返却をその間に通す）
+- 終了は返却と同じ「status = 'ongoing' なら更新」の条件付き UPDATE で行う
+  → 見回りと同時に利用者が返却しても、どちらか一方だけが請求する
+
+【注意】
+- close で終了した貸出のバッテリーは利用不可のまま（手元にあるので、回収後に在庫へ戻す）
+  終了後に返却しようとしても "invalid rental" になる
+- close の請求は残高が足りなくても行う（残高がマイナスになる）
+- close で終了した貸出は return_station_id が NULL のまま。利用集計（rollup.py）では
+  貸出元スタンドの返却数・売上として数える
+- 同時に複数の見回りを走らせないこと（cron は1台から）
+
+使い方（cron で10分ごとなど）:
+  python admin.py sweep_overdue [--policy flag|close] [--dry-run]
+=====================================================
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_, literal_column
+from sqlalchemy.orm import Session
+
+from models import Rental, OverdueRentalAction
+from ledger import debit
+from tariff import active_tariff
+from variables import (
+    OVERDUE_AFTER_HOURS, SWEEPER_POLICY, SWEEPER_BATCH_SIZE, SWEEPER_BATCH_PAUSE_MS
+)
+
+POLICIES = ("flag", "close")
+
+# 部分インデックスの条件（WHERE status = 'ongoing'）と同じ形で書く。
+# SQLite はバインド変数（status = ?）だと部分インデックスを使わない
+ONGOING = Rental.status == literal_column("'ongoing'")
+
+
+def overdue_batch_query(cutoff, after=None, limit=SWEEPER_BATCH_SIZE):
+    """cutoff より前に始まった貸出中の貸出を (start_at, id) の順に limit 件読む SELECT 文"""
+    stmt = select(Rental.id, Rental.user_id, Rental.start_at, Rental.station_id).where(
+        ONGOING, Rental.start_at < cutoff
+    )
+    if after is not None:
+        last_start, last_id = after
+        stmt = stmt.where(
+            Rental.start_at >= last_start,
+            or_(Rental.start_at > last_start, Rental.id > last_id)
+        )
+    return stmt.order_by(Rental.start_at, Rental.id).limit(limit)
+
+
+def _flag(session, rows):
+    """まだ記録していない貸出だけを flagged として記録する（記録した件数）"""
+    flagged = set(session.execute(
+        select(OverdueRentalAction.rental_id).where(
+            OverdueRentalAction.rental_id.in_([row.id for row in rows]),
+            OverdueRentalAction.action == "flagged",
+        )
+    ).scalars())
+    new = [row for row in rows if row.id not in flagged]
+    session.add_all([OverdueRentalAction(rental_id=row.id, action="flagged") for row in new])
+    return len(new)
+
+
+def close_overdue_rental(session, row, now, tariff):
+    """
+    貸出を終了して請求する（呼び出し元のトランザクション内で実行する）
+
+    【戻り値】
+    請求額（同時に返却されて終了できなかった場合は None）
+    """
+    price = tariff.price(row.start_at, now, row.station_id)
+    result = session.execute(
+        update(Rental)
+        .where(Rental.id == row.id, Rental.status == "ongoing")
+        .values(end_at=now, price_cents=price, status="overdue")
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    debit(session, row.user_id, price, kind="overdue", rental_id=row.id, allow_negative=True)
+    session.add(OverdueRentalAction(rental_id=row.id, action="closed", amount_cents=price))
+    return price
+
+
+def sweep_overdue(bind, now=None, policy=SWEEPER_POLICY, overdue_after_hours=OVERDUE_AFTER_HOURS,
+                  batch_size=SWEEPER_BATCH_SIZE, pause_ms=SWEEPER_BATCH_PAUSE_MS,
+                  tariff=None, dry_run=False):
+    """
+    長期未返却の貸出をバッチごとに処理する
+
+    dry_run=True なら何も書き込まずに件数（close なら請求予定額）だけ数える。
+
+    【戻り値】
+    {"policy", "cutoff", "overdue", "flagged", "closed", "skipped", "charged_cents", "batches", "seconds"}
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy: {policy} (choose from {', '.join(POLICIES)})")
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(hours=overdue_after_hours)
+    tariff = tariff or active_tariff
+    summary = {
+        "policy": policy, "cutoff": cutoff.isoformat(), "overdue": 0, "flagged": 0,
+        "closed": 0, "skipped": 0, "charged_cents": 0, "batches": 0,
+    }
+
+    after = None
+    while True:
+        with bind.connect() as conn:
+            rows = conn.execute(overdue_batch_query(cutoff, after, batch_size)).all()
+        if not rows:
+            break
+        after = (rows[-1].start_at, rows[-1].id)
+        summary["overdue"] += len(rows)
+        summary["batches"] += 1
+
+        if dry_run:
+            if policy == "close":
+                summary["charged_cents"] += sum(
+                    tariff.price(row.start_at, now, row.station_id) for row in rows
+                )
+        else:
+            with Session(bind, autoflush=False) as session, session.begin():
+                if policy == "flag":
+                    summary["flagged"] += _flag(session, rows)
+                else:
+                    for row in rows:
+                        price = close_overdue_rental(session, row, now, tariff)
+                        if price is None:
+                            summary["skipped"] += 1
+                            continue
+                        summary["closed"] += 1
+                        summary["charged_cents"] += price
+
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause_ms / 1000)
+
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
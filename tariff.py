@@ -0,0 +1,316 @@
+"""
+tariff.py - 料金計算（料金表のコンパイルと一括再計算）
+=====================================================
+【設計意図】
+- 料金のルール（時間帯別の分単価・1日の上限・スタンドごとの上書き）は
+  起動時に1回だけ「1日 1440 分の単価表の累積和」にコンパイルする
+  → 1件の料金は、日ごとに累積和の差を取って上限で切るだけ（分ごとのループなし）
+- 同じ計算を NumPy で配列ごとに行う price_many() を用意し、
+  過去の貸出数百万件を候補の料金表で数秒で計算し直せるようにする（reprice_rentals）
+- 返却時の1件の計算（price）と一括計算（price_many）は同じ式なので、結果は一致する
+  （一括計算は日時をミリ秒の整数で扱うため、1ミリ秒未満の端数で分の境界をまたぐ場合だけ異なりうる）
+
+【料金表（JSON）】
+{
+  "per_minute_cents": 10,                 # 基本の分単価
+  "minimum_minutes": 1,                   # 最低課金分数（1分未満は1分）
+  "bands": [                              # 時間帯別の分単価（現地時刻、終了は含まない）
+    {"start": "22:00", "end": "06:00", "per_minute_cents": 5}
+  ],
+  "daily_cap_cents": 1500,                # 1日（現地時刻の0時区切り）あたりの上限
+  "max_charge_cents": 10000,              # 1件あたりの上限（長期未返却でも請求はここまで）
+  "stations": {                           # スタンドごとの上書き（貸出元スタンドで決まる）
+    "12": {"per_minute_cents": 8, "daily_cap_cents": 1000}
+  }
+}
+- 省略した項目は基本の値を引き継ぐ（bands を指定したスタンドは bands ごと置き換え）
+- n 分目の単価は「貸出開始 + n 分」の時刻が含まれる時間帯の単価
+- 現地時刻は UTC + TARIFF_UTC_OFFSET_HOURS（DB の日時は UTC で保存されている前提）
+
+【注意】
+- 料金表ファイル（TARIFF_FILE）を省略すると PRICE_PER_MINUTE_CENTS だけの料金表になる
+  （従来の max(1, 分) * PRICE_PER_MINUTE_CENTS と同じ結果）
+- max_charge_cents を省略すると RENTAL_MAX_CHARGE_CENTS（0 なら上限なし）になる
+=====================================================
+"""
+
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import select, func, cast, BigInteger
+
+from models import Rental
+from variables import (
+    PRICE_PER_MINUTE_CENTS, RENTAL_MAX_CHARGE_CENTS, TARIFF_FILE, TARIFF_UTC_OFFSET_HOURS
+)
+
+MINUTES_PER_DAY = 1440
+# 上限なしを表す値（日数を掛けても int64 に収まるよう、1日分の料金と min を取ってから使う）
+NO_CAP = 2 ** 53
+EPOCH = datetime(1970, 1, 1)
+
+
+class TariffError(ValueError):
+    """料金表の内容が不正"""
+
+
+def _parse_hhmm(value):
+    try:
+        hours, minutes = str(value).split(":")
+        minute = int(hours) * 60 + int(minutes)
+    except ValueError:
+        raise TariffError(f"invalid time: {value!r}")
+    if not 0 <= minute <= MINUTES_PER_DAY:
+        raise TariffError(f"invalid time: {value!r}")
+    return minute
+
+
+def _non_negative(profile, key):
+    value = int(profile[key])
+    if value < 0:
+        raise TariffError(f"{key} must not be negative")
+    return value
+
+
+def _compile_rates(profile):
+    """1日 1440 分の分単価の配列を作る"""
+    rates = np.full(MINUTES_PER_DAY, _non_negative(profile, "per_minute_cents"), dtype=np.int64)
+    for band in profile.get("bands") or []:
+        start = _parse_hhmm(band["start"])
+        end = _parse_hhmm(band["end"])
+        rate = _non_negative(band, "per_minute_cents")
+        if start < end:
+            rates[start:end] = rate
+        else:
+            # 0時をまたぐ帯（start == end は終日）
+            rates[start:] = rate
+            rates[:end] = rate
+    return rates
+
+
+def _utc_naive(value):
+    """aware な日時は UTC の naive にそろえる（naive はもともと UTC とみなす）"""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class Tariff:
+    """
+    コンパイル済みの料金表
+
+    【使用例】
+    tariff = Tariff({"per_minute_cents": 10, "daily_cap_cents": 1500})
+    tariff.price(start_at, end_at, station_id)                     # 1件
+    tariff.price_many(start_ms, end_ms, station_ids)               # NumPy 配列でまとめて
+    """
+
+    def __init__(self, config=None, utc_offset_hours=TARIFF_UTC_OFFSET_HOURS):
+        config = dict(config or {"per_minute_cents": PRICE_PER_MINUTE_CENTS})
+        config.setdefault("per_minute_cents", PRICE_PER_MINUTE_CENTS)
+        config.setdefault("max_charge_cents", RENTAL_MAX_CHARGE_CENTS or None)
+        self.config = config
+        self.offset_seconds = int(utc_offset_hours * 3600)
+        self.minimum_minutes = int(config.get("minimum_minutes", 1))
+
+        # プロファイル 0 が基本、1 以降がスタンドごとの上書き
+        profiles = [config]
+        station_profile = {}
+        for station_id, override in (config.get("stations") or {}).items():
+            station_profile[int(station_id)] = len(profiles)
+            profiles.append({**config, **override})
+
+        rates = np.stack([_compile_rates(profile) for profile in profiles])
+        # cum[p, m] = プロファイル p の 0時から m 分までの料金
+        self._cum = np.zeros((len(profiles), MINUTES_PER_DAY + 1), dtype=np.int64)
+        self._cum[:, 1:] = np.cumsum(rates, axis=1)
+        self._caps = np.array([
+            _non_negative(profile, "daily_cap_cents") if profile.get("daily_cap_cents") is not None
+            else NO_CAP
+            for profile in profiles
+        ], dtype=np.int64)
+        self._max_charges = np.array([
+            _non_negative(profile, "max_charge_cents") if profile.get("max_charge_cents") is not None
+            else NO_CAP
+            for profile in profiles
+        ], dtype=np.int64)
+
+        self._station_profile = station_profile
+        lookup_size = max(station_profile, default=-1) + 1
+        self._profile_lookup = np.zeros(lookup_size, dtype=np.int64)
+        for station_id, index in station_profile.items():
+            self._profile_lookup[station_id] = index
+
+        # 1件ずつの計算は Python のリストの方が速い
+        self._cum_rows = self._cum.tolist()
+        self._caps_list = self._caps.tolist()
+        self._max_charges_list = self._max_charges.tolist()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def _span_price(self, profile, start_minute, minutes):
+        """現地時刻の通算分 start_minute から minutes 分の料金（日ごとに上限で切る）"""
+        cum = self._cum_rows[profile]
+        cap = self._caps_list[profile]
+        first_day, first_minute = divmod(start_minute, MINUTES_PER_DAY)
+        last_day, last_minute = divmod(start_minute + minutes, MINUTES_PER_DAY)
+        if first_day == last_day:
+            return min(cap, cum[last_minute] - cum[first_minute])
+        full_day = min(cap, cum[MINUTES_PER_DAY])
+        return (
+            min(cap, cum[MINUTES_PER_DAY] - cum[first_minute])
+            + (last_day - first_day - 1) * full_day
+            + min(cap, cum[last_minute])
+        )
+
+    def price(self, start_at, end_at, station_id=None):
+        """1件の利用料金（返却時・長期未返却の自動終了時に使う）"""
+        start_at = _utc_naive(start_at)
+        end_at = _utc_naive(end_at)
+        minutes = max(self.minimum_minutes, int((end_at - start_at).total_seconds() // 60))
+        start_minute = int(((start_at - EPOCH).total_seconds() + self.offset_seconds) // 60)
+        profile = self._station_profile.get(station_id, 0) if station_id is not None else 0
+        return int(min(self._max_charges_list[profile], self._span_price(profile, start_minute, minutes)))
+
+    def profiles_for(self, station_ids):
+        """スタンドIDの配列をプロファイル番号の配列にする（上書きのないスタンド・負数は 0）"""
+        ids = np.asarray(station_ids, dtype=np.int64)
+        profiles = np.zeros(ids.shape, dtype=np.int64)
+        valid = (ids >= 0) & (ids < len(self._profile_lookup))
+        profiles[valid] = self._profile_lookup[ids[valid]]
+        return profiles
+
+    def price_many(self, start_ms, end_ms, station_ids=None):
+        """
+        price() の配列版
+
+        start_ms / end_ms は UNIX 時刻のミリ秒（int64 の配列）、
+        station_ids はスタンドIDの配列（不明なら -1）。料金の int64 配列を返す。
+        """
+        start_ms = np.asarray(start_ms, dtype=np.int64)
+        end_ms = np.asarray(end_ms, dtype=np.int64)
+        minutes = np.maximum(self.minimum_minutes, (end_ms - start_ms) // 60000)
+        start_minute = (start_ms + self.offset_seconds * 1000) // 60000
+        if station_ids is None:
+            profiles = np.zeros(start_minute.shape, dtype=np.int64)
+        else:
+            profiles = self.profiles_for(station_ids)
+
+        cum = self._cum
+        cap = self._caps[profiles]
+        first_day, first_minute = np.divmod(start_minute, MINUTES_PER_DAY)
+        last_day, last_minute = np.divmod(start_minute + minutes, MINUTES_PER_DAY)
+        same_day = first_day == last_day
+        day_total = cum[profiles, MINUTES_PER_DAY]
+
+        first = np.minimum(cap, np.where(
+            same_day,
+            cum[profiles, last_minute] - cum[profiles, first_minute],
+            day_total - cum[profiles, first_minute],
+        ))
+        middle = np.maximum(last_day - first_day - 1, 0) * np.minimum(cap, day_total)
+        last = np.where(same_day, 0, np.minimum(cap, cum[profiles, last_minute]))
+        return np.minimum(self._max_charges[profiles], first + middle + last)
+
+
+def load_tariff(path=TARIFF_FILE):
+    """TARIFF_FILE があればその料金表、なければ PRICE_PER_MINUTE_CENTS だけの料金表"""
+    return Tariff.from_file(path) if path else Tariff()
+
+
+# アプリ全体で使う料金表（起動時に1回だけコンパイルする）
+active_tariff = load_tariff()
+
+
+def epoch_millis(column, dialect_name):
+    """日時カラムを UNIX 時刻のミリ秒（整数）にする SQL 式"""
+    if dialect_name == "sqlite":
+        millis = (func.julianday(column) - 2440587.5) * 86400000.0
+    else:
+        millis = func.extract("epoch", column) * 1000
+    return cast(func.round(millis), BigInteger)
+
+
+def reprice_rentals(tariff, bind, since=None, until=None, chunk_size=500000, top_stations=10):
+    """
+    返却済みの貸出を候補の料金表で計算し直し、実際の請求額と比べる（DB は書き換えない）
+
+    【設計意図】
+    - 日時は SQL 側でミリ秒の整数にして取り出し、chunk_size 行ずつ NumPy 配列にして
+      price_many に渡す（Python の datetime を行ごとに作らない）
+    - stream_results で読むので、件数が多くてもメモリ使用量は chunk_size 行分
+
+    【戻り値】
+    件数・現在の請求総額・候補の請求総額・差額・変わった件数と、
+    差額の大きいスタンド top_stations 件の辞書
+    """
+    started = time.perf_counter()
+    dialect_name = bind.dialect.name
+    stmt = (
+        select(
+            func.coalesce(Rental.station_id, -1),
+            epoch_millis(Rental.start_at, dialect_name),
+            epoch_millis(Rental.end_at, dialect_name),
+            func.coalesce(Rental.price_cents, 0),
+        )
+        .where(Rental.status == "returned", Rental.end_at.isnot(None))
+    )
+    if since is not None:
+        stmt = stmt.where(Rental.start_at >= since)
+    if until is not None:
+        stmt = stmt.where(Rental.start_at < until)
+
+    count = 0
+    current_total = 0
+    candidate_total = 0
+    increased = 0
+    decreased = 0
+    diff_by_station = np.zeros(0, dtype=np.float64)
+
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        for rows in result.partitions(chunk_size):
+            # Row を1行ずつ配列にせず、全値を平らにして一度に読み込む
+            data = np.fromiter(
+                itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4
+            ).reshape(-1, 4)
+            station_ids = data[:, 0]
+            current = data[:, 3]
+            candidate = tariff.price_many(data[:, 1], data[:, 2], station_ids)
+            diff = candidate - current
+
+            count += len(rows)
+            current_total += int(current.sum())
+            candidate_total += int(candidate.sum())
+            increased += int((diff > 0).sum())
+            decreased += int((diff < 0).sum())
+
+            # スタンドID + 1 を添字にして集計（ID 不明の -1 は 0 番）
+            by_station = np.bincount(station_ids + 1, weights=diff)
+            if len(by_station) > len(diff_by_station):
+                by_station[:len(diff_by_station)] += diff_by_station
+                diff_by_station = by_station
+            else:
+                diff_by_station[:len(by_station)] += by_station
+
+    order = np.argsort(-np.abs(diff_by_station))[:top_stations]
+    return {
+        "rentals": count,
+        "current_cents": current_total,
+        "candidate_cents": candidate_total,
+        "diff_cents": candidate_total - current_total,
+        "increased": increased,
+        "decreased": decreased,
+        "unchanged": count - increased - decreased,
+        "top_stations": [
+            {"station_id": int(i) - 1 if i else None, "diff_cents": int(diff_by_station[i])}
+            for i in order if diff_by_station[i]
+        ],
+        "seconds": round(time.perf_counter() - started, 2),
+    }
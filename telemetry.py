@@ -0,0 +1,255 @@
+"""
+telemetry.py - バッテリー残量テレメトリの取り込み（write-behind バッファ）
+=====================================================
+【設計意図】
+- ステーションは数秒ごとに残量を送ってくるが、画面に必要なのは各バッテリーの最新値だけ
+- 受け取った計測値はプロセス内のバッファ（シリアル → 最新の計測）に上書きで溜め、
+  同じバッテリーの計測は1件にまとめる（古い計測時刻のものは捨てる）
+- 書き出しはバックグラウンドのスレッドが TELEMETRY_FLUSH_INTERVAL_MS ごと、
+  またはバッファが TELEMETRY_FLUSH_MAX_ROWS 件に達したときに行う
+- 書き出しは CASE 式を使った UPDATE 1文で UPDATE_CHUNK 台ずつ更新する
+  （毎秒数千件の計測でも、DB への文は数文で済む）
+
+【複数ワーカー】
+- バッファはプロセスごとにあるので、同じバッテリーの計測が別々のワーカーから書かれることがある
+- UPDATE の条件に「level_reported_at が今回の計測時刻より古い」を入れ、
+  遅れて書き出された古い計測で新しい値を上書きしない
+- そのため未来の時刻の計測が1件でも入ると、実際の計測がその時刻まで反映されなくなる
+  → 現在時刻 + TELEMETRY_MAX_CLOCK_SKEW_SECONDS より先の時刻の計測は不正として捨てる
+
+【注意】
+- バッファはメモリ上にあるため、プロセスが強制終了すると未書き出しの計測は失われる
+  （通常終了時は atexit で書き出す）。次の計測で上書きされる性質のデータなので許容する
+=====================================================
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update, case, or_
+
+from db import engine
+from models import Battery
+from variables import (
+    TELEMETRY_FLUSH_INTERVAL_MS, TELEMETRY_FLUSH_MAX_ROWS, TELEMETRY_MAX_CLOCK_SKEW_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# UPDATE 1文で更新するバッテリー数（バインド変数は1台あたり7個）
+UPDATE_CHUNK = 500
+
+
+def _parse_ts(value, now):
+    """
+    計測時刻（UNIX 秒 または ISO 8601）を UTC の naive datetime にする。省略時は now
+
+    now + TELEMETRY_MAX_CLOCK_SKEW_SECONDS より先の時刻は ValueError（時計のずれたステーション）
+    """
+    if value is None:
+        return now
+    if isinstance(value, bool):
+        raise ValueError("invalid ts")
+    if isinstance(value, (int, float)):
+        ts = datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    else:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    if ts > now + timedelta(seconds=TELEMETRY_MAX_CLOCK_SKEW_SECONDS):
+        raise ValueError("ts in the future")
+    return ts
+
+
+def parse_readings(items, now=None):
+    """
+    リクエストの計測値を検証する
+
+    【入力】
+    [{"serial": "BT0000000001", "level": 87, "ts": 1760000000}, ...]
+    level は 0〜100、ts は省略可（UNIX 秒 または ISO 8601）。未来の時刻は不正
+
+    【戻り値】
+    ([(serial, level, ts), ...], 不正で捨てた件数)
+    """
+    now = now or datetime.utcnow()
+    readings = []
+    rejected = 0
+    for item in items:
+        try:
+            serial = item["serial"]
+            level = item["level"]
+            if not isinstance(serial, str) or not serial or len(serial) > 120:
+                raise ValueError("invalid serial")
+            if isinstance(level, bool) or not isinstance(level, (int, float)):
+                raise ValueError("invalid level")
+            level = int(round(level))
+            if not 0 <= level <= 100:
+                raise ValueError("invalid level")
+            readings.append((serial, level, _parse_ts(item.get("ts"), now)))
+        except (KeyError, TypeError, ValueError, AttributeError, OverflowError, OSError):
+            rejected += 1
+    return readings, rejected
+
+
+def build_level_update(chunk):
+    """
+    [(serial, (ts, level)), ...] をまとめて反映する UPDATE 文
+
+    UPDATE batteries
+       SET battery_level = CASE serial WHEN :s1 THEN :l1 ... END,
+           level_reported_at = CASE serial WHEN :s1 THEN :t1 ... END
+     WHERE serial IN (...)
+       AND (level_reported_at IS NULL OR level_reported_at < CASE serial ... END)
+    """
+    levels = {serial: level for serial, (ts, level) in chunk}
+    stamps = {serial: ts for serial, (ts, level) in chunk}
+    reported_at = case(stamps, value=Battery.serial)
+    return (
+        update(Battery)
+        .where(
+            Battery.serial.in_(list(levels)),
+            or_(Battery.level_reported_at.is_(None), Battery.level_reported_at < reported_at),
+        )
+        .values(
+            battery_level=case(levels, value=Battery.serial),
+            level_reported_at=reported_at,
+        )
+    )
+
+
+class TelemetryBuffer:
+    """
+    計測値をバッテリーごとに最新の1件へまとめ、定期的に一括 UPDATE する
+
+    【使用例】
+    telemetry_buffer.add([("BT0000000001", 87, datetime.utcnow())])
+    telemetry_buffer.flush()   # テストやシャットダウン時に即時書き出す
+
+    stats() で受信数・まとめた件数・書き出した行数・発行した UPDATE 文の数を返す。
+    """
+
+    def __init__(self, flush_interval_ms, flush_max_rows, bind=engine):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self.bind = bind
+        self._pending = {}  # serial -> (ts, level)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._received = 0
+        self._coalesced = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._rows_flushed = 0
+        self._rows_updated = 0
+        self._statements = 0
+        self._flush_seconds_max = 0.0
+
+    def add(self, readings):
+        """(serial, level, ts) を溜める。同じバッテリーは計測時刻の新しいものだけ残す"""
+        with self._lock:
+            for serial, level, ts in readings:
+                self._received += 1
+                current = self._pending.get(serial)
+                if current is not None:
+                    self._coalesced += 1
+                    if ts < current[0]:
+                        continue
+                self._pending[serial] = (ts, level)
+            pending = len(self._pending)
+
+        self._ensure_thread()
+        if pending >= self.flush_max_rows:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # gunicorn の fork 後はスレッドが引き継がれないため、プロセスごとに起動する
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="telemetry-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """溜まっている計測値を書き出し、更新した行数を返す"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            # シリアル順に更新して、複数ワーカーが同時に書き出すときのロック順をそろえる
+            items = sorted(batch.items())
+            updated = 0
+            statements = 0
+            try:
+                with self.bind.begin() as conn:
+                    for start in range(0, len(items), UPDATE_CHUNK):
+                        result = conn.execute(build_level_update(items[start:start + UPDATE_CHUNK]))
+                        updated += result.rowcount
+                        statements += 1
+            except Exception as e:
+                logger.error(f"telemetry flush failed ({len(items)} batteries): {e}")
+                self._requeue(batch)
+                with self._lock:
+                    self._failed_flushes += 1
+                return 0
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._flushes += 1
+                self._rows_flushed += len(items)
+                self._rows_updated += updated
+                self._statements += statements
+                self._flush_seconds_max = max(self._flush_seconds_max, elapsed)
+            return updated
+
+    def _requeue(self, batch):
+        """書き出しに失敗した計測を戻す（その間に届いた新しい計測は優先）"""
+        with self._lock:
+            for serial, (ts, level) in batch.items():
+                current = self._pending.get(serial)
+                if current is None or current[0] < ts:
+                    self._pending[serial] = (ts, level)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "received": self._received,
+                "coalesced": self._coalesced,
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "rows_flushed": self._rows_flushed,
+                "rows_updated": self._rows_updated,
+                "statements": self._statements,
+                "flush_seconds_max": self._flush_seconds_max,
+            }
+
+
+telemetry_buffer = TelemetryBuffer(
+    flush_interval_ms=TELEMETRY_FLUSH_INTERVAL_MS,
+    flush_max_rows=TELEMETRY_FLUSH_MAX_ROWS,
+)
+
+# 通常終了時は未書き出しの計測を書き出してから終わる
+atexit.register(telemetry_buffer.flush)
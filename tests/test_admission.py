@@ -0,0 +1,135 @@
+"""
+アドミッション制御（admission.py）のテスト
+- 読み取りの枠が埋まっていたら、読み取りだけ 503 + Retry-After ですぐ断ること
+- ログインは IP ごと・ユーザーごとの回数制限を超えたら 429 + Retry-After を返すこと
+- トークンバケットが時間とともに補充されること
+- ログイン・登録のフォーム表示（GET）は auth の枠を使わないこと
+- TRUSTED_PROXY_HOPS を設定すると X-Forwarded-For の IP ごとに回数を数えること
+- 既定の read の枠はスレッド数と同じで、全スレッドが同時に読んでも断らないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from db import engine, get_session
+from models import Base, User
+from app import app, availability_cache, wrap_proxy_fix
+from auth import hash_password
+from admission import ConcurrencyLimiter, TokenBucketLimiter, build_limiters
+from variables import ADMISSION_LIMITS, GUNICORN_THREADS
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    s.add(User(email="admit@example.com", password_hash=hash_password("pass"), balance_cents=0))
+    s.commit()
+    s.close()
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        yield c
+    # 在庫一覧のキャッシュを次のテストに持ち越さない
+    availability_cache.bump()
+
+def test_read_storm_is_shed_but_writes_pass(client, monkeypatch):
+    limiters = build_limiters({"auth": (1, 0), "write": (1, 0), "read": (1, 0)})
+    monkeypatch.setattr("app.admission_limiters", limiters)
+    assert client.get("/api/stations").status_code == 200
+    # 枠は応答後に返されている
+    assert limiters["read"].stats()["in_flight"] == 0
+
+    # 読み取りの枠を他のリクエストが使っている状態
+    assert limiters["read"].try_acquire()
+    r = client.get("/api/stations")
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+    assert r.get_json() == {"msg": "server busy, retry later"}
+    assert client.get("/stations").status_code == 503
+
+    # 書き込み（貸出）は別の枠なので通る（トークンがないので 401）
+    assert client.post("/api/rent", json={"battery_id": 1}).status_code == 401
+    assert limiters["read"].stats()["rejected"] == 2
+    limiters["read"].release()
+    assert client.get("/api/stations").status_code == 200
+
+def test_login_rate_limits(client, monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr("admission.login_ip_limiter", TokenBucketLimiter(60, 3, clock=lambda: clock[0]))
+    monkeypatch.setattr("admission.login_user_limiter", TokenBucketLimiter(6, 2, clock=lambda: clock[0]))
+
+    def login(ip, email="admit@example.com"):
+        return client.post("/api/login", json={"email": email, "password": "pass"},
+                           environ_base={"REMOTE_ADDR": ip})
+
+    # 同じユーザーは IP を変えても2回まで。3回目は 10 秒後（6回/分）まで待たせる
+    assert login("10.0.0.1").status_code == 200
+    assert login("10.0.0.2").status_code == 200
+    r = login("10.0.0.3")
+    assert r.status_code == 429 and r.headers["Retry-After"] == "10"
+
+    # 同じ IP からは別のユーザーでも3回まで（10.0.0.3 は上で1回使っている）
+    assert login("10.0.0.3", "other1@example.com").status_code == 401
+    assert login("10.0.0.3", "other2@example.com").status_code == 401
+    r = login("10.0.0.3", "other3@example.com")
+    assert r.status_code == 429 and r.headers["Retry-After"] == "1"
+
+    r = client.post("/login", data={"email": "other4@example.com", "password": "x"},
+                    environ_base={"REMOTE_ADDR": "10.0.0.3"})
+    assert r.status_code == 429 and "Retry-After" in r.headers
+
+    clock[0] += 10
+    assert login("10.0.0.4").status_code == 200
+
+def test_login_form_does_not_use_auth_slot(client, monkeypatch):
+    limiters = build_limiters({"auth": (1, 0), "write": (1, 0), "read": (1, 0)})
+    monkeypatch.setattr("app.admission_limiters", limiters)
+    # ログイン処理が auth の枠を使っている状態
+    assert limiters["auth"].try_acquire()
+    assert client.get("/login").status_code == 200
+    assert client.get("/register").status_code == 200
+    r = client.post("/api/login", json={"email": "admit@example.com", "password": "pass"})
+    assert r.status_code == 503
+    assert limiters["auth"].stats()["rejected"] == 1
+    limiters["auth"].release()
+
+def test_login_rate_per_forwarded_ip(client, monkeypatch):
+    monkeypatch.setattr("admission.login_ip_limiter", TokenBucketLimiter(60, 1, clock=lambda: 0.0))
+    monkeypatch.setattr("admission.login_user_limiter", TokenBucketLimiter(60, 100, clock=lambda: 0.0))
+    monkeypatch.setattr(app, "wsgi_app", wrap_proxy_fix(app.wsgi_app, hops=1))
+
+    def login(forwarded_for):
+        # どの利用者もプロキシ（10.0.0.1）経由で届く
+        return client.post("/api/login", json={"email": "admit@example.com", "password": "pass"},
+                           environ_base={"REMOTE_ADDR": "10.0.0.1"},
+                           headers={"X-Forwarded-For": forwarded_for})
+
+    assert login("203.0.113.1").status_code == 200
+    assert login("203.0.113.2").status_code == 200
+    assert login("203.0.113.1").status_code == 429
+
+def test_limiter_primitives():
+    limiter = ConcurrencyLimiter("read", 1, 0)
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+    clock = [0.0]
+    bucket = TokenBucketLimiter(30, 2, max_keys=2, clock=lambda: clock[0])
+    assert bucket.take("a") == 0 and bucket.take("a") == 0
+    assert bucket.take("a") == pytest.approx(2.0)
+    clock[0] += 1
+    assert bucket.take("a") == pytest.approx(1.0)
+    clock[0] += 1
+    assert bucket.take("a") == 0
+    # 覚えておくキーは2件まで（古いものから忘れる）
+    bucket.take("b")
+    bucket.take("c")
+    assert set(bucket._buckets) == {"b", "c"}
+
+def test_default_read_slots_cover_all_threads():
+    assert ADMISSION_LIMITS["read"][0] >= GUNICORN_THREADS
+    limiter = build_limiters(ADMISSION_LIMITS)["read"]
+    assert all(limiter.try_acquire() for _ in range(GUNICORN_THREADS))
+    assert limiter.stats()["rejected"] == 0
+    for _ in range(GUNICORN_THREADS):
+        limiter.release()
@@ -0,0 +1,68 @@
+"""
+非同期 API（asgi_api.py）のテスト
+- Flask 版と同じトークンで認証でき、同じ JSON を返すこと（sub が数値でないトークンは 401）
+- 在庫一覧の ETag が一致すれば 304 を返すこと
+SQLite（aiosqlite）のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("httpx")
+
+from flask_jwt_extended import create_access_token
+from starlette.testclient import TestClient
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from app import app as flask_app
+from asgi_api import app as asgi_app
+from auth import hash_password
+
+@pytest.fixture(scope="module")
+def token():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="async@example.com", password_hash=hash_password("pass"), balance_cents=700)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=1)
+    s.add_all([u, st])
+    s.commit()
+    b = Battery(serial="ASYNC1", station_id=st.id, available=True)
+    s.add(b)
+    s.commit()
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    for i in range(5):
+        s.add(Rental(user_id=u.id, battery_id=b.id, status="returned",
+                     start_at=base + timedelta(minutes=i), end_at=base + timedelta(minutes=i + 1),
+                     price_cents=10))
+    s.commit()
+    uid = u.id
+    s.close()
+    with flask_app.app_context():
+        return create_access_token(identity=str(uid))
+
+def test_same_responses_as_flask(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    flask_client = flask_app.test_client()
+    with TestClient(asgi_app) as client:
+        for path in ("/api/user", "/api/history?limit=2", "/api/stations"):
+            r = client.get(path, headers=headers)
+            assert r.status_code == 200
+            assert r.json() == flask_client.get(path, headers=headers).get_json()
+
+        cursor = client.get("/api/history?limit=2", headers=headers).json()["next_cursor"]
+        page2 = client.get(f"/api/history?limit=2&cursor={cursor}", headers=headers).json()
+        assert [h["id"] for h in page2["history"]] == [3, 2]
+
+        assert client.get("/api/user").status_code == 401
+
+        # 署名は正しいが sub がユーザーIDでないトークンは 500 ではなく 401
+        with flask_app.app_context():
+            bad = {"Authorization": f"Bearer {create_access_token(identity='station-7')}"}
+        assert client.get("/api/user", headers=bad).status_code == 401
+        assert flask_client.get("/api/user", headers=bad).status_code == 401
+
+def test_stations_not_modified(token):
+    with TestClient(asgi_app) as client:
+        etag = client.get("/api/stations").headers["ETag"]
+        assert client.get("/api/stations", headers={"If-None-Match": etag}).status_code == 304
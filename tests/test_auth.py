@@ -0,0 +1,79 @@
+"""
+パスワードハッシュのテスト
+- 反復回数が設定と違うハッシュは、ログイン成功時に作り直されること
+- ハッシュ用プールが満杯なら HashingBusyError で即座に断ること
+- 待ち時間と断った件数が /metrics に出ること
+SQLite のまま動かす想定
+"""
+import threading
+import pytest
+from passlib.hash import pbkdf2_sha256
+from db import engine, get_session
+from models import Base, User
+from prometheus_client import REGISTRY
+from app import app
+from auth import HashingExecutor, HashingBusyError
+from variables import PBKDF2_ROUNDS
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    # 古い反復回数で保存されたハッシュ
+    old_hash = pbkdf2_sha256.using(rounds=1000).hash("pass")
+    s.add(User(email="old@example.com", password_hash=old_hash, balance_cents=0))
+    s.commit()
+    s.close()
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        yield c
+
+def test_login_rehashes_outdated_hash(client):
+    r = client.post("/api/login", json={"email": "old@example.com", "password": "pass"})
+    assert r.status_code == 200
+
+    s = get_session()
+    new_hash = s.query(User).filter_by(email="old@example.com").one().password_hash
+    s.close()
+    assert pbkdf2_sha256.from_string(new_hash).rounds == PBKDF2_ROUNDS
+    assert pbkdf2_sha256.verify("pass", new_hash)
+
+    # 作り直した後もログインできる
+    r = client.post("/api/login", json={"email": "old@example.com", "password": "pass"})
+    assert r.status_code == 200
+
+def hash_metrics():
+    return (
+        REGISTRY.get_sample_value("password_hash_queue_wait_seconds_count") or 0,
+        REGISTRY.get_sample_value("password_hash_rejected_total", {"reason": "queue_full"}) or 0,
+    )
+
+def test_executor_rejects_when_full():
+    waits_before, rejected_before = hash_metrics()
+    executor = HashingExecutor(max_workers=1, max_pending=0, wait_timeout=5, slow_queue_seconds=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+        return "done"
+
+    t = threading.Thread(target=executor.run, args=(block,))
+    t.start()
+    started.wait()
+    with pytest.raises(HashingBusyError):
+        executor.run(lambda: None)
+    release.set()
+    t.join()
+
+    assert executor.run(lambda: "ok") == "ok"
+    stats = executor.stats()
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
+    assert stats["in_flight"] == 0
+
+    waits_after, rejected_after = hash_metrics()
+    assert waits_after - waits_before == 2
+    assert rejected_after - rejected_before == 1
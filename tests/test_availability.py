@@ -0,0 +1,117 @@
+"""
+スタンド在庫の集計（availability.py）のテスト
+- batteries からの実集計は1回の GROUP BY で全スタンド分を返すこと
+  （バッテリーのないスタンドは 0、貸出中のバッテリーは数えない）
+- 在庫一覧 API に実集計と同じ在庫数が出ること
+- 在庫カウンタは貸出で -1、返却で返却先スタンドに +1 され、実集計とずれないこと
+- ずれたカウンタは reconcile_available_counts で検出・修復できること
+SQLite のまま動かす想定
+"""
+import pytest
+from sqlalchemy import event, update
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from app import app, availability_cache
+from availability import actual_availability_query, reconcile_available_counts
+
+@pytest.fixture(scope="module")
+def station_ids():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    s.add(User(email="avail@example.com", password_hash="x", balance_cents=5000))
+    stations = [Station(name=f"AV{i}", lat=0.0, lng=0.0, available_count=n) for i, n in enumerate((2, 0, 1))]
+    s.add_all(stations)
+    s.commit()
+    a, empty, c = stations
+    s.add_all([
+        Battery(serial="AV-A1", station_id=a.id, available=True),
+        Battery(serial="AV-A2", station_id=a.id, available=True),
+        Battery(serial="AV-A3", station_id=a.id, available=False),
+        Battery(serial="AV-C1", station_id=c.id, available=True),
+        Battery(serial="AV-X1", station_id=None, available=True),
+    ])
+    s.commit()
+    ids = [st.id for st in stations]
+    s.close()
+    # 他のテストで作られた在庫一覧のキャッシュを捨てる
+    availability_cache.bump()
+    return ids
+
+def count_statements(fn):
+    """fn() の戻り値と、その間に発行された SQL の件数"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+def test_grouped_count_in_one_query(station_ids):
+    s = get_session()
+    try:
+        rows, count = count_statements(lambda: s.execute(actual_availability_query()).all())
+    finally:
+        s.close()
+    assert count == 1
+    assert [(row.id, row.actual_count) for row in rows] == list(zip(station_ids, (2, 0, 1)))
+
+def test_station_list_shows_counts(station_ids):
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        r = c.get("/api/stations")
+    assert r.status_code == 200
+    assert [(st["name"], st["available"]) for st in r.get_json()] == [("AV0", 2), ("AV1", 0), ("AV2", 1)]
+
+def counters(station_ids):
+    s = get_session()
+    try:
+        return [s.get(Station, station_id).available_count for station_id in station_ids]
+    finally:
+        s.close()
+
+def test_counter_follows_rent_and_return(station_ids):
+    s = get_session()
+    user_id = s.query(User).filter_by(email="avail@example.com").one().id
+    battery_id = s.query(Battery).filter_by(serial="AV-A1").one().id
+    s.close()
+    app.config['TESTING'] = True
+
+    with app.test_client() as c:
+        with c.session_transaction() as flask_session:
+            flask_session["user_id"] = user_id
+        assert c.post(f"/rent/{battery_id}").status_code == 302
+        assert counters(station_ids) == [1, 0, 1]
+
+        s = get_session()
+        rental_id = s.query(Rental).filter_by(user_id=user_id, status="ongoing").one().id
+        s.close()
+        # 在庫のなかったスタンドへ返却
+        r = c.post(f"/return/{rental_id}", data={"return_station_id": station_ids[1]})
+        assert r.status_code == 302
+    assert counters(station_ids) == [1, 1, 1]
+
+    s = get_session()
+    try:
+        assert reconcile_available_counts(s) == []
+    finally:
+        s.close()
+
+def test_reconcile_repairs_drift(station_ids):
+    with engine.begin() as conn:
+        conn.execute(update(Station).where(Station.id == station_ids[2]).values(available_count=9))
+
+    s = get_session()
+    try:
+        assert reconcile_available_counts(s) == [(station_ids[2], 9, 1)]
+        assert reconcile_available_counts(s, fix=True) == [(station_ids[2], 9, 1)]
+        s.commit()
+        assert reconcile_available_counts(s) == []
+    finally:
+        s.close()
+    assert counters(station_ids)[2] == 1
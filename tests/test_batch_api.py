@@ -0,0 +1,134 @@
+"""
+一括処理 API（/api/batch）のテスト
+- 返却・貸出・チャージを1リクエストで処理し、1件ごとの結果を返すこと
+- 失敗した操作だけが取り消され、同じチャンクの他の操作は確定すること
+- 整数でない ID はその1件だけ 400 になり、チャンクの他の操作は確定すること
+- 存在しない返却先スタンドはその1件だけ失敗し、在庫カウンタもずれないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from app import app
+from auth import hash_password
+from ledger import audit_balances
+from availability import reconcile_available_counts
+
+@pytest.fixture(scope="module")
+def setup():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="batch@example.com", password_hash=hash_password("pass"), balance_cents=0)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=2)
+    s.add_all([u, st])
+    s.commit()
+    batteries = [Battery(serial=f"BATCH{i}", station_id=st.id, available=(i < 2)) for i in range(3)]
+    s.add_all(batteries)
+    s.commit()
+    r = Rental(user_id=u.id, battery_id=batteries[2].id, status="ongoing",
+               start_at=datetime.utcnow() - timedelta(minutes=5))
+    s.add(r)
+    s.commit()
+    ids = (u.id, st.id, [b.id for b in batteries], r.id)
+    s.close()
+    app.config['TESTING'] = True
+    with app.app_context():
+        token = create_access_token(identity=str(ids[0]))
+    return ids, token
+
+def test_batch_per_item_results(setup):
+    (user_id, station_id, battery_ids, rental_id), token = setup
+    client = app.test_client()
+    operations = [
+        {"op": "rent", "battery_id": battery_ids[0]},        # 残高 0 なので失敗
+        {"op": "charge", "amount": 5000},
+        {"op": "return", "rental_id": rental_id},
+        {"op": "return", "rental_id": rental_id},            # 二重返却は失敗
+        {"op": "rent", "battery_id": battery_ids[0]},
+        {"op": "rent", "battery_id": battery_ids[0]},        # 貸出済み
+        {"op": "swap"},
+    ]
+    r = client.post("/api/batch", json={"operations": operations, "chunk_size": 4},
+                    headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 200
+    results = r.get_json()["results"]
+    assert [x["ok"] for x in results] == [False, True, True, False, True, False, False]
+    assert [x["status"] for x in results] == [400, 200, 200, 400, 200, 400, 400]
+    assert results[0]["msg"] == "insufficient balance"
+    assert results[3]["msg"] == "invalid rental"
+    assert results[5]["msg"] == "battery not available"
+    assert results[6]["msg"] == "unknown op"
+    assert results[2]["balance"] == 5000 - results[2]["price"]
+
+    s = get_session()
+    try:
+        assert s.get(Rental, rental_id).status == "returned"
+        assert s.query(Rental).filter_by(user_id=user_id, status="ongoing").count() == 1
+        # 返却で +1、貸出で -1
+        assert s.get(Station, station_id).available_count == 2
+        assert audit_balances(s) == []
+    finally:
+        s.close()
+
+def test_batch_rejects_too_many(setup):
+    _, token = setup
+    client = app.test_client()
+    r = client.post("/api/batch", json={"operations": [{"op": "charge", "amount": 1}] * 10000},
+                    headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 400
+
+def test_batch_rejects_non_integer_ids(setup):
+    (user_id, station_id, battery_ids, rental_id), token = setup
+    client = app.test_client()
+    s = get_session()
+    balance_before = s.get(User, user_id).balance_cents
+    s.close()
+    operations = [
+        {"op": "rent", "battery_id": "abc"},
+        {"op": "return", "rental_id": 1.5},
+        {"op": "return", "rental_id": rental_id, "return_station_id": "x"},
+        {"op": "rent", "battery_id": True},
+        {"op": "charge", "amount": 100},
+    ]
+    r = client.post("/api/batch", json={"operations": operations, "chunk_size": 10},
+                    headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 200
+    results = r.get_json()["results"]
+    assert [x["status"] for x in results] == [400, 400, 400, 400, 200]
+    assert [x.get("msg") for x in results[:4]] == [
+        "invalid battery_id", "invalid rental_id", "invalid return_station_id", "invalid battery_id"
+    ]
+    assert results[4]["balance"] == balance_before + 100
+
+def test_batch_rejects_unknown_return_station(setup):
+    (user_id, station_id, battery_ids, _), token = setup
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    r = client.post("/api/batch", json={"operations": [{"op": "rent", "battery_id": battery_ids[1]}]},
+                    headers=headers)
+    rental_id = r.get_json()["results"][0]["rental_id"]
+
+    operations = [
+        {"op": "charge", "amount": 100},
+        {"op": "return", "rental_id": rental_id, "return_station_id": 999},
+        {"op": "charge", "amount": 200},
+    ]
+    r = client.post("/api/batch", json={"operations": operations, "chunk_size": 10}, headers=headers)
+    assert r.status_code == 200
+    results = r.get_json()["results"]
+    assert [x["ok"] for x in results] == [True, False, True]
+    assert results[1] == {"index": 1, "op": "return", "ok": False, "status": 400,
+                          "msg": "invalid return station"}
+
+    s = get_session()
+    try:
+        assert s.get(Rental, rental_id).status == "ongoing"
+        assert s.get(Rental, rental_id).return_station_id is None
+        assert s.get(Battery, battery_ids[1]).station_id == station_id
+        assert reconcile_available_counts(s) == []
+        assert audit_balances(s) == []
+    finally:
+        s.close()
@@ -0,0 +1,85 @@
+"""
+同時貸出のテスト
+- 1台のバッテリーに数百件の貸出リクエストを同時に送っても、成功は1件だけ
+- 在庫カウンタも 1 だけ減ること
+- 整数でない ID は SQL を発行せずに 400 を返すこと
+SQLite のまま動かす想定
+"""
+import re
+import threading
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from app import app
+from auth import hash_password
+
+N_CLIENTS = 200
+
+@pytest.fixture(scope="module")
+def tokens():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    password_hash = hash_password("pass")
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"email": f"c{i}@example.com", "password_hash": password_hash, "balance_cents": 5000}
+            for i in range(N_CLIENTS)
+        ])
+    s = get_session()
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=1)
+    s.add(st)
+    s.commit()
+    s.add(Battery(serial="RACE1", station_id=st.id, available=True))
+    s.commit()
+    user_ids = [u.id for u in s.query(User).order_by(User.id)]
+    s.close()
+    app.config['TESTING'] = True
+    with app.app_context():
+        return [create_access_token(identity=str(uid)) for uid in user_ids]
+
+def test_concurrent_rent_succeeds_once(tokens):
+    barrier = threading.Barrier(len(tokens))
+    results = []
+    lock = threading.Lock()
+
+    def rent(token):
+        client = app.test_client()
+        barrier.wait()
+        r = client.post("/api/rent", json={"battery_id": 1},
+                        headers={"Authorization": f"Bearer {token}"})
+        with lock:
+            results.append((r.status_code, (r.get_json() or {}).get("msg")))
+
+    threads = [threading.Thread(target=rent, args=(t,)) for t in tokens]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == N_CLIENTS
+    assert sum(1 for code, _ in results if code == 200) == 1
+    assert all(msg == "battery not available" for code, msg in results if code != 200)
+
+    s = get_session()
+    assert s.query(Rental).count() == 1
+    assert s.query(Station).one().available_count == 0
+    assert s.query(Battery).one().available is False
+    s.close()
+
+def test_non_integer_ids_are_rejected_before_sql(tokens):
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {tokens[0]}"}
+    cases = [
+        ("/api/rent", {"battery_id": {"x": 1}}, "invalid battery_id"),
+        ("/api/rent", {"battery_id": "1; drop"}, "invalid battery_id"),
+        ("/api/rent", {}, "battery_id required"),
+        ("/api/return", {"rental_id": [1]}, "invalid rental_id"),
+        ("/api/return", {"rental_id": "abc"}, "invalid rental_id"),
+    ]
+    for path, body, msg in cases:
+        r = client.post(path, json=body, headers=headers)
+        assert r.status_code == 400, body
+        assert r.get_json()["msg"] == msg
+        assert re.search(r'desc="0 queries"', r.headers["Server-Timing"]), body
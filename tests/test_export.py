@@ -0,0 +1,76 @@
+"""
+貸出エクスポート（admin.py export_rentals）のテスト
+- スタンドはバッテリーの現在の置き場所ではなく、貸出時・返却先のスタンドであること
+- CSV と NDJSON で同じ行が出ること
+- --since / --until のオフセットつき日時は UTC に直して絞り込むこと
+SQLite のまま動かす想定
+"""
+import csv
+import json
+import pytest
+from datetime import datetime
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from admin import export_rentals, EXPORT_COLUMNS, parse_args
+
+@pytest.fixture(scope="module")
+def rental_ids():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="export@example.com", password_hash="x", balance_cents=0)
+    stations = [Station(name=name, lat=0.0, lng=0.0, available_count=0) for name in ("A", "B", "C")]
+    s.add(u)
+    s.add_all(stations)
+    s.commit()
+    a, b, c = stations
+    # A で借りて B に返却され、その後 C に移されたバッテリー
+    battery = Battery(serial="EXP1", station_id=c.id, available=True)
+    s.add(battery)
+    s.commit()
+    returned = Rental(user_id=u.id, battery_id=battery.id, station_id=a.id, return_station_id=b.id,
+                      status="returned", start_at=datetime(2025, 1, 1, 9), end_at=datetime(2025, 1, 1, 10),
+                      price_cents=300)
+    # スタンドが記録される前の貸出
+    legacy = Rental(user_id=u.id, battery_id=battery.id, status="returned",
+                    start_at=datetime(2024, 1, 1, 9), end_at=datetime(2024, 1, 1, 10), price_cents=100)
+    s.add_all([returned, legacy])
+    s.commit()
+    ids = {"returned": returned.id, "legacy": legacy.id, "a": a.id, "b": b.id}
+    s.close()
+    return ids
+
+def test_csv_uses_rental_and_return_station(rental_ids, tmp_path):
+    path = tmp_path / "rentals.csv"
+    assert export_rentals("csv", output=str(path)) == 2
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = {int(row["rental_id"]): row for row in csv.DictReader(f)}
+    assert list(rows[rental_ids["returned"]]) == EXPORT_COLUMNS
+
+    row = rows[rental_ids["returned"]]
+    assert (row["station_id"], row["station_name"]) == (str(rental_ids["a"]), "A")
+    assert (row["return_station_id"], row["return_station_name"]) == (str(rental_ids["b"]), "B")
+
+    row = rows[rental_ids["legacy"]]
+    assert row["station_id"] == row["return_station_id"] == ""
+
+def test_ndjson_matches(rental_ids, tmp_path):
+    path = tmp_path / "rentals.ndjson"
+    export_rentals("ndjson", output=str(path), statuses=["returned"])
+    with open(path, encoding="utf-8") as f:
+        rows = {row["rental_id"]: row for row in map(json.loads, f)}
+    row = rows[rental_ids["returned"]]
+    assert row["station_name"] == "A" and row["return_station_name"] == "B"
+    assert row["start_at"] == "2025-01-01T09:00:00"
+    assert rows[rental_ids["legacy"]]["station_id"] is None
+
+def test_since_with_offset_is_utc(rental_ids, tmp_path):
+    # 2025-01-01 18:00+09:00 = 09:00 UTC（当日 09:00 UTC に始まった貸出を含む）
+    args = parse_args(["export_rentals", "--since", "2025-01-01T18:00+09:00",
+                       "--until", "2025-01-01T19:00:01+09:00"])
+    assert args.since == datetime(2025, 1, 1, 9) and args.since.tzinfo is None
+
+    path = tmp_path / "rentals.csv"
+    assert export_rentals("csv", output=str(path), since=args.since, until=args.until) == 1
+    # 呼び出し元から aware な datetime を渡しても同じ
+    assert export_rentals("csv", output=str(path), since=datetime.fromisoformat("2025-01-01T18:00+09:00")) == 1
@@ -0,0 +1,55 @@
+"""
+利用履歴のキーセットページングのテスト
+- 同じ start_at の行があっても、全ページを通して重複・欠落がないこと
+- 不正なカーソルは ValueError になること（API では 400 を返す）
+SQLite のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from app import app, get_user_rentals_with_details, decode_history_cursor
+from auth import hash_password
+
+@pytest.fixture(scope="module")
+def user_id():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="hist@example.com", password_hash=hash_password("pass"), balance_cents=0)
+    st = Station(name="S", lat=0.0, lng=0.0)
+    s.add_all([u, st])
+    s.commit()
+    b = Battery(serial="HIST1", station_id=st.id, available=True)
+    s.add(b)
+    s.commit()
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    # 3件ずつ同じ開始時刻にして、ページ境界で同時刻が割れるようにする
+    for i in range(25):
+        s.add(Rental(user_id=u.id, battery_id=b.id, status="returned",
+                     start_at=base + timedelta(minutes=i // 3), price_cents=10))
+    s.commit()
+    uid = u.id
+    s.close()
+    return uid
+
+def test_pages_cover_all_rentals_in_order(user_id):
+    seen = []
+    after_id = None
+    pages = 0
+    while True:
+        # ヘルパーはリクエスト単位のセッション（g）を使うのでアプリコンテキスト内で呼ぶ
+        with app.app_context():
+            rows, after_id = get_user_rentals_with_details(user_id, 4, after_id)
+        pages += 1
+        seen.extend((rental.start_at, rental.id) for rental, _, _ in rows)
+        if after_id is None:
+            break
+    assert pages == 7
+    assert len(seen) == 25
+    assert len({rid for _, rid in seen}) == 25
+    assert seen == sorted(seen, reverse=True)
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        decode_history_cursor("!!not-a-cursor!!")
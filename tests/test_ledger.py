@@ -0,0 +1,95 @@
+"""
+残高と台帳のテスト
+- 同じ貸出を同時に返却しても、請求は1回だけ
+- 同時チャージでも加算が失われず、台帳の合計と残高が一致すること
+SQLite のまま動かす想定
+"""
+import threading
+import pytest
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental, ChargeHistory
+from app import app
+from auth import hash_password
+from ledger import audit_balances
+
+N_CLIENTS = 20
+
+@pytest.fixture(scope="module")
+def setup():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="ledger@example.com", password_hash=hash_password("pass"), balance_cents=1000)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=0)
+    s.add_all([u, st])
+    s.commit()
+    s.add(ChargeHistory(user_id=u.id, amount_cents=1000, kind="initial"))
+    b = Battery(serial="LEDGER1", station_id=st.id, available=False)
+    s.add(b)
+    s.commit()
+    r = Rental(user_id=u.id, battery_id=b.id, status="ongoing",
+               start_at=datetime.utcnow() - timedelta(minutes=5))
+    s.add(r)
+    s.commit()
+    ids = (u.id, r.id)
+    s.close()
+    app.config['TESTING'] = True
+    with app.app_context():
+        token = create_access_token(identity=str(ids[0]))
+    return ids, token
+
+def _run_concurrently(fn, n):
+    barrier = threading.Barrier(n)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        barrier.wait()
+        r = fn(client)
+        with lock:
+            results.append((r.status_code, r.get_json() or {}))
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_concurrent_return_charges_once(setup):
+    (user_id, rental_id), token = setup
+    headers = {"Authorization": f"Bearer {token}"}
+    results = _run_concurrently(
+        lambda c: c.post("/api/return", json={"rental_id": rental_id}, headers=headers),
+        N_CLIENTS
+    )
+    ok = [body for code, body in results if code == 200]
+    assert len(ok) == 1
+    assert all(body.get("msg") == "invalid rental" for code, body in results if code != 200)
+
+    s = get_session()
+    assert s.get(User, user_id).balance_cents == 1000 - ok[0]["price"]
+    assert s.query(ChargeHistory).filter_by(kind="rental").count() == 1
+    assert s.query(Station).one().available_count == 1
+    s.close()
+
+def test_concurrent_charges_are_not_lost(setup):
+    (user_id, _), token = setup
+    headers = {"Authorization": f"Bearer {token}"}
+    s = get_session()
+    before = s.get(User, user_id).balance_cents
+    s.close()
+
+    results = _run_concurrently(
+        lambda c: c.post("/api/charge", json={"amount": 100}, headers=headers),
+        N_CLIENTS
+    )
+    assert all(code == 200 for code, _ in results)
+
+    s = get_session()
+    assert s.get(User, user_id).balance_cents == before + 100 * N_CLIENTS
+    assert audit_balances(s) == []
+    s.close()
@@ -0,0 +1,71 @@
+"""
+負荷試験（benchmarks/load_test.py）の集計のテスト
+- 計測区間の外のリクエストは数えないこと
+- 2xx 以外と接続エラーをエラーとして数え、パーセンタイルとスループットを出すこと
+- クライアントごとのバッテリーが重ならず、全台を使うこと
+- 比較表が片方にしかないエンドポイントでも落ちないこと
+サーバーは起動せずに動かす想定
+"""
+from benchmarks.load_test import (
+    Recorder, Client, summarize, percentile, battery_pool, free_port, print_comparison
+)
+
+def test_percentile():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.051
+    assert percentile(values, 99) == 0.1
+    assert percentile([0.5], 95) == 0.5
+
+def test_summarize_counts_only_recorded_window():
+    recorder = Recorder()
+    recorder.add("GET /api/stations", 9.0, 200)  # 助走中（数えない）
+    recorder.recording = True
+    for ms in range(1, 11):
+        recorder.add("GET /api/stations", ms / 1000, 200)
+    recorder.add("POST /api/rent", 0.002, 400)
+    recorder.add("POST /api/rent", 0.004, "error")
+    recorder.add("POST /api/rent", 0.003, 200)
+    recorder.recording = False
+    recorder.add("POST /api/rent", 9.0, 200)
+
+    endpoints, total = summarize(recorder, duration=2)
+    stations = endpoints["GET /api/stations"]
+    assert stations["requests"] == 10
+    assert stations["errors"] == 0
+    assert stations["throughput_rps"] == 5.0
+    assert (stations["p50_ms"], stations["max_ms"]) == (6.0, 10.0)
+
+    rent = endpoints["POST /api/rent"]
+    assert rent["errors"] == 2
+    assert rent["status"] == {"400": 1, "error": 1, "200": 1}
+    assert total == {"requests": 13, "throughput_rps": 6.5}
+
+def test_connection_error_is_recorded():
+    recorder = Recorder()
+    recorder.recording = True
+    client = Client("127.0.0.1", free_port(), recorder)
+    assert client.call("GET", "/api/history?limit=20") == ("error", {})
+    assert recorder.statuses == {"GET /api/history": {"error": 1}}
+
+def test_battery_pools_are_disjoint():
+    pools = [battery_pool(i, 100, 8) for i in range(8)]
+    flat = [battery_id for pool in pools for battery_id in pool]
+    assert sorted(flat) == list(range(1, 101))
+    # バッテリーよりクライアントが多くても空にはしない
+    assert battery_pool(5, 3, 8) == [1]
+
+def test_compare_handles_new_endpoints(capsys):
+    def result(rev, endpoints, rps):
+        return {"meta": {"git_revision": rev}, "endpoints": endpoints, "total": {"throughput_rps": rps}}
+
+    stats = {"throughput_rps": 100.0, "p50_ms": 2.0, "p95_ms": 4.0, "p99_ms": 8.0}
+    base = result("aaa", {"GET /api/stations": stats}, 100.0)
+    current = result("bbb", {
+        "GET /api/stations": dict(stats, throughput_rps=150.0, p50_ms=1.0),
+        "POST /api/rent": stats,
+    }, 150.0)
+    print_comparison(base, current)
+    out = capsys.readouterr().out
+    assert "aaa -> bbb" in out
+    assert "+50.0%" in out and "-50.0%" in out
+    assert "(only in current)" in out
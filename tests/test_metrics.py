@@ -0,0 +1,59 @@
+"""
+/metrics のテスト
+- 貸出できなかった理由ごとにカウンタが増えること
+- 貸出中件数・利用可能バッテリー数が DB の値と一致すること
+- リクエストが終われば貸し出し中の DB 接続数が 0 に戻ること
+SQLite のまま動かす想定
+"""
+import re
+import pytest
+from flask_jwt_extended import create_access_token
+from db import engine, get_session
+from models import Base, User, Station, Battery
+from prometheus_client import REGISTRY
+from app import app
+from auth import hash_password
+
+def metric_value(text, name):
+    match = re.search(rf"^{re.escape(name)} ([0-9.e+-]+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="m@example.com", password_hash=hash_password("pass"), balance_cents=5000)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=1)
+    s.add_all([u, st])
+    s.commit()
+    s.add(Battery(serial="MET1", station_id=st.id, available=True))
+    s.commit()
+    uid = u.id
+    s.close()
+    app.config['TESTING'] = True
+    with app.app_context():
+        token = create_access_token(identity=str(uid))
+    with app.test_client() as c:
+        c.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        yield c
+
+def test_rent_outcomes_and_inventory_gauges(client):
+    label = 'battery_operations_total{operation="rent",outcome="%s"}'
+    before = client.get("/metrics").get_data(as_text=True)
+
+    assert client.post("/api/rent", json={"battery_id": 1}).status_code == 200
+    assert client.post("/api/rent", json={"battery_id": 1}).status_code == 400
+
+    after = client.get("/metrics").get_data(as_text=True)
+    assert metric_value(after, label % "success") - metric_value(before, label % "success") == 1
+    assert (metric_value(after, label % "battery_not_available")
+            - metric_value(before, label % "battery_not_available")) == 1
+    assert metric_value(after, "rentals_ongoing") == 1
+    assert metric_value(after, "batteries_available") == 0
+
+def test_pool_gauges_return_to_zero_after_request(client):
+    assert client.get("/api/stations").status_code == 200
+    assert engine.pool.checkedout() == 0
+    assert REGISTRY.get_sample_value("db_pool_checked_out_connections") == 0
+    assert REGISTRY.get_sample_value("db_pool_overflow_connections") == 0
@@ -0,0 +1,75 @@
+"""
+マイグレーション（migrations.py）のテスト
+- 旧スキーマの DB に未適用の番号だけを順に当て、schema_migrations に記録すること
+- 2回目は何もしないこと、--to の番号で止まること
+- 追加したインデックスを貸出中の検索・在庫の集計が使うこと
+SQLite のまま動かす想定
+"""
+import pytest
+from sqlalchemy import inspect, text
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from migrations import MIGRATIONS, upgrade, migration_status
+
+NEW_INDEXES = (
+    "ix_rentals_start_at", "ix_rentals_user_id_start_at_id",
+    "ix_batteries_station_id_available", "ix_rentals_ongoing_start_at",
+)
+
+@pytest.fixture
+def old_schema():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE schema_migrations"))
+        for name in NEW_INDEXES:
+            conn.execute(text(f"DROP INDEX {name}"))
+    # 返却済みが大半で、貸出中はわずか（本番と同じ偏り）
+    s = get_session()
+    u = User(email="migrate@example.com", password_hash="x", balance_cents=0)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=0)
+    s.add_all([u, st])
+    s.commit()
+    b = Battery(serial="MIGRATE1", station_id=st.id, available=False)
+    s.add(b)
+    s.commit()
+    base = datetime(2025, 1, 1)
+    s.add_all([
+        Rental(user_id=u.id, battery_id=b.id, status="returned" if i else "ongoing",
+               start_at=base + timedelta(minutes=i), end_at=base + timedelta(minutes=i + 1) if i else None)
+        for i in range(300)
+    ])
+    s.commit()
+    s.close()
+
+def _index_names():
+    inspector = inspect(engine)
+    return {i["name"] for table in ("rentals", "batteries") for i in inspector.get_indexes(table)}
+
+def test_upgrade_applies_pending_in_order(old_schema):
+    assert not set(NEW_INDEXES) & _index_names()
+    assert upgrade(engine, target=2, log=lambda line: None) == [1, 2]
+    assert "ix_rentals_start_at" in _index_names()
+    assert "ix_batteries_station_id_available" not in _index_names()
+
+    rest = upgrade(engine, log=lambda line: None)
+    assert rest == [m.version for m in MIGRATIONS if m.version > 2]
+    assert set(NEW_INDEXES) <= _index_names()
+    assert all(applied for _, _, applied in migration_status(engine))
+    assert upgrade(engine, log=lambda line: None) == []
+
+def test_queries_use_new_indexes(old_schema):
+    upgrade(engine, log=lambda line: None)
+    # SQLite の接続は統計を接続時に読むので、プールの接続を作り直す（本番ではワーカーの再起動）
+    engine.dispose()
+    with engine.connect() as conn:
+        def plan(sql):
+            return " ".join(row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+        assert "ix_rentals_ongoing_start_at" in plan(
+            "SELECT id FROM rentals WHERE status = 'ongoing' AND start_at < '2025-01-01' "
+            "ORDER BY start_at, id LIMIT 100"
+        )
+        assert "ix_batteries_station_id_available" in plan(
+            "SELECT count(*) FROM batteries WHERE station_id = 1 AND available = 1"
+        )
@@ -0,0 +1,90 @@
+"""
+/api/stations/nearby のテスト
+- 近い順に、半径・件数・在庫数の条件で絞って返すこと
+- NaN・無限大や不正な値は 500 にならず 400 を返すこと
+- 貸出・返却の在庫数の変化は、全スタンドを読み直さずに差分で反映されること
+- 一括処理で失敗した操作は反映されないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from flask_jwt_extended import create_access_token
+from db import engine, get_session
+from models import Base, User, Station, Battery
+from app import app, availability_cache, station_index
+from auth import hash_password
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="near@example.com", password_hash=hash_password("pass"), balance_cents=5000)
+    # 東京駅から約 0m / 約 1.1km / 約 11km
+    near = Station(name="Near", lat=35.6812, lng=139.7671, available_count=1)
+    mid = Station(name="Mid", lat=35.6912, lng=139.7671, available_count=0)
+    far = Station(name="Far", lat=35.7812, lng=139.7671, available_count=1)
+    s.add_all([u, near, mid, far])
+    s.commit()
+    s.add_all([Battery(serial="NEAR1", station_id=near.id, available=True),
+               Battery(serial="FAR1", station_id=far.id, available=True)])
+    s.commit()
+    uid = u.id
+    s.close()
+    availability_cache.bump()
+    station_index.synced_at = None
+    app.config['TESTING'] = True
+    with app.app_context():
+        token = create_access_token(identity=str(uid))
+    with app.test_client() as c:
+        c.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        yield c
+    availability_cache.bump()
+
+def nearby(client, **params):
+    query = {"lat": 35.6812, "lng": 139.7671, **params}
+    r = client.get("/api/stations/nearby", query_string=query)
+    assert r.status_code == 200
+    return [(s["name"], s["available"]) for s in r.get_json()]
+
+def test_nearby_filters_and_orders(client):
+    assert nearby(client) == [("Near", 1), ("Mid", 0)]
+    assert nearby(client, radius=20000) == [("Near", 1), ("Mid", 0), ("Far", 1)]
+    assert nearby(client, radius=20000, limit=1) == [("Near", 1)]
+    assert nearby(client, radius=20000, min_available=1) == [("Near", 1), ("Far", 1)]
+    assert client.get("/api/stations/nearby?lat=x").status_code == 400
+
+def test_nearby_rejects_non_finite_and_bad_params(client):
+    base = "/api/stations/nearby?lat=35.6812&lng=139.7671"
+    for query in ("&radius=nan", "&radius=inf", "&radius=-1", "&limit=0"):
+        r = client.get(base + query)
+        assert r.status_code == 400, query
+        assert r.get_json()["msg"] == "invalid parameters"
+    for query in ("?lat=nan&lng=139", "?lat=35&lng=inf"):
+        assert client.get("/api/stations/nearby" + query).status_code == 400, query
+    r = client.get(base + "&min_available=x")
+    assert r.status_code == 400
+    assert r.get_json()["msg"] == "invalid min_available"
+
+def test_rent_and_return_update_index_without_reload(client, monkeypatch):
+    nearby(client)
+    synced_at = station_index.synced_at
+
+    def reload_not_expected():
+        raise AssertionError("nearby reloaded all stations")
+    monkeypatch.setattr("app.load_station_availability", reload_not_expected)
+
+    r = client.post("/api/rent", json={"battery_id": 1})
+    assert r.status_code == 200
+    assert nearby(client) == [("Near", 0), ("Mid", 0)]
+    assert nearby(client, min_available=1) == []
+
+    assert client.post("/api/return", json={"rental_id": r.get_json()["rental_id"]}).status_code == 200
+    assert nearby(client) == [("Near", 1), ("Mid", 0)]
+
+    # 一括処理で失敗した貸出（同じバッテリーの2回目）は数えない
+    r = client.post("/api/batch", json={"operations": [
+        {"op": "rent", "battery_id": 2}, {"op": "rent", "battery_id": 2},
+    ]})
+    assert [item["ok"] for item in r.get_json()["results"]] == [True, False]
+    assert nearby(client, radius=20000) == [("Near", 1), ("Mid", 0), ("Far", 0)]
+    assert station_index.synced_at == synced_at
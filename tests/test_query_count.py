@@ -0,0 +1,49 @@
+"""
+SQL 発行回数のテスト（Server-Timing ヘッダで確認）
+- ホーム画面の SQL 件数がスタンド数に比例しないこと（N+1 の再発防止）
+- 在庫一覧 API はキャッシュが有効な間 SQL を発行しないこと
+SQLite のまま動かす想定
+"""
+import re
+import pytest
+from sqlalchemy import insert
+from db import engine, get_session
+from models import Base, User, Station
+from app import app, availability_cache
+from auth import hash_password
+
+def query_count(response):
+    match = re.search(r'desc="(\d+) queries"', response.headers.get("Server-Timing", ""))
+    assert match, response.headers
+    return int(match.group(1))
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    s.add(User(email="qc@example.com", password_hash=hash_password("pass"), balance_cents=1000))
+    s.add(Station(name="S0", lat=0.0, lng=0.0))
+    s.commit()
+    s.close()
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        c.post("/login", data={"email": "qc@example.com", "password": "pass"})
+        yield c
+
+def test_home_query_count_does_not_grow_with_stations(client):
+    availability_cache.bump()
+    few = query_count(client.get("/home"))
+
+    with engine.begin() as conn:
+        conn.execute(insert(Station), [
+            {"name": f"S{i}", "lat": 0.0, "lng": 0.0} for i in range(1, 51)
+        ])
+    availability_cache.bump()
+    many = query_count(client.get("/home"))
+
+    assert many == few
+
+def test_cached_station_list_issues_no_queries(client):
+    client.get("/api/stations")
+    assert query_count(client.get("/api/stations")) == 0
@@ -0,0 +1,139 @@
+"""
+再配置計画（rebalance.py）のテスト
+- 余っているスタンドから近い順に不足分を運び、遠すぎるスタンドには運ばないこと
+- 過去の貸出の時刻別の貸出・返却から目標在庫が決まること
+- 貪欲な割り当てが、候補を広げても台数の合計を守ること
+- 貪欲な割り当ては最小費用とは限らないこと（小さな例で総当たりの最適解と比べる）
+SQLite のまま動かす想定
+"""
+import itertools
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from rebalance import plan_rebalance, plan_moves, station_targets
+
+NOW = datetime(2025, 1, 29, 8, 0, 0)
+
+@pytest.fixture(scope="module")
+def stations():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    # A に5台。B は約1.1km、C は約2.2km、D は約110km 離れている
+    st = {name: Station(name=name, lat=lat, lng=0.0, available_count=0)
+          for name, lat in (("A", 35.0), ("B", 35.01), ("C", 35.02), ("D", 36.0))}
+    s.add_all(st.values())
+    s.commit()
+    for i in range(5):
+        s.add(Battery(serial=f"REBAL{i}", station_id=st["A"].id, available=True))
+    s.commit()
+    result = {name: station.id for name, station in st.items()}
+    s.close()
+    return result
+
+def test_moves_go_to_nearest_within_range(stations):
+    plan = plan_rebalance(engine, now=NOW, horizon_hours=6, history_days=28,
+                          max_distance_m=10000, min_stock=2)
+    moves = [(m["from_station_id"], m["to_station_id"], m["batteries"]) for m in plan["moves"]]
+    assert moves == [(stations["A"], stations["B"], 2), (stations["A"], stations["C"], 1)]
+    assert 1000 < plan["moves"][0]["distance_m"] < 1200
+    assert plan["batteries_moved"] == 3
+    # C の残り1台と D の2台は運べない
+    assert plan["unmet_batteries"] == 3
+
+def test_demand_raises_target(stations):
+    # B では 9時台に毎日4台貸し出され（返却は遠い D）、11時台に1台返却される（D から）
+    s = get_session()
+    u = User(email="rebal@example.com", password_hash="x", balance_cents=0)
+    b = Battery(serial="REBAL-R", station_id=None, available=False)
+    s.add_all([u, b])
+    s.commit()
+    for day in range(28):
+        at = NOW.replace(hour=0) - timedelta(days=day + 1)
+        for i in range(4):
+            s.add(Rental(user_id=u.id, battery_id=b.id, station_id=stations["B"], status="returned",
+                         start_at=at.replace(hour=9, minute=10 + i), end_at=at.replace(hour=10),
+                         return_station_id=stations["D"]))
+        s.add(Rental(user_id=u.id, battery_id=b.id, station_id=stations["D"], status="returned",
+                     start_at=at.replace(hour=10, minute=30), end_at=at.replace(hour=11, minute=15),
+                     return_station_id=stations["B"]))
+        # 見回りで終了した貸出（返却先なし）は返却に数えない
+        s.add(Rental(user_id=u.id, battery_id=b.id, station_id=stations["D"], status="overdue",
+                     start_at=at.replace(hour=1), end_at=at.replace(hour=10)))
+    s.commit()
+    s.close()
+
+    plan = plan_rebalance(engine, now=NOW, horizon_hours=6, history_days=28,
+                          max_distance_m=10000, min_stock=0)
+    assert [(m["to_station_id"], m["batteries"]) for m in plan["moves"]] == [(stations["B"], 4)]
+    assert plan["method"] == "greedy_nearest" and plan["optimal"] is False
+    # 9時台の前（8時から1時間だけ）を見るなら需要はまだない
+    assert plan_rebalance(engine, now=NOW, horizon_hours=1, min_stock=0)["moves"] == []
+
+def test_station_targets_and_greedy_totals():
+    pickups = np.zeros((2, 24))
+    returns = np.zeros((2, 24))
+    pickups[0, 23], pickups[0, 0], returns[0, 1] = 2.5, 1.0, 3.0
+    assert station_targets(pickups, returns, 23, 3, 1).tolist() == [5, 1]
+
+    rng = np.random.default_rng(7)
+    xy = rng.uniform(0, 20000, size=(3000, 2)).astype(np.float32)
+    surplus = np.where(rng.random(3000) < 0.3, rng.integers(1, 6, 3000), 0)
+    deficit = np.where(surplus == 0, rng.integers(0, 4, 3000), 0)
+    moves = plan_moves(xy, surplus, deficit, 50000)
+    sent = np.zeros(3000, dtype=np.int64)
+    received = np.zeros(3000, dtype=np.int64)
+    for d, r, count, meters in moves:
+        sent[d] += count
+        received[r] += count
+        assert meters == pytest.approx(float(np.hypot(*(xy[d] - xy[r]))), rel=1e-4)
+    assert (sent <= surplus).all() and (received <= deficit).all()
+    # 距離の上限が十分大きいので、少ない方の合計まで運べる
+    assert sent.sum() == min(surplus.sum(), deficit.sum())
+
+def brute_force_min_cost(xy, surplus, deficit, max_distance_m):
+    """運べる台数を最大にしたうえで、台数 × 距離の合計が最小になる割り当て（総当たり）"""
+    donors = np.flatnonzero(surplus)
+    receivers = np.flatnonzero(deficit)
+    pairs = [(d, r, float(np.hypot(*(xy[d] - xy[r])))) for d in donors for r in receivers]
+    pairs = [p for p in pairs if p[2] <= max_distance_m]
+    best = (0, 0.0)
+    for counts in itertools.product(*[range(min(surplus[d], deficit[r]) + 1) for d, r, _ in pairs]):
+        sent = {}
+        received = {}
+        for (d, r, _), count in zip(pairs, counts):
+            sent[d] = sent.get(d, 0) + count
+            received[r] = received.get(r, 0) + count
+        if any(sent[d] > surplus[d] for d in sent) or any(received[r] > deficit[r] for r in received):
+            continue
+        moved = sum(counts)
+        cost = sum(count * meters for (_, _, meters), count in zip(pairs, counts))
+        if moved > best[0] or (moved == best[0] and cost < best[1]):
+            best = (moved, cost)
+    return best
+
+def greedy_total(moves):
+    return sum(count for _, _, count, _ in moves), sum(count * meters for _, _, count, meters in moves)
+
+def test_greedy_gap_against_brute_force():
+    # 一直線上に 需要R2(0m)・供給D1(2m)・需要R1(3m)・供給D2(5m)
+    xy = np.array([[0, 0], [2, 0], [3, 0], [5, 0]], dtype=np.float32)
+    surplus = np.array([0, 1, 0, 1])
+    deficit = np.array([1, 0, 1, 0])
+    moved, cost = greedy_total(plan_moves(xy, surplus, deficit, 100))
+    assert (moved, cost) == (2, pytest.approx(6.0))
+    # 最適は D1→R2, D2→R1 の計4m。貪欲法は 1.5 倍
+    assert brute_force_min_cost(xy, surplus, deficit, 100) == (2, pytest.approx(4.0))
+
+    # 小さなランダムな例: 台数は最適と同じだけ運び、距離は最適以上（下回れば総当たりが誤り）
+    rng = np.random.default_rng(11)
+    for _ in range(30):
+        xy = rng.uniform(0, 1000, size=(5, 2)).astype(np.float32)
+        surplus = np.array([2, 1, 0, 0, 0]) * rng.integers(0, 2, 5)
+        deficit = np.array([0, 0, 1, 2, 1])
+        moved, cost = greedy_total(plan_moves(xy, surplus, deficit, 5000))
+        best_moved, best_cost = brute_force_min_cost(xy, surplus, deficit, 5000)
+        assert moved == best_moved
+        assert cost >= best_cost - 1e-3
@@ -0,0 +1,145 @@
+"""
+利用集計（rollup.py）のテスト
+- 前回以降の貸出だけを加算し、作り直した結果と一致すること
+- 同じ範囲を2回集計しても二重に加算しないこと
+- 管理用 API が集計テーブルから時系列を返すこと（オフセットつきの since / until は UTC に直す）
+- ウォーターマークの行がない状態で2つのジョブが行を作ろうとしても失敗しないこと
+- 見回りで終了した貸出（返却先なし）の請求が貸出元スタンドの売上に入ること
+SQLite のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental, StationHourlyStat, RollupWatermark
+from app import app
+from rollup import refresh_station_hourly, _claim_window
+from sweeper import sweep_overdue
+
+BASE = datetime(2025, 1, 1, 9, 0, 0)
+
+@pytest.fixture(scope="module")
+def ids():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="rollup@example.com", password_hash="x", balance_cents=0)
+    st1 = Station(name="S1", lat=0.0, lng=0.0, available_count=1)
+    st2 = Station(name="S2", lat=0.0, lng=0.0, available_count=0)
+    s.add_all([u, st1, st2])
+    s.commit()
+    b = Battery(serial="ROLLUP1", station_id=st1.id, available=True)
+    s.add(b)
+    s.commit()
+    # 9時台に S1 で3件開始、うち2件は10時台に S2 へ返却（30分・50分）、1件は貸出中
+    for minutes, end in ((10, 40), (20, 70), (30, None)):
+        s.add(Rental(user_id=u.id, battery_id=b.id, station_id=st1.id,
+                     start_at=BASE + timedelta(minutes=minutes),
+                     end_at=BASE + timedelta(minutes=end) if end else None,
+                     return_station_id=st2.id if end else None,
+                     status="returned" if end else "ongoing",
+                     price_cents=(end - minutes) * 10 if end else None))
+    s.commit()
+    result = (u.id, b.id, st1.id, st2.id)
+    s.close()
+    app.config['TESTING'] = True
+    return result
+
+def _rows():
+    s = get_session()
+    try:
+        return sorted(
+            (r.station_id, r.hour, r.rentals_started, r.rentals_returned, r.revenue_cents,
+             r.duration_seconds_total)
+            for r in s.query(StationHourlyStat).all()
+        )
+    finally:
+        s.close()
+
+def test_incremental_matches_rebuild(ids):
+    user_id, battery_id, st1, st2 = ids
+    first = refresh_station_hourly(engine, now=BASE + timedelta(hours=2), lag_seconds=0)
+    assert first["since"] is None and not first["skipped"]
+    rows = {(r[0], r[1]): r[2:] for r in _rows()}
+    assert rows[(st1, BASE)] == (3, 0, 0, 0)
+    assert rows[(st2, BASE + timedelta(hours=1))] == (0, 1, 500, 3000)
+    assert rows[(st2, BASE)] == (0, 1, 300, 1800)
+    assert rows[(0, BASE)][:2] == (3, 1)
+
+    # 同じ時刻までをもう一度：何も加算しない
+    assert refresh_station_hourly(engine, now=BASE + timedelta(hours=2), lag_seconds=0)["skipped"]
+
+    # 貸出中だった1件を返却し、新しい貸出を1件追加して差分だけ集計
+    s = get_session()
+    rental = s.query(Rental).filter_by(status="ongoing").one()
+    rental.status, rental.end_at, rental.price_cents = "returned", BASE + timedelta(hours=2, minutes=30), 1200
+    rental.return_station_id = st1
+    s.add(Rental(user_id=user_id, battery_id=battery_id, station_id=st2, status="ongoing",
+                 start_at=BASE + timedelta(hours=2, minutes=45)))
+    s.commit()
+    s.close()
+    second = refresh_station_hourly(engine, now=BASE + timedelta(hours=3), lag_seconds=0)
+    assert second["since"] == (BASE + timedelta(hours=2)).isoformat()
+    incremental = _rows()
+
+    refresh_station_hourly(engine, now=BASE + timedelta(hours=3), lag_seconds=0, rebuild=True)
+    assert _rows() == incremental
+
+def test_station_stats_api(ids, monkeypatch):
+    _, _, st1, st2 = ids
+    monkeypatch.setattr("app.ADMIN_API_KEY", "admin-key")
+    client = app.test_client()
+    url = f"/api/admin/stats/stations/{st2}?since=2025-01-01&until=2025-01-02&bucket=day"
+    assert client.get(url).status_code == 401
+
+    r = client.get(url, headers={"X-API-Key": "admin-key"})
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["series"] == [{"at": "2025-01-01T00:00:00", "rentals_started": 1, "rentals_returned": 2,
+                               "revenue_cents": 800, "mean_duration_seconds": 2400.0}]
+    assert data["totals"]["rentals_returned"] == 2
+
+    # 2025-01-01T09:00+09:00 = 00:00 UTC
+    r = client.get(f"/api/admin/stats/stations/{st2}?since=2025-01-01T09:00%2B09:00"
+                   f"&until=2025-01-02T09:00%2B09:00&bucket=day", headers={"X-API-Key": "admin-key"})
+    assert r.status_code == 200
+    assert r.get_json()["series"] == data["series"]
+    assert r.get_json()["since"] == "2025-01-01T00:00:00"
+
+def test_overdue_closures_count_at_rental_station(ids):
+    _, _, st1, st2 = ids
+    refresh_station_hourly(engine, now=BASE + timedelta(hours=3), lag_seconds=0)
+    # S2 で 2:45 に始まった貸出中の1件を、3:50 の見回りで終了させる
+    closed = sweep_overdue(engine, now=BASE + timedelta(hours=3, minutes=50), policy="close",
+                           overdue_after_hours=1, pause_ms=0)
+    assert closed["closed"] == 1 and closed["charged_cents"] > 0
+
+    refresh_station_hourly(engine, now=BASE + timedelta(hours=4), lag_seconds=0)
+    rows = {(r[0], r[1]): r[2:] for r in _rows()}
+    assert rows[(st2, BASE + timedelta(hours=3))][1:3] == (1, closed["charged_cents"])
+    assert rows[(0, BASE + timedelta(hours=3))][1:3] == (1, closed["charged_cents"])
+
+class StaleFirstRead:
+    """最初の SELECT だけ「ウォーターマークの行がない」と読む接続（同時に走った初回のジョブ）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.dialect = conn.dialect
+        self.first_read = True
+
+    def execute(self, stmt, *args):
+        if self.first_read:
+            self.first_read = False
+            return self.conn.execute(stmt.where(False), *args)
+        return self.conn.execute(stmt, *args)
+
+def test_concurrent_first_runs_do_not_collide(ids):
+    # もう一方のジョブが先に行を作り、集計範囲を進めた後
+    with engine.begin() as conn:
+        conn.execute(RollupWatermark.__table__.delete())
+        since, claimed = _claim_window(conn, BASE + timedelta(hours=1))
+    assert since is None and claimed
+
+    # 行がないと読んでいた方は主キー違反にならず、何もせずに終わる
+    with engine.begin() as conn:
+        since, claimed = _claim_window(StaleFirstRead(conn), BASE + timedelta(hours=1))
+    assert since is None and not claimed
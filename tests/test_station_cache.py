@@ -0,0 +1,89 @@
+"""
+在庫一覧のキャッシュ（AvailabilityCache と /api/stations の ETag）のテスト
+- If-None-Match が一致すれば DB に触れずに 304 を返すこと
+- 貸出のコミット後は作り直され、ETag と在庫数が変わること
+- bump() か TTL 切れまでは loader を呼ばず、作り直しても中身が同じなら ETag は変わらないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from sqlalchemy import event
+from db import engine, get_session
+from models import Base, User, Station, Battery
+from app import app, availability_cache
+from availability import AvailabilityCache
+
+@pytest.fixture(scope="module")
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="cache@example.com", password_hash="x", balance_cents=5000)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=1)
+    s.add_all([u, st])
+    s.commit()
+    b = Battery(serial="CACHE1", station_id=st.id, available=True)
+    s.add(b)
+    s.commit()
+    ids = (u.id, b.id)
+    s.close()
+    availability_cache.bump()
+    app.config['TESTING'] = True
+    with app.test_client() as c:
+        with c.session_transaction() as flask_session:
+            flask_session["user_id"] = ids[0]
+        yield c, ids
+    availability_cache.bump()
+
+def test_not_modified_without_queries(client):
+    c, _ = client
+    r = c.get("/api/stations")
+    etag = r.headers["ETag"]
+    assert r.headers["Cache-Control"] == "no-cache"
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        r = c.get("/api/stations", headers={"If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert r.status_code == 304
+    assert r.headers["ETag"] == etag
+    assert statements == []
+
+def test_rent_invalidates(client):
+    c, (_, battery_id) = client
+    etag = c.get("/api/stations").headers["ETag"]
+    assert c.post(f"/rent/{battery_id}").status_code == 302
+
+    r = c.get("/api/stations", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    assert r.get_json()[0]["available"] == 0
+
+def test_cache_reuses_until_bump_or_ttl(monkeypatch):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [{"id": 1, "available_count": 3}]
+
+    now = [100.0]
+    monkeypatch.setattr("availability.time.monotonic", lambda: now[0])
+    cache = AvailabilityCache(ttl_seconds=5)
+    _, etag = cache.get(loader)
+    cache.get(loader)
+    assert len(calls) == 1
+
+    cache.bump()
+    _, rebuilt = cache.get(loader)
+    assert len(calls) == 2
+    # 中身が同じなら ETag は同じ（クライアントは 304 のまま）
+    assert rebuilt == etag
+
+    now[0] += 5
+    cache.get(loader)
+    assert len(calls) == 3
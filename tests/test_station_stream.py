@@ -0,0 +1,114 @@
+"""
+在庫ストリーム（station_stream.py）のテスト
+- 接続直後に snapshot、以降は変化したスタンドだけを delta で受け取ること
+- Last-Event-ID で取りこぼした delta だけを受け取り直せること
+- DB を読むのは購読者の数によらず1回の poll につき1回だけであること
+- 最初の読み込みが失敗・停滞したら、待たずに StreamUnavailableError になること
+DB の代わりに在庫を返す関数を渡して動かす想定
+"""
+import asyncio
+import json
+import pytest
+from station_stream import StationBroadcaster, StreamUnavailableError
+
+def _parse(message):
+    fields = dict(line.split(": ", 1) for line in message.decode("utf-8").strip().split("\n"))
+    return fields["event"], fields["id"], json.loads(fields["data"])
+
+def test_snapshot_delta_and_resume():
+    counts = {1: 5, 2: 3}
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return dict(counts)
+
+    async def scenario():
+        broadcaster = StationBroadcaster(loader, poll_interval_ms=60000, snapshot_seconds=3600,
+                                         replay_events=10, subscriber_queue=10)
+        subscribers = []
+        for _ in range(50):
+            sub, initial = await broadcaster.subscribe()
+            subscribers.append(sub)
+        event, snapshot_id, data = _parse(initial[0])
+        assert event == "snapshot"
+        assert data == [{"station_id": 1, "available": 5}, {"station_id": 2, "available": 3}]
+
+        counts[1] = 4
+        await broadcaster.poll()
+        counts[2] = 2
+        await broadcaster.poll()
+        assert len(calls) == 3
+
+        for sub in subscribers:
+            first = _parse(await sub.next(1))
+            second = _parse(await sub.next(1))
+            assert first[0] == "delta" and first[2] == [{"station_id": 1, "available": 4}]
+            assert second[2] == [{"station_id": 2, "available": 2}]
+
+        # 1件目の delta まで受け取っていたクライアントは2件目だけ受け取り直す
+        _, resumed = await broadcaster.subscribe(first[1])
+        assert [_parse(m)[2] for m in resumed] == [[{"station_id": 2, "available": 2}]]
+
+        # snapshot の ID からは、その後の delta 2件
+        _, resumed = await broadcaster.subscribe(snapshot_id)
+        assert len(resumed) == 2
+
+        # 別プロセス（epoch 違い）の ID は snapshot からやり直し
+        _, resumed = await broadcaster.subscribe("other-1")
+        assert _parse(resumed[0])[0] == "snapshot"
+        assert _parse(resumed[0])[2][0] == {"station_id": 1, "available": 4}
+
+    asyncio.run(scenario())
+
+def test_slow_subscriber_is_dropped():
+    counts = {1: 0}
+
+    async def loader():
+        return dict(counts)
+
+    async def scenario():
+        broadcaster = StationBroadcaster(loader, poll_interval_ms=60000, snapshot_seconds=3600,
+                                         replay_events=10, subscriber_queue=2)
+        slow, _ = await broadcaster.subscribe()
+        for i in range(1, 4):
+            counts[1] = i
+            await broadcaster.poll()
+        assert slow.dropped
+        # 溜まっていた分を送り終えたら None（接続を閉じる）
+        assert await slow.next(1) is not None
+        assert await slow.next(1) is not None
+        assert await slow.next(1) is None
+
+    asyncio.run(scenario())
+
+def test_first_poll_failure_does_not_hang():
+    failures = [RuntimeError("db down")]
+
+    async def loader():
+        if failures:
+            raise failures.pop()
+        return {1: 5}
+
+    async def scenario():
+        broadcaster = StationBroadcaster(loader, poll_interval_ms=10, snapshot_seconds=3600,
+                                         replay_events=10, subscriber_queue=10, ready_timeout=5)
+        with pytest.raises(StreamUnavailableError):
+            await asyncio.wait_for(broadcaster.subscribe(), 1)
+        # 次の接続で読み直し、DB が戻っていればつながる
+        _, initial = await asyncio.wait_for(broadcaster.subscribe(), 1)
+        assert _parse(initial[0])[2] == [{"station_id": 1, "available": 5}]
+
+    asyncio.run(scenario())
+
+def test_stalled_first_poll_times_out():
+    async def loader():
+        await asyncio.Event().wait()
+
+    async def scenario():
+        broadcaster = StationBroadcaster(loader, poll_interval_ms=10, snapshot_seconds=3600,
+                                         replay_events=10, subscriber_queue=10, ready_timeout=0.1)
+        with pytest.raises(StreamUnavailableError):
+            await asyncio.wait_for(broadcaster.subscribe(), 1)
+
+    asyncio.run(scenario())
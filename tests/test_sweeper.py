@@ -0,0 +1,79 @@
+"""
+長期未返却の見回り（sweeper.py）のテスト
+- flag は期限を過ぎた貸出だけを1回だけ記録すること
+- close は上限つきの料金を請求して終了し、台帳と残高が一致すること
+- 同時に返却された貸出は請求しないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental, ChargeHistory, OverdueRentalAction
+from ledger import audit_balances
+from tariff import Tariff
+from sweeper import sweep_overdue, close_overdue_rental, overdue_batch_query
+
+NOW = datetime(2025, 3, 1, 12, 0, 0)
+TARIFF = Tariff({"per_minute_cents": 10, "max_charge_cents": 3000})
+
+@pytest.fixture
+def rentals():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="sweeper@example.com", password_hash="x", balance_cents=1000)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=0)
+    s.add_all([u, st])
+    s.commit()
+    s.add(ChargeHistory(user_id=u.id, amount_cents=1000, kind="charge"))
+    batteries = [Battery(serial=f"SWEEP{i}", station_id=st.id, available=False) for i in range(4)]
+    s.add_all(batteries)
+    s.commit()
+    # 30時間前・25時間前に始まった貸出中、1時間前に始まった貸出中、返却済み
+    for battery, hours, status in zip(batteries, (30, 25, 1, 40), ("ongoing", "ongoing", "ongoing", "returned")):
+        s.add(Rental(user_id=u.id, battery_id=battery.id, station_id=st.id, status=status,
+                     start_at=NOW - timedelta(hours=hours),
+                     end_at=NOW - timedelta(hours=39) if status == "returned" else None))
+    s.commit()
+    user_id = u.id
+    s.close()
+    return user_id
+
+def test_flag_records_each_overdue_rental_once(rentals):
+    first = sweep_overdue(engine, now=NOW, policy="flag", overdue_after_hours=24, batch_size=1, pause_ms=0)
+    assert (first["overdue"], first["flagged"], first["batches"]) == (2, 2, 2)
+    assert sweep_overdue(engine, now=NOW, policy="flag", overdue_after_hours=24, pause_ms=0)["flagged"] == 0
+
+    s = get_session()
+    assert s.query(OverdueRentalAction).filter_by(action="flagged").count() == 2
+    assert s.query(Rental).filter_by(status="ongoing").count() == 3
+    s.close()
+
+def test_close_charges_capped_price(rentals):
+    preview = sweep_overdue(engine, now=NOW, policy="close", overdue_after_hours=24,
+                            tariff=TARIFF, dry_run=True)
+    assert preview["charged_cents"] == 6000 and preview["closed"] == 0
+
+    summary = sweep_overdue(engine, now=NOW, policy="close", overdue_after_hours=24, tariff=TARIFF)
+    assert (summary["closed"], summary["charged_cents"]) == (2, 6000)
+    assert sweep_overdue(engine, now=NOW, policy="close", overdue_after_hours=24, tariff=TARIFF)["overdue"] == 0
+
+    s = get_session()
+    closed = s.query(Rental).filter_by(status="overdue").all()
+    assert [(r.price_cents, r.end_at) for r in closed] == [(3000, NOW), (3000, NOW)]
+    assert s.get(User, rentals).balance_cents == 1000 - 6000
+    assert s.query(ChargeHistory).filter_by(kind="overdue").count() == 2
+    assert audit_balances(s) == []
+    assert s.query(OverdueRentalAction).filter_by(action="closed").count() == 2
+    s.close()
+
+def test_close_skips_rental_returned_meanwhile(rentals):
+    with engine.connect() as conn:
+        row = conn.execute(overdue_batch_query(NOW - timedelta(hours=24))).first()
+    s = get_session()
+    s.get(Rental, row.id).status = "returned"
+    s.commit()
+    assert close_overdue_rental(s, row, NOW, TARIFF) is None
+    s.commit()
+    assert s.query(ChargeHistory).filter_by(kind="overdue").count() == 0
+    s.close()
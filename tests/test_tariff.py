@@ -0,0 +1,95 @@
+"""
+料金表（tariff.py）のテスト
+- 料金表を指定しなければ従来の max(1, 分) * 分単価 と同じになること
+- 時間帯別単価・1日の上限・スタンドごとの上書きで、1件の計算と配列の計算が一致すること
+- 一括再計算が DB の貸出を読み、現在の請求額との差を返すこと
+SQLite のまま動かす想定
+"""
+import random
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, User, Station, Battery, Rental
+from tariff import Tariff, reprice_rentals, EPOCH
+from variables import PRICE_PER_MINUTE_CENTS
+
+CANDIDATE = {
+    "per_minute_cents": 10,
+    "bands": [{"start": "22:00", "end": "06:00", "per_minute_cents": 4}],
+    "daily_cap_cents": 1500,
+    "stations": {"2": {"per_minute_cents": 7, "bands": [], "daily_cap_cents": None}},
+}
+
+def test_default_matches_flat_rate():
+    tariff = Tariff()
+    start = datetime(2025, 1, 1, 12, 0, 0)
+    assert tariff.price(start, start + timedelta(seconds=30)) == PRICE_PER_MINUTE_CENTS
+    assert tariff.price(start, start + timedelta(minutes=90, seconds=59)) == 90 * PRICE_PER_MINUTE_CENTS
+
+def test_bands_caps_and_overrides():
+    # UTC+9 で 21:50 開始、20分 → 10分 * 10 + 10分 * 4
+    tariff = Tariff(CANDIDATE, utc_offset_hours=9)
+    start = datetime(2025, 1, 1, 12, 50)
+    assert tariff.price(start, start + timedelta(minutes=20)) == 140
+    # 上限は現地時刻の日ごと（21:50〜翌々日 03:50: 580 + 上限 1500 + 230分 * 4）
+    assert tariff.price(start, start + timedelta(hours=30)) == 580 + 1500 + 920
+    # スタンド 2 は分単価 7、上限なし
+    assert tariff.price(start, start + timedelta(hours=30), station_id=2) == 7 * 30 * 60
+
+def test_scalar_and_vectorized_agree():
+    tariff = Tariff(CANDIDATE, utc_offset_hours=9)
+    rng = random.Random(1)
+    starts, ends, stations, expected = [], [], [], []
+    for _ in range(2000):
+        start = datetime(2025, 1, 1) + timedelta(seconds=rng.randrange(0, 86400 * 30))
+        end = start + timedelta(seconds=rng.randrange(0, 86400 * 3))
+        station_id = rng.choice([None, 1, 2, 3])
+        starts.append((start - EPOCH) // timedelta(milliseconds=1))
+        ends.append((end - EPOCH) // timedelta(milliseconds=1))
+        stations.append(-1 if station_id is None else station_id)
+        expected.append(tariff.price(start, end, station_id))
+    prices = tariff.price_many(np.array(starts), np.array(ends), np.array(stations))
+    assert prices.tolist() == expected
+
+@pytest.fixture(scope="module")
+def rentals():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    u = User(email="tariff@example.com", password_hash="x", balance_cents=0)
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=1)
+    s.add_all([u, st])
+    s.commit()
+    b = Battery(serial="TARIFF1", station_id=st.id, available=True)
+    s.add(b)
+    s.commit()
+    base = datetime(2025, 1, 1, 3, 0, 0)
+    for i in range(20):
+        start = base + timedelta(hours=i)
+        end = start + timedelta(minutes=30 + i, seconds=15)
+        s.add(Rental(user_id=u.id, battery_id=b.id, station_id=st.id, status="returned",
+                     start_at=start, end_at=end, price_cents=Tariff().price(start, end)))
+    s.commit()
+    s.close()
+
+def test_reprice_rentals(rentals):
+    same = reprice_rentals(Tariff(), engine)
+    assert same["rentals"] == 20
+    assert same["diff_cents"] == 0 and same["unchanged"] == 20
+
+    cheaper = reprice_rentals(Tariff({"per_minute_cents": PRICE_PER_MINUTE_CENTS - 1}), engine)
+    assert cheaper["decreased"] == 20
+    assert cheaper["diff_cents"] == -sum(30 + i for i in range(20))
+    assert cheaper["top_stations"][0]["diff_cents"] == cheaper["diff_cents"]
+
+def test_max_charge_caps_long_rentals():
+    tariff = Tariff({**CANDIDATE, "max_charge_cents": 2000}, utc_offset_hours=9)
+    start = datetime(2025, 1, 1, 12, 50)
+    assert tariff.price(start, start + timedelta(minutes=20)) == 140
+    assert tariff.price(start, start + timedelta(hours=30)) == 2000
+    # スタンドの上書きも上限を引き継ぐ
+    assert tariff.price(start, start + timedelta(hours=30), station_id=2) == 2000
+    start_ms = (start - EPOCH) // timedelta(milliseconds=1)
+    end_ms = start_ms + np.array([20, 30 * 60]) * 60000
+    assert tariff.price_many(np.full(2, start_ms), end_ms, np.array([-1, 2])).tolist() == [140, 2000]
@@ -0,0 +1,87 @@
+"""
+テレメトリ取り込みのテスト
+- 同じバッテリーの計測は最新の1件にまとめ、UPDATE 1文で書き出すこと
+- 遅れて届いた古い計測で新しい残量を上書きしないこと
+- 時計のずれた未来の時刻の計測は捨て、以降の計測を妨げないこと
+SQLite のまま動かす想定
+"""
+import pytest
+from datetime import datetime, timedelta
+from db import engine, get_session
+from models import Base, Station, Battery
+from app import app
+from telemetry import TelemetryBuffer, telemetry_buffer
+
+SERIALS = ["TEL1", "TEL2", "TEL3"]
+
+@pytest.fixture(scope="module")
+def setup():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    s = get_session()
+    st = Station(name="S", lat=0.0, lng=0.0, available_count=3)
+    s.add(st)
+    s.commit()
+    s.add_all([Battery(serial=serial, station_id=st.id, battery_level=100) for serial in SERIALS])
+    s.commit()
+    s.close()
+    app.config['TESTING'] = True
+
+def _levels():
+    s = get_session()
+    try:
+        return {b.serial: b.battery_level for b in s.query(Battery).all()}
+    finally:
+        s.close()
+
+def test_buffer_coalesces_into_one_statement(setup):
+    buffer = TelemetryBuffer(flush_interval_ms=60000, flush_max_rows=10000)
+    base = datetime.utcnow()
+    readings = []
+    for i in range(100):
+        for n, serial in enumerate(SERIALS):
+            readings.append((serial, 10 * n + i % 10, base + timedelta(seconds=i)))
+    # 最新より古い計測が後から届いても無視される
+    readings.append(("TEL1", 1, base - timedelta(seconds=1)))
+    buffer.add(readings)
+
+    assert buffer.flush() == 3
+    stats = buffer.stats()
+    assert stats["statements"] == 1
+    assert stats["received"] == 301
+    assert _levels() == {"TEL1": 9, "TEL2": 19, "TEL3": 29}
+
+    # 別のワーカーから古い計測が書き出されても上書きしない
+    buffer.add([("TEL2", 55, base - timedelta(minutes=1))])
+    assert buffer.flush() == 0
+    assert _levels()["TEL2"] == 19
+
+def test_telemetry_endpoint(setup, monkeypatch):
+    monkeypatch.setattr("app.TELEMETRY_API_KEY", "station-key")
+    client = app.test_client()
+    body = {"readings": [
+        {"serial": "TEL3", "level": 42, "ts": (datetime.utcnow() + timedelta(minutes=2)).isoformat()},
+        {"serial": "TEL3", "level": 120},
+        {"level": 50},
+        # 時計が1日進んだステーション
+        {"serial": "TEL1", "level": 7, "ts": (datetime.utcnow() + timedelta(days=1)).isoformat()},
+    ]}
+
+    r = client.post("/api/telemetry", json=body, headers={"X-API-Key": "wrong"})
+    assert r.status_code == 401
+
+    r = client.post("/api/telemetry", json=body, headers={"X-API-Key": "station-key"})
+    assert r.status_code == 202
+    assert r.get_json() == {"accepted": 1, "rejected": 3}
+
+    telemetry_buffer.flush()
+    assert _levels()["TEL3"] == 42
+    assert _levels()["TEL1"] == 9
+
+    # 捨てたので、その後の正しい計測は反映される
+    ts = (datetime.utcnow() + timedelta(minutes=3)).isoformat()
+    r = client.post("/api/telemetry", json={"readings": [{"serial": "TEL1", "level": 33, "ts": ts}]},
+                    headers={"X-API-Key": "station-key"})
+    assert r.get_json() == {"accepted": 1, "rejected": 0}
+    telemetry_buffer.flush()
+    assert _levels()["TEL1"] == 33
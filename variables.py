@@ -48,6 +48,35 @@ FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "flask_secret_key_change_me!")
 # デバッグモード
 DEBUG_MODE = os.getenv("DEBUG_MODE", "True").lower() == "true"
 
+# ============================================================
+# DBエンジン設定（db.py のプロファイル）
+# ============================================================
+# dev: 開発用（SQL の全文ログは SQL_ECHO=true で出す） / prod: 本番向けプール / bench: 負荷試験用
+DB_PROFILE = os.getenv("DB_PROFILE", "dev" if DEBUG_MODE else "prod")
+
+# SQLログ出力（未指定ならプロファイルの既定値）
+SQL_ECHO = os.getenv("SQL_ECHO")
+
+# 非同期 API（asgi_api.py）用の URL。未指定なら DATABASE_URL のドライバを
+# aiosqlite / asyncpg に置き換えて使う
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# コネクションプール（PostgreSQL の prod プロファイル。bench は大きさが4倍、dev は db.py の小さい固定値）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 秒
+
+# SQLite の PRAGMA
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+# SQL 計測: この時間（ミリ秒）以上かかった文をルート名つきで警告ログに出す
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# レスポンスに Server-Timing ヘッダ（SQL の件数・時間）をつけるか
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "True").lower() == "true"
+
 # ============================================================
 # 料金設定（ビジネスロジック）
 # ============================================================
@@ -60,6 +89,199 @@ RENTAL_DEPOSIT_CENTS = int(os.getenv("RENTAL_DEPOSIT_CENTS", "500"))
 # 初回チャージボーナス（cents = 円）
 INITIAL_BALANCE_CENTS = int(os.getenv("INITIAL_BALANCE_CENTS", "0"))
 
+# 料金表ファイル（JSON、書式は tariff.py 参照）。空なら PRICE_PER_MINUTE_CENTS だけで計算する
+TARIFF_FILE = os.getenv("TARIFF_FILE", "")
+
+# 時間帯別料金・1日の上限を判定する現地時刻の UTC との差（時間）
+TARIFF_UTC_OFFSET_HOURS = float(os.getenv("TARIFF_UTC_OFFSET_HOURS", "9"))
+
+# 1件の貸出あたりの請求の上限（cents = 円）。料金表の max_charge_cents の既定値。0 なら上限なし
+RENTAL_MAX_CHARGE_CENTS = int(os.getenv("RENTAL_MAX_CHARGE_CENTS", "0"))
+
+# ============================================================
+# キャッシュ設定
+# ============================================================
+# スタンド在庫一覧キャッシュの有効期限（秒）
+# 同一プロセス内の貸出・返却は即座に反映される。他プロセスからの変更はこの秒数以内に反映
+AVAILABILITY_CACHE_TTL_SECONDS = float(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "5"))
+
+# ============================================================
+# 近隣スタンド検索設定
+# ============================================================
+# 空間インデックスのマスの大きさ（度）。0.0025度 ≒ 280m
+NEARBY_GRID_CELL_DEG = float(os.getenv("NEARBY_GRID_CELL_DEG", "0.0025"))
+
+# 検索半径（m）の既定値と上限
+NEARBY_DEFAULT_RADIUS_M = float(os.getenv("NEARBY_DEFAULT_RADIUS_M", "3000"))
+NEARBY_MAX_RADIUS_M = float(os.getenv("NEARBY_MAX_RADIUS_M", "50000"))
+
+# 返却件数の上限
+NEARBY_MAX_LIMIT = int(os.getenv("NEARBY_MAX_LIMIT", "50"))
+
+# ============================================================
+# 利用履歴ページング設定
+# ============================================================
+# 1ページあたりの件数（既定値と上限）
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# ============================================================
+# パスワードハッシュ設定
+# ============================================================
+# PBKDF2 の反復回数。変更すると、古い回数のハッシュはログイン成功時に作り直される
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+
+# ハッシュ計算の同時実行数（ワーカープロセスごと）。残りの CPU を貸出・返却に残す
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# 実行待ちにできる件数。超えたログインは 503 + Retry-After で断る
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "32"))
+
+# 実行待ちの上限時間（秒）と、警告ログを出す待ち時間（秒）
+HASH_WAIT_TIMEOUT_SECONDS = float(os.getenv("HASH_WAIT_TIMEOUT_SECONDS", "5"))
+HASH_SLOW_QUEUE_SECONDS = float(os.getenv("HASH_SLOW_QUEUE_SECONDS", "0.5"))
+
+# 混雑時に返す Retry-After（秒）
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "2"))
+
+# ============================================================
+# 一括処理 API（/api/batch）設定
+# ============================================================
+# 1リクエストで受け付ける操作数の上限
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "200"))
+
+# 1トランザクション（1コミット）で処理する操作数の既定値。リクエストの chunk_size で上書きできる
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "50"))
+
+# ============================================================
+# テレメトリ（バッテリー残量）取り込み設定
+# ============================================================
+# ステーションが X-API-Key ヘッダーで送るキー。空なら取り込み API は使えない
+TELEMETRY_API_KEY = os.getenv("TELEMETRY_API_KEY", "")
+
+# 溜めた計測値を DB に書き出す間隔（ミリ秒）と、間隔を待たずに書き出すバッテリー数
+TELEMETRY_FLUSH_INTERVAL_MS = int(os.getenv("TELEMETRY_FLUSH_INTERVAL_MS", "1000"))
+TELEMETRY_FLUSH_MAX_ROWS = int(os.getenv("TELEMETRY_FLUSH_MAX_ROWS", "5000"))
+
+# 1リクエストで受け付ける計測値の上限
+TELEMETRY_MAX_READINGS = int(os.getenv("TELEMETRY_MAX_READINGS", "5000"))
+
+# 計測時刻が現在時刻よりこの秒数以上先なら捨てる（時計のずれたステーションの計測で、
+# 以降の正しい計測が反映されなくなるのを防ぐ）
+TELEMETRY_MAX_CLOCK_SKEW_SECONDS = int(os.getenv("TELEMETRY_MAX_CLOCK_SKEW_SECONDS", "300"))
+
+# ============================================================
+# 在庫ストリーム（/api/stations/stream, SSE）設定
+# ============================================================
+# 在庫を読み直して差分を配る間隔（ミリ秒）。購読者の数によらずプロセスごとに1回
+STREAM_POLL_INTERVAL_MS = int(os.getenv("STREAM_POLL_INTERVAL_MS", "500"))
+
+# 全スタンドの snapshot を配り直す間隔（秒）
+STREAM_SNAPSHOT_SECONDS = int(os.getenv("STREAM_SNAPSHOT_SECONDS", "60"))
+
+# 接続維持のためのコメント行を送る間隔（秒）
+STREAM_KEEPALIVE_SECONDS = int(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+
+# Last-Event-ID で再開できるように残しておく delta の件数
+STREAM_REPLAY_EVENTS = int(os.getenv("STREAM_REPLAY_EVENTS", "1000"))
+
+# 購読者ごとに溜められるイベント数。溢れた購読者は切断して再接続させる
+STREAM_SUBSCRIBER_QUEUE = int(os.getenv("STREAM_SUBSCRIBER_QUEUE", "100"))
+
+# 接続時に最初の在庫読み込みを待つ上限（秒）。読めなければ 503 を返して再接続させる
+STREAM_READY_TIMEOUT_SECONDS = float(os.getenv("STREAM_READY_TIMEOUT_SECONDS", "5"))
+
+# ============================================================
+# 利用集計（rollup.py）設定
+# ============================================================
+# 管理用 API（/api/admin/...）の X-API-Key。空なら管理用 API は使えない
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+
+# 集計ジョブが現在時刻からどれだけ遅れて集計するか（秒）。コミット待ちの貸出を取りこぼさないため
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "120"))
+
+# 集計 API で一度に指定できる期間の上限（日）
+STATS_MAX_DAYS = int(os.getenv("STATS_MAX_DAYS", "400"))
+
+# ============================================================
+# バッテリー再配置計画（rebalance.py）設定
+# ============================================================
+# 何時間先までの貸出・返却を見込んで目標在庫を決めるか
+REBALANCE_HORIZON_HOURS = int(os.getenv("REBALANCE_HORIZON_HOURS", "6"))
+
+# 需要の平均を取る過去の日数
+REBALANCE_HISTORY_DAYS = int(os.getenv("REBALANCE_HISTORY_DAYS", "28"))
+
+# 運ぶ距離の上限（m）。これより遠いスタンドとは組み合わせない
+REBALANCE_MAX_DISTANCE_M = float(os.getenv("REBALANCE_MAX_DISTANCE_M", "10000"))
+
+# 見込みとは別に各スタンドに残しておく台数
+REBALANCE_MIN_STOCK = int(os.getenv("REBALANCE_MIN_STOCK", "2"))
+
+# ============================================================
+# 長期未返却の貸出の見回り（sweeper.py）設定
+# ============================================================
+# 貸出開始からこの時間（時間）を過ぎても貸出中なら長期未返却とみなす
+OVERDUE_AFTER_HOURS = float(os.getenv("OVERDUE_AFTER_HOURS", "24"))
+
+# 長期未返却の扱い
+# - flag:  記録するだけ（返却時の請求は料金表の max_charge_cents まで）
+# - close: その時点の料金（上限つき）を請求して貸出を終了する（status = overdue）
+SWEEPER_POLICY = os.getenv("SWEEPER_POLICY", "flag")
+
+# 1トランザクションで処理する貸出の件数（書き込みロックを短く保つ）
+SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "100"))
+
+# バッチの間に空ける時間（ミリ秒）。貸出・返却の書き込みを先に通すため
+SWEEPER_BATCH_PAUSE_MS = int(os.getenv("SWEEPER_BATCH_PAUSE_MS", "50"))
+
+# ============================================================
+# アドミッション制御（admission.py）設定
+# ============================================================
+# false にすると種類ごとの同時実行数の制限をしない（ログインの回数制限は残る）
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+
+# ワーカーあたりのスレッド数（gunicorn.conf.py の threads と同じ環境変数・既定値）
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# ルートの種類ごとの (同時に処理する数, 枠が空くのを待つ最大時間[ミリ秒])。ワーカー（プロセス）ごと
+# - auth:  ログイン・登録の POST（パスワードのハッシュ計算がある）。ハッシュ計算のスレッド数
+#          （HASH_MAX_WORKERS）より少ないと計算の枠が余るので、既定値はそれに揃える
+# - write: 貸出・返却・チャージなどの書き込み。貸出・返却を守るため待ち時間を長めにする
+# - read:  在庫・履歴などの読み取り（ポーリングが集中しやすい）。待ち時間は短くすぐ断る。
+#          キャッシュから返す GET は一瞬で終わるので、既定値はスレッド数にする
+#          （スレッド数より少ないと、普段の負荷でも安い GET が 503 になる）
+ADMISSION_LIMITS = {
+    "auth": (
+        int(os.getenv("ADMISSION_AUTH_CONCURRENCY", str(HASH_MAX_WORKERS))),
+        int(os.getenv("ADMISSION_AUTH_WAIT_MS", "200")),
+    ),
+    "write": (
+        int(os.getenv("ADMISSION_WRITE_CONCURRENCY", "4")),
+        int(os.getenv("ADMISSION_WRITE_WAIT_MS", "2000")),
+    ),
+    "read": (
+        int(os.getenv("ADMISSION_READ_CONCURRENCY", str(GUNICORN_THREADS))),
+        int(os.getenv("ADMISSION_READ_WAIT_MS", "50")),
+    ),
+}
+
+# 断ったときの Retry-After（秒）
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+# ログインの回数制限（/api/login, /login の POST）。1分あたりの回数と、まとめて使える回数
+LOGIN_IP_RATE_PER_MINUTE = float(os.getenv("LOGIN_IP_RATE_PER_MINUTE", "30"))
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "10"))
+LOGIN_USER_RATE_PER_MINUTE = float(os.getenv("LOGIN_USER_RATE_PER_MINUTE", "5"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "5"))
+
+# 回数制限のために覚えておく IP・メールアドレスの数（プロセスごと）
+LOGIN_LIMITER_MAX_KEYS = int(os.getenv("LOGIN_LIMITER_MAX_KEYS", "100000"))
+
+# アプリの前にいるリバースプロキシの段数（Render なら 1）。X-Forwarded-For を何段まで信頼するか。
+# 0 なら信頼しない（プロキシなしで 1 以上にすると、利用者が IP を偽って回数制限を逃れられる）
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
 # ============================================================
 # 設定内容の確認（デバッグ用）
 # ============================================================
@@ -68,7 +290,9 @@ if __name__ == "__main__":
     print("現在の設定値")
     print("=" * 50)
     print(f"DATABASE_URL: {DATABASE_URL[:30]}...")
+    print(f"DB_PROFILE: {DB_PROFILE}")
     print(f"JWT_SECRET_KEY: {'*' * len(JWT_SECRET_KEY)}")
     print(f"PRICE_PER_MINUTE_CENTS: {PRICE_PER_MINUTE_CENTS}円/分")
     print(f"RENTAL_DEPOSIT_CENTS: {RENTAL_DEPOSIT_CENTS}円")
+    print(f"PBKDF2_ROUNDS: {PBKDF2_ROUNDS}")
     print(f"DEBUG_MODE: {DEBUG_MODE}")